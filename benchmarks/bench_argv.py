@@ -0,0 +1,96 @@
+"""Compare shell and argument-vector command execution.
+
+Runs a full git release (commit, tag, egg_info, sdist; no upload) of the
+test package a number of times, first with every command routed through
+/bin/sh, then with argument vectors passed straight to Popen.
+
+Usage: bench_argv.py [rounds]
+"""
+
+import sys
+import os
+import time
+import pipes
+import shutil
+import tempfile
+import zipfile
+import subprocess
+
+from os.path import join, dirname
+
+from jarn.mkrelease import tee
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.mkrelease import ReleaseMaker
+
+PACKAGE = join(dirname(__file__), '..', 'jarn', 'mkrelease', 'tests', 'testpackage.git.zip')
+
+# Recent setuptools no longer knows --no-svn-revision
+INFOFLAGS = ['--no-date', '--tag-build=']
+
+
+class CountingPopen(object):
+    """Wrap Popen, counting exec'd programs."""
+
+    def __init__(self, shell):
+        self.shell = shell
+        self.execs = 0
+
+    def __call__(self, cmd, **kw):
+        if self.shell and not isinstance(cmd, basestring):
+            cmd = ' '.join(pipes.quote(x) for x in cmd)
+        if isinstance(cmd, basestring):
+            kw['shell'] = True
+            self.execs += 2     # /bin/sh plus the actual binary
+        else:
+            kw['shell'] = False
+            self.execs += 1
+        return subprocess.Popen(cmd, **kw)
+
+
+def setup():
+    tempdir = tempfile.mkdtemp()
+    zipfile.ZipFile(PACKAGE).extractall(tempdir)
+    sandbox = join(tempdir, 'testpackage')
+    os.rename(join(tempdir, 'testpackage.git'), sandbox)
+    return tempdir, sandbox
+
+
+def release(sandbox):
+    saved = sys.stdout
+    sys.stdout = open(os.devnull, 'wt')
+    try:
+        maker = ReleaseMaker(['-S', '-q', sandbox])
+        maker.infoflags = INFOFLAGS
+        maker.run()
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved
+    Process(quiet=True).system(['git', '--git-dir', join(sandbox, '.git'), 'tag', '-d', '2.6'])
+
+
+def bench(shell, rounds):
+    tempdir, sandbox = setup()
+    try:
+        popen = CountingPopen(shell)
+        tee.Popen = popen
+        try:
+            start = time.time()
+            for i in range(rounds):
+                release(sandbox)
+            elapsed = time.time() - start
+        finally:
+            tee.Popen = subprocess.Popen
+        return elapsed / rounds, popen.execs / rounds
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def main(rounds=5):
+    for shell in (True, False):
+        elapsed, execs = bench(shell, rounds)
+        print '%-6s %3d execs per release  %7.1f ms per release' % (
+            'shell' if shell else 'argv', execs, elapsed * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,84 @@
+"""Compare Mercurial processes with a Mercurial command server.
+
+Runs the read-only queries ReleaseMaker makes on a Mercurial sandbox
+'count' times
+
+- with a new hg process per query, and
+- through one command server (CommandServerProcess).
+
+The time to start the command server is included.
+
+Usage: bench_cmdserver.py [count] [rounds]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+from os.path import join
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.cmdserver import CommandServerProcess
+from jarn.mkrelease.scm import Mercurial
+
+
+def setup_hg(tempdir):
+    dir = join(tempdir, 'hg')
+    process = Process(quiet=True)
+    process.system(['hg', 'init', dir])
+    with open(join(dir, 'setup.py'), 'wt') as file:
+        file.write('#\n')
+    process.system(['hg', 'commit', '-q', '-A', '-m', 'Initial', '-u', 'bench'], cwd=dir)
+    with open(join(dir, '.hg', 'hgrc'), 'wt') as file:
+        file.write('[paths]\ndefault = %s\n' % dir)
+    return dir
+
+
+def queries(process, dir, count):
+    scm = Mercurial(process)
+    for i in range(count):
+        scm.is_valid_sandbox(dir)
+        scm.get_status_from_sandbox(dir)
+        scm.get_root_from_sandbox(dir)
+        scm.get_url_from_sandbox(dir)
+        scm.tag_exists(dir, '1.0')
+
+
+def before(dir, count):
+    queries(Process(quiet=True), dir, count)
+
+
+def after(dir, count):
+    process = CommandServerProcess(quiet=True)
+    try:
+        queries(process, dir, count)
+    finally:
+        process.close()
+
+
+def bench(func, dir, count, rounds):
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        func(dir, count)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(count=5, rounds=3):
+    tempdir = tempfile.mkdtemp()
+    try:
+        dir = setup_hg(tempdir)
+        # get_url_from_sandbox also asks for the branch
+        print '%d x 6 queries' % count
+        for method, func in (('before', before), ('after', after)):
+            elapsed = bench(func, dir, count, rounds)
+            print '%-7s %8.1f ms' % (method, elapsed * 1000)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
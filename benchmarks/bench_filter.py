@@ -0,0 +1,61 @@
+"""Compare the per-line cost of tee filters.
+
+Feeds the output of a large 'setup.py sdist' run through the filters
+setuptools uses, once as nested filter objects and once compiled with
+tee.compile_filter.
+
+Usage: bench_filter.py [lines] [rounds]
+"""
+
+import sys
+import time
+
+from jarn.mkrelease.tee import compile_filter
+from jarn.mkrelease.tee import After, And, Or, Not
+from jarn.mkrelease.tee import StartsWith, EndsWith, Equals
+
+
+def make_lines(count):
+    lines = ['running egg_info', 'writing manifest file \'foo.egg-info/SOURCES.txt\'',
+             'running sdist']
+    for i in xrange(count):
+        if i % 100 == 0:
+            lines.append('creating testpackage-2.6/testpackage/sub%d' % i)
+        lines.append('adding \'testpackage-2.6/testpackage/module%d.py\'' % i)
+    lines.append('creating \'dist/testpackage-2.6.tar.gz\' and adding \'testpackage-2.6\' to it')
+    lines.append('running upload')
+    return lines
+
+
+def bench(make_filter, lines, rounds):
+    best = None
+    for i in range(rounds):
+        filter = make_filter()
+        start = time.time()
+        for line in lines:
+            filter(line)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(count=100000, rounds=5):
+    lines = make_lines(count)
+
+    filters = (
+        ('quiet build', lambda: And(After('running sdist'), StartsWith('running'))),
+        ('stateless', lambda: Or(And(StartsWith('creating', 'running'), Not(EndsWith('.py'))),
+                                 Equals('running upload'))),
+        ('capture', lambda: Or(StartsWith("creating '"), StartsWith("writing manifest file '"))),
+    )
+
+    print '%d lines' % len(lines)
+    for name, make_filter in filters:
+        plain = bench(make_filter, lines, rounds)
+        compiled = bench(lambda: compile_filter(make_filter()), lines, rounds)
+        print '%-12s objects %6.1f ms  compiled %6.1f ms  %5.0f ns/line saved' % (
+            name, plain * 1000, compiled * 1000, (plain - compiled) / len(lines) * 1e9)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
@@ -0,0 +1,78 @@
+"""Compare detecting and describing a Mercurial sandbox.
+
+Asks whether a directory is a Mercurial sandbox and for its root,
+branch, and default path 'count' times
+
+- by running hg for each question, and
+- with HgReader, which reads the answers from .hg.
+
+Also prints the number of commands run.
+
+Usage: bench_hgreader.py [count] [rounds]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+from os.path import join
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.ledger import Ledger
+from jarn.mkrelease.scm import Mercurial
+from jarn.mkrelease.testing import NullReader
+
+
+def setup_hg(tempdir):
+    dir = join(tempdir, 'hg')
+    process = Process(quiet=True)
+    process.system(['hg', 'init', dir])
+    with open(join(dir, '.hg', 'hgrc'), 'wt') as file:
+        file.write('[paths]\ndefault = ssh://hg@example.com/foo\n')
+    return dir
+
+
+def describe(scm, dir, count):
+    for i in range(count):
+        scm.is_valid_sandbox(dir)
+        scm.get_root_from_sandbox(dir)
+        scm.get_branch_from_sandbox(dir)
+        scm.get_url_from_sandbox(dir)
+
+
+def before(dir, count):
+    describe(Mercurial(Process(quiet=True), reader=NullReader()), dir, count)
+
+
+def after(dir, count):
+    describe(Mercurial(Process(quiet=True)), dir, count)
+
+
+def bench(func, dir, count, rounds):
+    best = None
+    for i in range(rounds):
+        Process.ledger = Ledger()
+        start = time.time()
+        func(dir, count)
+        elapsed = time.time() - start
+        commands = len(Process.ledger)
+        Process.ledger = None
+        best = elapsed if best is None else min(best, elapsed)
+    return best, commands
+
+
+def main(count=5, rounds=3):
+    tempdir = tempfile.mkdtemp()
+    try:
+        dir = setup_hg(tempdir)
+        print '%d x 4 queries' % count
+        for method, func in (('before', before), ('after', after)):
+            elapsed, commands = bench(func, dir, count, rounds)
+            print '%-7s %8.1f ms %4d commands' % (method, elapsed * 1000, commands)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
@@ -0,0 +1,81 @@
+"""Compare tag lookups in a git repository with many tags.
+
+Creates a repository holding 'count' tags (written to packed-refs)
+and looks up the first tag, the last tag, and a missing tag
+
+- by reading all of 'git tag' and scanning the lines, and
+- with Process.query, which stops at the first matching line.
+
+Usage: bench_query.py [count] [rounds]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+from os.path import join
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.tee import Equals
+from jarn.mkrelease.chdir import ChdirStack
+
+
+def setup(count):
+    tempdir = tempfile.mkdtemp()
+    process = Process(quiet=True)
+    dirstack = ChdirStack()
+    dirstack.push(tempdir)
+    try:
+        process.system(['git', 'init', '-q'])
+        process.system(['git', 'commit', '-q', '--allow-empty', '-m', 'Initial'])
+        sha = process.pipe(['git', 'rev-parse', 'HEAD'])
+    finally:
+        dirstack.pop()
+    with open(join(tempdir, '.git', 'packed-refs'), 'wt') as file:
+        file.write('# pack-refs with: peeled fully-peeled sorted \n')
+        for i in xrange(count):
+            file.write('%s refs/tags/%d.%d\n' % (sha, i // 1000, i % 1000))
+    return tempdir
+
+
+def scan(process, tagid):
+    rc, lines = process.popen(['git', 'tag'], echo=False)
+    return tagid in lines
+
+
+def query(process, tagid):
+    rc, line = process.query(['git', 'tag'], Equals(tagid))
+    return line is not None
+
+
+def bench(func, process, tagid, rounds):
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        func(process, tagid)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(count=50000, rounds=5):
+    tempdir = setup(count)
+    process = Process(quiet=True)
+    dirstack = ChdirStack()
+    dirstack.push(tempdir)
+    try:
+        # git tag sorts by name
+        tags = sorted('%d.%d' % (i // 1000, i % 1000) for i in xrange(count))
+        print '%d tags' % count
+        for name, tagid in (('first', tags[0]), ('last', tags[-1]), ('missing', 'x')):
+            for label, func in (('scan', scan), ('query', query)):
+                elapsed = bench(func, process, tagid, rounds)
+                print '%-8s %-6s %7.1f ms' % (name, label, elapsed * 1000)
+    finally:
+        dirstack.pop()
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
@@ -0,0 +1,94 @@
+"""Measure the Python overhead of a release.
+
+Records a full git release (commit, tag, egg_info, sdist; no upload) of
+the test package once, then replays it a number of times from the
+cassette. No git or setup.py processes run during replay, so the timings
+cover option parsing, location resolution, reading .git, tee filtering,
+and result parsing only.
+
+Usage: bench_replay.py [rounds] [--profile]
+"""
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import zipfile
+import cProfile
+import pstats
+
+from os.path import join, dirname
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.cassette import Cassette
+from jarn.mkrelease.mkrelease import ReleaseMaker
+
+PACKAGE = join(dirname(__file__), '..', 'jarn', 'mkrelease', 'tests', 'testpackage.git.zip')
+
+# Recent setuptools no longer knows --no-svn-revision
+INFOFLAGS = ['--no-date', '--tag-build=']
+
+
+def setup():
+    tempdir = tempfile.mkdtemp()
+    zipfile.ZipFile(PACKAGE).extractall(tempdir)
+    sandbox = join(tempdir, 'testpackage')
+    os.rename(join(tempdir, 'testpackage.git'), sandbox)
+    return tempdir, sandbox
+
+
+def release(sandbox):
+    saved = sys.stdout
+    sys.stdout = open(os.devnull, 'wt')
+    try:
+        maker = ReleaseMaker(['-S', '-q', sandbox])
+        maker.infoflags = INFOFLAGS
+        maker.run()
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved
+
+
+def main(rounds=100, profile=False):
+    tempdir, sandbox = setup()
+    try:
+        filename = join(tempdir, 'cassette.json')
+
+        pristine = join(tempdir, 'pristine.git')
+        shutil.copytree(join(sandbox, '.git'), pristine)
+
+        Process.cassette = Cassette(filename, 'record')
+        start = time.time()
+        release(sandbox)
+        recorded = time.time() - start
+        Process.cassette.save()
+
+        # Metadata is read from .git; undo the tag
+        shutil.rmtree(join(sandbox, '.git'))
+        shutil.copytree(pristine, join(sandbox, '.git'))
+
+        Process.cassette = cassette = Cassette(filename)
+        profiler = cProfile.Profile() if profile else None
+        start = time.time()
+        for i in range(rounds):
+            cassette.rewind()
+            if profiler is not None:
+                profiler.runcall(release, sandbox)
+            else:
+                release(sandbox)
+        replayed = (time.time() - start) / rounds
+        Process.cassette = None
+
+        print 'recorded %3d commands  %8.2f ms per release' % (len(cassette.entries), recorded * 1000)
+        print 'replayed %3d rounds    %8.2f ms per release' % (rounds, replayed * 1000)
+
+        if profiler is not None:
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    args = [x for x in sys.argv[1:] if x != '--profile']
+    main(*[int(x) for x in args[:1]], profile='--profile' in sys.argv)
@@ -0,0 +1,89 @@
+"""Compare detecting the SCM of a sandbox.
+
+Detects the SCM of a Git and of a Mercurial sandbox 'count' times
+
+- by asking every SCM binary (scan),
+- by asking every SCM with its reader (readers), and
+- by walking up to the closest .svn, .hg, or .git marker (markers).
+
+Also prints the number of commands run.
+
+Usage: bench_scmfactory.py [count] [rounds]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+from os.path import join
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.ledger import Ledger
+from jarn.mkrelease.scm import SCMFactory, Subversion, Mercurial, Git
+from jarn.mkrelease.testing import NullReader
+
+
+def without_reader(klass):
+    class scm(klass):
+        def __init__(self, process=None, urlparser=None):
+            klass.__init__(self, process, urlparser, reader=NullReader())
+    return scm
+
+
+class ReaderFactory(SCMFactory):
+
+    def _find_marked_scm(self, dir):
+        return None
+
+
+class ScanFactory(ReaderFactory):
+
+    scms = tuple([without_reader(x) for x in (Subversion, Mercurial, Git)])
+
+
+def setup_sandboxes(tempdir):
+    dirs = []
+    process = Process(quiet=True)
+    for name in ('git', 'hg'):
+        dir = join(tempdir, name)
+        process.system([name, 'init', '-q', dir])
+        dirs.append(dir)
+    return dirs
+
+
+def detect(factory, dirs, count):
+    for i in range(count):
+        for dir in dirs:
+            factory.get_scm_from_sandbox(dir)
+
+
+def bench(factory, dirs, count, rounds):
+    best = None
+    for i in range(rounds):
+        Process.ledger = Ledger()
+        start = time.time()
+        detect(factory, dirs, count)
+        elapsed = time.time() - start
+        commands = len(Process.ledger)
+        Process.ledger = None
+        best = elapsed if best is None else min(best, elapsed)
+    return best, commands
+
+
+def main(count=5, rounds=3):
+    tempdir = tempfile.mkdtemp()
+    try:
+        dirs = setup_sandboxes(tempdir)
+        print '%d x 2 detections' % count
+        for method, factory in (('scan', ScanFactory()),
+                                ('readers', ReaderFactory()),
+                                ('markers', SCMFactory())):
+            elapsed, commands = bench(factory, dirs, count, rounds)
+            print '%-7s %8.1f ms %4d commands' % (method, elapsed * 1000, commands)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
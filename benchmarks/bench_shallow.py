@@ -0,0 +1,126 @@
+"""Compare full and minimal checkouts of repositories with long histories.
+
+Creates a git and a Mercurial repository with 'count' commits, each
+rewriting a data file, and checks out the master/default branch from
+a file:// URL. A second Mercurial repository keeps the 'count'
+commits on another named branch.
+
+- with clone_url followed by switch_branch, as mkrelease does by
+  default, and
+- with shallow_clone_url, as mkrelease does with --shallow.
+
+Prints the best time of 'rounds' runs and the size of the checkout.
+
+Usage: bench_shallow.py [count] [rounds]
+"""
+
+import os
+import sys
+import time
+import shutil
+import random
+import tempfile
+
+from os.path import join
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.scm import Git, Mercurial
+
+FILESIZE = 20000
+
+
+def make_data(rnd):
+    return '%0*x' % (FILESIZE, rnd.getrandbits(FILESIZE * 4))
+
+
+def setup_git(tempdir, count):
+    dir = join(tempdir, 'git')
+    process = Process(quiet=True)
+    process.system(['git', 'init', '-q', dir])
+    rnd = random.Random(0)
+    stream = []
+    for i in xrange(count):
+        data = make_data(rnd)
+        message = 'Commit %d' % i
+        stream.append('commit refs/heads/master\n')
+        stream.append('committer Bench <bench@example.com> %d +0000\n' % (1000000000 + i))
+        stream.append('data %d\n%s\n' % (len(message), message))
+        stream.append('M 644 inline data.txt\ndata %d\n%s\n' % (len(data), data))
+    process.popen('git fast-import --quiet < %s' % write_stream(tempdir, stream), echo=False, cwd=dir)
+    process.system(['git', 'checkout', '-q', '-f', 'master'], cwd=dir)
+    process.system(['git', 'gc', '-q'], cwd=dir)
+    return 'file://' + dir
+
+
+def write_stream(tempdir, stream):
+    filename = join(tempdir, 'fast-import')
+    with open(filename, 'wb') as file:
+        file.write(''.join(stream))
+    return filename
+
+
+def setup_hg(tempdir, count, dag='+%(count)d'):
+    dir = join(tempdir, 'hg')
+    process = Process(quiet=True)
+    process.system(['hg', 'init', dir])
+    process.system(['hg', 'debugbuilddag', '--overwritten-file', dag % locals()], cwd=dir)
+    process.system(['hg', 'update', '-q', 'default'], cwd=dir)
+    return 'file://' + dir
+
+
+def setup_hg_branches(tempdir, count):
+    # Most of the history is on another named branch
+    return setup_hg(tempdir, count, '+10:base @other +%(count)d @default <base +10')
+
+
+def full(scm, url, dir, branch):
+    scm.clone_url(url, dir)
+    scm.switch_branch(dir, branch)
+
+
+def shallow(scm, url, dir, branch):
+    scm.shallow_clone_url(url, dir, branch)
+
+
+def get_size(dir):
+    size = 0
+    for path, dirs, files in os.walk(dir):
+        for name in files:
+            size += os.lstat(join(path, name)).st_size
+    return size
+
+
+def bench(func, scm, url, branch, tempdir, rounds):
+    best = None
+    for i in range(rounds):
+        dir = join(tempdir, 'build')
+        start = time.time()
+        func(scm, url, dir, branch)
+        elapsed = time.time() - start
+        size = get_size(dir)
+        shutil.rmtree(dir)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+
+def main(count=2000, rounds=3):
+    tempdir = tempfile.mkdtemp()
+    try:
+        print '%d commits' % count
+        for label, setup, scm, branch in (
+            ('git', setup_git, Git(Process(quiet=True)), 'master'),
+            ('hg', setup_hg, Mercurial(Process(quiet=True)), 'default'),
+            ('hg2', setup_hg_branches, Mercurial(Process(quiet=True)), 'default'),
+        ):
+            url = setup(tempdir, count)
+            dir = url[len('file://'):]
+            for method, func in (('full', full), ('shallow', shallow)):
+                elapsed, size = bench(func, scm, url, branch, tempdir, rounds)
+                print '%-4s %-8s %8.1f ms %8.1f MB' % (label, method, elapsed * 1000, size / 1e6)
+            shutil.rmtree(dir)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
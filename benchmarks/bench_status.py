@@ -0,0 +1,112 @@
+"""Compare dirty and unclean checks in a sandbox with many files.
+
+Creates a git and a Mercurial sandbox holding 'count' files and asks
+whether the sandbox is dirty and unclean, as ReleaseMaker does
+
+- with one status scan per question, as mkrelease used to, and
+- with SCM.get_status_from_sandbox, which answers both from one scan.
+
+Runs on a clean sandbox and on one with a modified file.
+
+Usage: bench_status.py [count] [rounds]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from os.path import join
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.scm import Git, Mercurial
+from jarn.mkrelease.memo import Memo
+from jarn.mkrelease.testing import NullReader
+
+PERDIR = 1000
+
+
+def make_files(dir, count):
+    for i in xrange(count):
+        subdir = join(dir, 'd%03d' % (i // PERDIR))
+        if i % PERDIR == 0:
+            os.makedirs(subdir)
+        with open(join(subdir, 'f%04d.txt' % (i % PERDIR)), 'wt') as file:
+            file.write('%d\n' % i)
+
+
+def setup_git(tempdir, count):
+    dir = join(tempdir, 'git')
+    process = Process(quiet=True)
+    process.system(['git', 'init', '-q', dir])
+    make_files(dir, count)
+    process.system(['git', 'add', '.'], cwd=dir)
+    # No background gc racing the final rmtree
+    process.system(['git', '-c', 'gc.auto=0', 'commit', '-q', '-m', 'Initial'], cwd=dir)
+    return dir
+
+
+def setup_hg(tempdir, count):
+    dir = join(tempdir, 'hg')
+    process = Process(quiet=True)
+    process.system(['hg', 'init', dir])
+    make_files(dir, count)
+    process.system(['hg', 'commit', '-q', '-A', '-m', 'Initial', '-u', 'bench'], cwd=dir)
+    return dir
+
+
+def git_before(dir):
+    process = Process(quiet=True)
+    for i in range(2):
+        process.popen(['git', 'status', '--porcelain', '--untracked-files=no', '.'],
+                      echo=False, cwd=dir)
+
+
+def hg_before(dir):
+    process = Process(quiet=True)
+    process.popen(['hg', 'status', '-mar', '.'], echo=False, cwd=dir)
+    process.popen(['hg', 'status', '-mard', '.'], echo=False, cwd=dir)
+
+
+def after(scm):
+    def func(dir):
+        scm.memo = Memo()
+        scm.is_dirty_sandbox(dir)
+        scm.is_unclean_sandbox(dir)
+    return func
+
+
+def bench(func, dir, rounds):
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        func(dir)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(count=100000, rounds=3):
+    tempdir = tempfile.mkdtemp()
+    try:
+        print '%d files' % count
+        for label, setup, before, scm in (
+            ('git', setup_git, git_before, Git(Process(quiet=True), reader=NullReader())),
+            ('hg', setup_hg, hg_before, Mercurial(Process(quiet=True))),
+        ):
+            dir = setup(tempdir, count)
+            for state in ('clean', 'dirty'):
+                if state == 'dirty':
+                    with open(join(dir, 'd000', 'f0000.txt'), 'at') as file:
+                        file.write('dirty\n')
+                for method, func in (('before', before), ('after', after(scm))):
+                    elapsed = bench(func, dir, rounds)
+                    print '%-4s %-6s %-7s %8.1f ms' % (label, state, method, elapsed * 1000)
+            shutil.rmtree(dir)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
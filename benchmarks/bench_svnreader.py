@@ -0,0 +1,77 @@
+"""Compare describing a Subversion 1.7+ working copy.
+
+Asks for the URL and the root of a working copy and of a directory
+inside it 'count' times
+
+- by running 'svn info' for each question (and per level for the
+  root), and
+- with SvnReader, which reads the answers from .svn/wc.db.
+
+Usage: bench_svnreader.py [count] [rounds]
+"""
+
+import sys
+import time
+import shutil
+import zipfile
+import tempfile
+
+from os.path import join, dirname
+
+import jarn.mkrelease.tests
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.scm import Subversion
+from jarn.mkrelease.memo import Memo
+from jarn.mkrelease.testing import NullReader
+
+SOURCE = 'testpackage.svn17.zip'
+
+
+def setup_svn(tempdir):
+    package = join(dirname(jarn.mkrelease.tests.__file__), SOURCE)
+    archive = zipfile.ZipFile(package, 'r')
+    archive.extractall(tempdir)
+    return join(tempdir, SOURCE[:-4])
+
+
+def describe(scm, dir, count):
+    for i in range(count):
+        scm.memo = Memo()
+        for path in (dir, join(dir, 'testpackage')):
+            scm.get_url_from_sandbox(path)
+            scm.get_root_from_sandbox(path)
+
+
+def before(dir, count):
+    describe(Subversion(Process(quiet=True), reader=NullReader()), dir, count)
+
+
+def after(dir, count):
+    describe(Subversion(Process(quiet=True)), dir, count)
+
+
+def bench(func, dir, count, rounds):
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        func(dir, count)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(count=5, rounds=3):
+    tempdir = tempfile.mkdtemp()
+    try:
+        dir = setup_svn(tempdir)
+        print '%d x 4 queries' % count
+        for method, func in (('before', before), ('after', after)):
+            elapsed = bench(func, dir, count, rounds)
+            print '%-7s %8.1f ms' % (method, elapsed * 1000)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
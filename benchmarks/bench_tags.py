@@ -0,0 +1,122 @@
+"""Compare tag existence checks in repositories with many tags.
+
+Creates a git and a Mercurial repository holding 'count' tags and
+looks up the last tag and a missing tag
+
+- by listing all tags ('git tag', 'hg tags') and scanning the lines,
+- with Git.tag_exists and Mercurial.tag_exists,
+- for git, with Git.tag_exists not using the GitReader, and
+- for hg, with Mercurial.tag_exists using a TagIndex (the first
+  round builds the index).
+
+Usage: bench_tags.py [count] [rounds]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+from os.path import join
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.scm import Git, Mercurial
+from jarn.mkrelease.tee import Equals
+from jarn.mkrelease.tagindex import TagIndex
+from jarn.mkrelease.testing import NullReader
+
+
+def make_tags(count):
+    return ['%d.%d' % (i // 1000, i % 1000) for i in xrange(count)]
+
+
+def setup_git(tempdir, tags):
+    dir = join(tempdir, 'git')
+    process = Process(quiet=True)
+    process.system(['git', 'init', '-q', dir])
+    process.system(['git', 'commit', '-q', '--allow-empty', '-m', 'Initial'], cwd=dir)
+    sha = process.pipe(['git', 'rev-parse', 'HEAD'], cwd=dir)
+    with open(join(dir, '.git', 'packed-refs'), 'wt') as file:
+        file.write('# pack-refs with: peeled fully-peeled sorted \n')
+        for tagid in sorted(tags):
+            file.write('%s refs/tags/%s\n' % (sha, tagid))
+    return dir
+
+
+def setup_hg(tempdir, tags):
+    dir = join(tempdir, 'hg')
+    process = Process(quiet=True)
+    process.system(['hg', 'init', dir])
+    with open(join(dir, 'README'), 'wt') as file:
+        file.write('README\n')
+    process.system(['hg', 'commit', '-q', '-A', '-m', 'Initial', '-u', 'bench'], cwd=dir)
+    node = process.pipe(['hg', 'log', '-r', '.', '--template', '{node}'], cwd=dir)
+    with open(join(dir, '.hgtags'), 'wt') as file:
+        for tagid in tags:
+            file.write('%s %s\n' % (node, tagid))
+    process.system(['hg', 'commit', '-q', '-A', '-m', 'Tags', '-u', 'bench'], cwd=dir)
+    # Warm up the tags cache
+    process.popen(['hg', 'tags'], echo=False, cwd=dir)
+    return dir
+
+
+def git_scan(dir, tagid):
+    rc, line = Process(quiet=True).query(['git', 'tag'], Equals(tagid), cwd=dir)
+    return line is not None
+
+
+def git_probe(dir, tagid):
+    return Git(Process(quiet=True), reader=NullReader()).tag_exists(dir, tagid)
+
+
+def git_reader(dir, tagid):
+    return Git(Process(quiet=True)).tag_exists(dir, tagid)
+
+
+def hg_scan(dir, tagid):
+    rc, line = Process(quiet=True).query(
+        ['hg', 'tags'], lambda line: line.split()[:1] == [tagid], cwd=dir)
+    return line is not None
+
+
+def hg_probe(dir, tagid):
+    return Mercurial(Process(quiet=True)).tag_exists(dir, tagid)
+
+
+def hg_index(dir, tagid):
+    scm = Mercurial(Process(quiet=True))
+    scm.tagindex = TagIndex(join(dir, '.index'))
+    return scm.tag_exists(dir, tagid)
+
+
+def bench(func, dir, tagid, rounds):
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        func(dir, tagid)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(count=50000, rounds=5):
+    tempdir = tempfile.mkdtemp()
+    try:
+        tags = make_tags(count)
+        last = sorted(tags)[-1]
+        print '%d tags' % count
+        for label, setup, funcs in (
+            ('git', setup_git, (('scan', git_scan), ('probe', git_probe), ('reader', git_reader))),
+            ('hg', setup_hg, (('scan', hg_scan), ('probe', hg_probe), ('index', hg_index))),
+        ):
+            dir = setup(tempdir, tags)
+            for name, tagid in (('last', last), ('missing', 'x')):
+                for method, func in funcs:
+                    elapsed = bench(func, dir, tagid, rounds)
+                    print '%-4s %-8s %-7s %8.1f ms' % (label, name, method, elapsed * 1000)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
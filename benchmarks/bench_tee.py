@@ -0,0 +1,116 @@
+"""Compare tee throughput on large outputs.
+
+Runs a child printing 100k lines and reads its output with
+
+- the former readline loop (stdout in the main thread, stderr
+  in a helper thread, polling for exit), and
+- the current chunked os.read loop.
+
+Each variant is measured with echo off, with all lines echoed
+(to /dev/null), and with the filter setuptools uses with -q.
+
+Usage: bench_tee.py [lines] [rounds]
+"""
+
+import sys
+import os
+import time
+import threading
+
+from subprocess import Popen, PIPE
+
+from jarn.mkrelease import tee
+from jarn.mkrelease.tee import On, Off, After, And, StartsWith
+
+
+def readline_tee(process, filter):
+    lines = []
+    while True:
+        line = process.stdout.readline()
+        if line:
+            stripped_line = line.rstrip()
+            if filter(stripped_line):
+                sys.stdout.write(line)
+            lines.append(stripped_line)
+        elif process.poll() is not None:
+            break
+    return lines
+
+
+def readline_tee2(process, filter):
+    while True:
+        line = process.stderr.readline()
+        if line:
+            stripped_line = line.rstrip()
+            if filter(stripped_line):
+                sys.stderr.write(line)
+        elif process.poll() is not None:
+            break
+
+
+def readline_popen(cmd, echo, echo2):
+    process = Popen(cmd, stdout=PIPE, stderr=PIPE)
+    t = threading.Thread(target=readline_tee2, args=(process, echo2))
+    t.start()
+    lines = readline_tee(process, echo)
+    t.join()
+    return process.returncode, lines
+
+
+def chunked_popen(cmd, echo, echo2):
+    return tee.popen(cmd, echo, echo2)
+
+
+def make_cmd(count):
+    script = ('import sys\n'
+              'sys.stdout.write("running sdist\\n")\n'
+              'for i in xrange(%d):\n'
+              '    sys.stdout.write("adding \'testpackage-2.6/testpackage/module%%d.py\'\\n" %% i)\n'
+              % count)
+    return [sys.executable, '-c', script]
+
+
+def bench(popen, cmd, echo, rounds):
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        rc, lines = popen(cmd, echo(), Off())
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(lines)
+
+
+def main(count=100000, rounds=5):
+    cmd = make_cmd(count)
+
+    # The child's own run time, for reference
+    start = time.time()
+    Popen(cmd, stdout=open(os.devnull, 'wb')).wait()
+    baseline = time.time() - start
+
+    echos = (
+        ('echo off', Off),
+        ('echo on', On),
+        ('filtered', lambda: And(After('running sdist'), StartsWith('running'))),
+    )
+
+    saved = sys.stdout
+    sys.stdout = open(os.devnull, 'wt')
+    try:
+        results = []
+        for name, echo in echos:
+            for label, popen in (('readline', readline_popen), ('chunked', chunked_popen)):
+                elapsed, lines = bench(popen, cmd, echo, rounds)
+                results.append((name, label, elapsed, lines))
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved
+
+    print 'child alone: %.1f ms' % (baseline * 1000)
+    for name, label, elapsed, lines in results:
+        print '%-9s %-9s %7.1f ms  %9.0f lines/s' % (
+            name, label, elapsed * 1000, lines / elapsed)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
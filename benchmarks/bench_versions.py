@@ -0,0 +1,57 @@
+"""Compare determining SCM binary versions.
+
+Asks fresh Git and Mercurial objects for their version 'count' times
+
+- by running 'git --version' and 'hg --version' each time, and
+- with a VersionCache, which runs them once per binary.
+
+Also prints the number of commands run.
+
+Usage: bench_versions.py [count] [rounds]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.ledger import Ledger
+from jarn.mkrelease.scm import Mercurial, Git
+from jarn.mkrelease.versioncache import VersionCache
+
+
+def ask(cache, count):
+    for i in range(count):
+        for klass in (Git, Mercurial):
+            scm = klass(Process(quiet=True))
+            scm.versioncache = cache
+            scm.version_info
+
+
+def bench(cache, count, rounds):
+    best = None
+    for i in range(rounds):
+        Process.ledger = Ledger()
+        start = time.time()
+        ask(cache, count)
+        elapsed = time.time() - start
+        commands = len(Process.ledger)
+        Process.ledger = None
+        best = elapsed if best is None else min(best, elapsed)
+    return best, commands
+
+
+def main(count=5, rounds=3):
+    tempdir = tempfile.mkdtemp()
+    try:
+        print '%d x 2 versions' % count
+        for method, cache in (('before', None), ('after', VersionCache(tempdir))):
+            elapsed, commands = bench(cache, count, rounds)
+            print '%-7s %8.1f ms %4d commands' % (method, elapsed * 1000, commands)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
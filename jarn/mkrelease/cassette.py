@@ -0,0 +1,101 @@
+import os
+import json
+
+from collections import deque
+from os.path import abspath
+
+import tee
+
+
+class CassetteError(Exception):
+    """Raised when a command cannot be replayed."""
+
+
+class Cassette(object):
+    """Record commands to a file or replay them from it.
+
+    In 'record' mode commands are executed and their output and exit
+    codes are kept. Call save() to write them to 'filename'.
+
+    In 'replay' mode commands are not executed. Their recorded output
+    is fed through the tee filters and the recorded exit code is
+    returned. Commands are matched by argument vector and working
+    directory; a command recorded several times is replayed in order.
+
+    Install a cassette by assigning it to Process.cassette.
+    """
+
+    def __init__(self, filename, mode='replay'):
+        if mode not in ('record', 'replay'):
+            raise ValueError('Bad cassette mode: %s' % mode)
+        self.filename = filename
+        self.mode = mode
+        self.entries = []
+        self.queues = {}
+        if mode == 'replay':
+            self.load()
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    def key(self, cmd, cwd):
+        if not isinstance(cmd, basestring):
+            cmd = tuple(cmd)
+        return cmd, cwd
+
+    def load(self):
+        with open(self.filename, 'rt') as file:
+            self.entries = decode(json.load(file))
+        self.rewind()
+
+    def save(self):
+        # Latin-1 maps bytes to code points one-to-one
+        with open(self.filename, 'wt') as file:
+            json.dump(self.entries, file, indent=1, encoding='latin-1')
+
+    def rewind(self):
+        """Start replaying from the beginning."""
+        self.queues = {}
+        for entry in self.entries:
+            key = self.key(entry['cmd'], entry['cwd'])
+            self.queues.setdefault(key, deque()).append(entry)
+
+    def spawn(self, cmd, echo=True, echo2=True, env=None, capture=None, cwd=None):
+        """Return a tee.Child for 'cmd'."""
+        if self.recording:
+            stdout, stderr = [], []
+            child = tee.spawn(cmd, tee.Tap(echo, stdout), tee.Tap(echo2, stderr), env, capture, cwd)
+            child.tape = stdout, stderr
+            return child
+
+        cwd = abspath(cwd) if cwd else os.getcwd()
+        queue = self.queues.get(self.key(cmd, cwd))
+        if not queue:
+            raise CassetteError('Not recorded: %r in %s' % (cmd, cwd))
+        entry = queue.popleft()
+        return tee.play(cmd, entry['returncode'], entry['stdout'], entry['stderr'],
+                        echo, echo2, capture, cwd)
+
+    def add(self, child):
+        """Keep the output of a finished tee.Child."""
+        if self.recording:
+            stdout, stderr = child.tape
+            self.entries.append({
+                'cmd': child.cmd,
+                'cwd': child.cwd,
+                'returncode': child.returncode,
+                'stdout': stdout,
+                'stderr': stderr,
+            })
+
+
+def decode(value):
+    """Turn unicode strings loaded from JSON back into byte strings."""
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    if isinstance(value, list):
+        return [decode(x) for x in value]
+    if isinstance(value, dict):
+        return dict((decode(k), decode(v)) for k, v in value.items())
+    return value
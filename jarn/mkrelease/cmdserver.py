@@ -0,0 +1,193 @@
+import os
+import struct
+import time
+
+from os.path import abspath, dirname, isdir, join
+from subprocess import Popen, PIPE
+
+import tee
+
+from process import Process
+
+# Commands talking to other repositories may prompt for credentials
+# and are better run in a process of their own
+LOCAL_ONLY = ('clone', 'init', 'push', 'pull', 'incoming', 'outgoing', 'serve')
+
+
+class CommandServerError(Exception):
+    """Raised when the command server fails."""
+
+
+class CommandServer(object):
+    """A Mercurial command server running in repository 'root'.
+
+    The server is started with 'hg serve --cmdserver pipe' and
+    runs commands without paying for interpreter start-up and
+    extension loading each time.
+    """
+
+    def __init__(self, root, env=None):
+        self.root = root
+        self.env = env
+        self.server = None
+
+    def start(self):
+        with open(os.devnull, 'wb') as devnull:
+            try:
+                self.server = Popen(['hg', 'serve', '--cmdserver', 'pipe'],
+                                    stdin=PIPE, stdout=PIPE, stderr=devnull,
+                                    cwd=self.root, env=self.env, close_fds=True)
+            except OSError, e:
+                raise CommandServerError(str(e))
+        channel, data = self.read()
+        if channel != 'o':
+            self.close()
+            raise CommandServerError('Bad hello message')
+        for line in data.split('\n'):
+            key, sep, value = line.partition(': ')
+            if key == 'capabilities' and 'runcommand' in value.split():
+                return
+        self.close()
+        raise CommandServerError('runcommand not supported')
+
+    def read(self):
+        header = self.server.stdout.read(5)
+        if len(header) != 5:
+            raise CommandServerError('Unexpected end of output')
+        channel, length = struct.unpack('>cI', header)
+        if channel in 'IL':
+            return channel, length
+        data = self.server.stdout.read(length)
+        if len(data) != length:
+            raise CommandServerError('Unexpected end of output')
+        return channel, data
+
+    def write(self, data):
+        self.server.stdin.write(data)
+        self.server.stdin.flush()
+
+    def runcommand(self, args, cwd=None):
+        """Run 'hg args' and return (returncode, stdout, stderr)."""
+        self.send(args, cwd)
+        return self.receive()
+
+    def send(self, args, cwd=None):
+        if cwd is not None:
+            args = ['--cwd', cwd] + list(args)
+        data = '\0'.join(args)
+        try:
+            self.write('runcommand\n' + struct.pack('>I', len(data)) + data)
+        except (IOError, ValueError), e:
+            raise CommandServerError(str(e))
+
+    def receive(self):
+        # Requests for input are answered with end-of-file
+        stdout, stderr = [], []
+        while True:
+            channel, data = self.read()
+            if channel == 'o':
+                stdout.append(data)
+            elif channel == 'e':
+                stderr.append(data)
+            elif channel == 'r':
+                return struct.unpack('>i', data)[0], ''.join(stdout), ''.join(stderr)
+            elif channel in 'IL':
+                self.write(struct.pack('>I', 0))
+            elif channel.isupper():
+                raise CommandServerError('Unsupported channel: %s' % channel)
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.stdin.close()
+            except IOError:
+                pass
+            self.server.wait()
+            self.server = None
+
+
+class CommandServerProcess(Process):
+    """Process related functions sending hg commands to command servers.
+
+    One server is kept per repository and reused for all commands
+    run inside it. Other commands, and hg commands which cannot
+    be served, are run as usual. Call close() to stop the servers.
+    """
+
+    def __init__(self, quiet=False, env=None):
+        Process.__init__(self, quiet, env)
+        self.servers = {}
+
+    def get_server(self, cmd, cwd=None):
+        # Return a running server for 'cmd' or None
+        if self.cassette is not None:
+            return None
+        if isinstance(cmd, basestring) or len(cmd) < 2 or cmd[0] != 'hg':
+            return None
+        if cmd[1].startswith('-') or cmd[1] in LOCAL_ONLY:
+            return None
+        root = find_root(abspath(cwd) if cwd else os.getcwd())
+        if root is None:
+            return None
+        if root not in self.servers:
+            server = CommandServer(root, self.env)
+            try:
+                server.start()
+            except CommandServerError:
+                server = None
+            self.servers[root] = server
+        return self.servers[root]
+
+    def spawn(self, cmd, echo, echo2, capture=None, cwd=None):
+        server = self.get_server(cmd, cwd)
+        if server is not None:
+            cwd = abspath(cwd) if cwd else os.getcwd()
+            start = time.time()
+            try:
+                server.send(cmd[1:], cwd)
+            except CommandServerError:
+                # Not sent; run it the usual way
+                self.drop(server)
+                return Process.spawn(self, cmd, echo, echo2, capture, cwd)
+            try:
+                rc, stdout, stderr = server.receive()
+            except CommandServerError, e:
+                self.drop(server)
+                rc, stdout, stderr = 255, '', 'abort: command server failed: %s\n' % e
+            return tee.play(cmd, rc, splitlines(stdout), splitlines(stderr),
+                            echo, echo2, capture, cwd, start)
+        return Process.spawn(self, cmd, echo, echo2, capture, cwd)
+
+    def drop(self, server):
+        # Stop using a failed server
+        server.close()
+        self.servers[server.root] = None
+
+    def passthrough(self, cmd, cwd=None):
+        if self.get_server(cmd, cwd) is not None:
+            return None
+        return Process.passthrough(self, cmd, cwd)
+
+    def close(self):
+        """Stop all command servers."""
+        for server in self.servers.values():
+            if server is not None:
+                server.close()
+        self.servers = {}
+
+
+def find_root(dir):
+    """Return the repository root containing 'dir' or None."""
+    while True:
+        if isdir(join(dir, '.hg')):
+            return dir
+        parent = dirname(dir)
+        if parent == dir:
+            return None
+        dir = parent
+
+
+def splitlines(data):
+    if data.endswith('\n'):
+        data = data[:-1]
+    return data.split('\n') if data else []
@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+from os.path import join, expanduser, dirname, isdir
+
+
+def get_cache_dir(*parts):
+    """Return the mkrelease cache directory joined with 'parts'.
+
+    Honors XDG_CACHE_HOME and defaults to ~/.cache/jarn.mkrelease.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or expanduser('~/.cache')
+    return join(base, 'jarn.mkrelease', *parts)
+
+
+def read_file(filename):
+    """Return the contents of 'filename' or None if it cannot be read."""
+    try:
+        with open(filename, 'rb') as file:
+            return file.read()
+    except (IOError, OSError):
+        return None
+
+
+def write_file(filename, data):
+    """Atomically replace 'filename' with 'data'.
+
+    Returns False if the file cannot be written; cache files are an
+    optimization, and failing to write one must not fail a release.
+    """
+    dir = dirname(filename)
+    try:
+        if not isdir(dir):
+            os.makedirs(dir)
+        fd, tempname = tempfile.mkstemp(dir=dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.rename(tempname, filename)
+        except:
+            os.remove(tempname)
+            raise
+    except (IOError, OSError):
+        return False
+    return True
@@ -0,0 +1,425 @@
+import os
+import re
+
+from os.path import join, dirname, realpath, expanduser
+from os.path import isabs, isdir, isfile
+
+MAXDEPTH = 10
+
+ENVIRON = ('GIT_DIR', 'GIT_WORK_TREE', 'GIT_COMMON_DIR', 'GIT_CEILING_DIRECTORIES',
+           'GIT_DISCOVERY_ACROSS_FILESYSTEM', 'GIT_CONFIG', 'GIT_CONFIG_COUNT',
+           'GIT_CONFIG_PARAMETERS')
+
+
+class Unsupported(Exception):
+    """Raised when the reader cannot answer reliably."""
+
+
+def fallback(method):
+    """Decorator returning None when 'method' cannot answer."""
+    def wrapped_method(self, *args, **kw):
+        try:
+            return method(self, *args, **kw)
+        except (Unsupported, EnvironmentError, ValueError):
+            return None
+
+    wrapped_method.__name__ = method.__name__
+    wrapped_method.__module__ = method.__module__
+    wrapped_method.__doc__ = method.__doc__
+    wrapped_method.__dict__.update(method.__dict__)
+    return wrapped_method
+
+
+class Repo(object):
+    """Locations of a work tree and its Git directories."""
+
+    def __init__(self, worktree, gitdir):
+        self.worktree = worktree
+        self.gitdir = gitdir
+        self.commondir = gitdir
+        if isfile(join(gitdir, 'commondir')):
+            self.commondir = realpath(join(gitdir, readline(join(gitdir, 'commondir'))))
+
+
+class GitReader(object):
+    """Answer questions about Git sandboxes from the files in .git.
+
+    Reads HEAD, loose refs, packed-refs, and the config files including
+    [include] and [includeIf] sections. Linked work trees are supported.
+
+    All methods return None when the answer cannot be determined
+    reliably, e.g. for bare repositories, detached heads, or when
+    GIT_DIR and friends are set. The caller should then ask git.
+    """
+
+    @fallback
+    def is_valid_sandbox(self, dir):
+        """Return True if 'dir' is inside a Git work tree."""
+        repo = self.find_repo(dir)
+        if repo is None:
+            return False
+        self.get_config(repo)
+        return True
+
+    @fallback
+    def get_root(self, dir):
+        """Return the top-level directory of the work tree."""
+        repo = self.get_repo(dir)
+        self.get_config(repo)
+        return repo.worktree
+
+    @fallback
+    def get_branch(self, dir):
+        """Return the name of the checked out branch."""
+        repo = self.get_repo(dir)
+        self.get_config(repo)
+        ref = self.get_head(repo)
+        if not ref.startswith('refs/heads/') or not self.ref_exists(repo, ref):
+            raise Unsupported(ref)
+        return ref[len('refs/heads/'):]
+
+    @fallback
+    def tag_exists(self, dir, tagid):
+        """Return True if tag 'tagid' exists."""
+        if not is_safe_refname(tagid):
+            raise Unsupported(tagid)
+        repo = self.get_repo(dir)
+        self.get_config(repo)
+        return self.ref_exists(repo, 'refs/tags/' + tagid)
+
+    @fallback
+    def is_shallow(self, dir):
+        """Return True if the repository is a shallow clone."""
+        repo = self.get_repo(dir)
+        self.get_config(repo)
+        return isfile(join(repo.commondir, 'shallow'))
+
+    @fallback
+    def get_config_lines(self, dir):
+        """Return the configuration like 'git config -l' does."""
+        repo = self.get_repo(dir)
+        lines = []
+        for key, value in self.get_config(repo):
+            if value is None:
+                lines.append(key)
+            else:
+                lines.extend(('%s=%s' % (key, value)).split('\n'))
+        return lines
+
+    def get_repo(self, dir):
+        repo = self.find_repo(dir)
+        if repo is None:
+            raise Unsupported(dir)
+        return repo
+
+    def find_repo(self, dir):
+        """Search 'dir' and its parents for a .git directory or file.
+
+        Returns a Repo or None if there is no work tree.
+        """
+        for name in ENVIRON:
+            if name in os.environ:
+                raise Unsupported(name)
+        dir = realpath(dir)
+        device = os.stat(dir).st_dev
+        while True:
+            if is_gitdir(dir):
+                # Inside a Git directory or a bare repository
+                raise Unsupported(dir)
+            dotgit = join(dir, '.git')
+            if isdir(dotgit):
+                if is_gitdir(dotgit):
+                    return Repo(dir, dotgit)
+            elif isfile(dotgit):
+                line = readline(dotgit)
+                if not line.startswith('gitdir: '):
+                    raise Unsupported(dotgit)
+                gitdir = realpath(join(dir, line[len('gitdir: '):]))
+                if not is_gitdir(gitdir):
+                    raise Unsupported(gitdir)
+                return Repo(dir, gitdir)
+            parent = dirname(dir)
+            if parent == dir:
+                return None
+            if os.stat(parent).st_dev != device:
+                raise Unsupported(parent)
+            dir = parent
+
+    def get_head(self, repo):
+        line = readline(join(repo.gitdir, 'HEAD'))
+        if not line.startswith('ref: '):
+            raise Unsupported('detached HEAD')
+        return line[len('ref: '):].strip()
+
+    def ref_exists(self, repo, ref):
+        if isfile(join(repo.commondir, *ref.split('/'))):
+            return True
+        packed = join(repo.commondir, 'packed-refs')
+        if isfile(packed):
+            # Search the whole file at once; repositories may pack
+            # tens of thousands of tags
+            with open(packed, 'rb') as file:
+                data = file.read()
+            return (' %s\n' % ref) in data
+        return False
+
+    def get_config(self, repo):
+        """Return the (key, value) pairs of all config files.
+
+        Raises Unsupported if the repository is one we do not
+        handle, e.g. a bare repository or a reftable one.
+        """
+        config = []
+        for filename in self.get_config_files(repo):
+            config.extend(ConfigReader(repo, self).read(filename))
+        values = dict(config)
+        if is_true(values.get('core.bare', 'false')):
+            raise Unsupported('core.bare')
+        if 'core.worktree' in values or 'extensions.refstorage' in values:
+            raise Unsupported('core.worktree')
+        if is_true(values.get('extensions.worktreeconfig', 'false')):
+            filename = join(repo.gitdir, 'config.worktree')
+            if isfile(filename):
+                config.extend(ConfigReader(repo, self).read(filename))
+        return config
+
+    def get_config_files(self, repo):
+        files = []
+        if 'GIT_CONFIG_NOSYSTEM' not in os.environ:
+            files.append(os.environ.get('GIT_CONFIG_SYSTEM', '/etc/gitconfig'))
+        if 'GIT_CONFIG_GLOBAL' in os.environ:
+            files.append(os.environ['GIT_CONFIG_GLOBAL'])
+        else:
+            xdg = os.environ.get('XDG_CONFIG_HOME') or expanduser('~/.config')
+            files.append(join(xdg, 'git', 'config'))
+            files.append(expanduser('~/.gitconfig'))
+        files.append(join(repo.commondir, 'config'))
+        return [x for x in files if isfile(x)]
+
+
+class ConfigReader(object):
+    """Parse a Git config file into (key, value) pairs.
+
+    Keys are returned as 'git config -l' prints them; keys without
+    a value have value None.
+    """
+
+    key_re = re.compile(r'[A-Za-z][A-Za-z0-9-]*')
+    section_re = re.compile(r'[A-Za-z0-9.-]+')
+
+    def __init__(self, repo, reader, depth=0):
+        self.repo = repo
+        self.reader = reader
+        self.depth = depth
+
+    def read(self, filename):
+        if self.depth > MAXDEPTH:
+            raise Unsupported('include depth')
+        with open(filename, 'rt') as file:
+            text = file.read()
+        config = []
+        for key, value in self.parse(text):
+            config.append((key, value))
+            if key == 'include.path' and value:
+                config.extend(self.include(filename, value))
+            elif key.startswith('includeif.') and key.endswith('.path') and value:
+                condition = key[len('includeif.'):-len('.path')]
+                if self.matches(filename, condition):
+                    config.extend(self.include(filename, value))
+        return config
+
+    def include(self, filename, path):
+        path = expanduser(path)
+        if not isabs(path):
+            path = join(dirname(filename), path)
+        if not isfile(path):
+            return []
+        return ConfigReader(self.repo, self.reader, self.depth+1).read(path)
+
+    def matches(self, filename, condition):
+        if condition.startswith(('gitdir:', 'gitdir/i:')):
+            kind, pattern = condition.split(':', 1)
+            if pattern.startswith('./'):
+                pattern = join(dirname(filename), pattern[2:])
+            pattern = expanduser(pattern)
+            if not isabs(pattern) and not pattern.startswith('**/'):
+                pattern = '**/' + pattern
+            if pattern.endswith('/'):
+                pattern += '**'
+            flags = re.IGNORECASE if kind == 'gitdir/i' else 0
+            gitdir = self.repo.gitdir
+            return (re.match(glob_to_regex(pattern), gitdir, flags) is not None or
+                    re.match(glob_to_regex(pattern), gitdir + '/', flags) is not None)
+        if condition.startswith('onbranch:'):
+            pattern = condition[len('onbranch:'):]
+            if pattern.endswith('/'):
+                pattern += '**'
+            try:
+                ref = self.reader.get_head(self.repo)
+            except Unsupported:
+                return False
+            if not ref.startswith('refs/heads/'):
+                return False
+            return re.match(glob_to_regex(pattern), ref[len('refs/heads/'):]) is not None
+        raise Unsupported(condition)
+
+    def parse(self, text):
+        section = None
+        pos = 0
+        end = len(text)
+        while pos < end:
+            c = text[pos]
+            if c in ' \t\r\n':
+                pos += 1
+            elif c in '#;':
+                pos = skip_line(text, pos)
+            elif c == '[':
+                section, pos = self.parse_section(text, pos+1)
+            else:
+                match = self.key_re.match(text, pos)
+                if match is None or section is None:
+                    raise ValueError('Bad config line at %d' % pos)
+                name = match.group().lower()
+                pos = match.end()
+                while pos < end and text[pos] in ' \t':
+                    pos += 1
+                if pos < end and text[pos] == '=':
+                    value, pos = self.parse_value(text, pos+1)
+                elif pos >= end or text[pos] in '\r\n#;':
+                    value = None
+                    pos = skip_line(text, pos)
+                else:
+                    raise ValueError('Bad config line at %d' % pos)
+                yield '%s.%s' % (section, name), value
+
+    def parse_section(self, text, pos):
+        match = self.section_re.match(text, pos)
+        if match is None:
+            raise ValueError('Bad section header at %d' % pos)
+        name = match.group().lower()
+        pos = match.end()
+        if text[pos:pos+1] == ']':
+            return name, pos+1
+        if text[pos:pos+2] != ' "':
+            raise ValueError('Bad section header at %d' % pos)
+        pos += 2
+        subsection = []
+        while True:
+            c = text[pos:pos+1]
+            if c in ('', '\n'):
+                raise ValueError('Bad section header at %d' % pos)
+            if c == '\\':
+                subsection.append(text[pos+1:pos+2])
+                pos += 2
+            elif c == '"':
+                pos += 1
+                break
+            else:
+                subsection.append(c)
+                pos += 1
+        if text[pos:pos+1] != ']':
+            raise ValueError('Bad section header at %d' % pos)
+        return '%s.%s' % (name, ''.join(subsection)), pos+1
+
+    def parse_value(self, text, pos):
+        value = []
+        quoted = False
+        trailing = 0    # Unquoted whitespace at the end of value
+        end = len(text)
+        while pos < end and text[pos] in ' \t':
+            pos += 1
+        while pos < end:
+            c = text[pos]
+            pos += 1
+            if c == '\n':
+                break
+            if c == '\\':
+                c = text[pos:pos+1]
+                pos += 1
+                if c == '\n':
+                    continue
+                if c == '\r' and text[pos:pos+1] == '\n':
+                    pos += 1
+                    continue
+                if c not in ESCAPES:
+                    raise ValueError('Bad escape at %d' % pos)
+                value.append(ESCAPES[c])
+                trailing = 0
+            elif c == '"':
+                quoted = not quoted
+            elif not quoted and c in '#;':
+                pos = skip_line(text, pos)
+                break
+            elif not quoted and c in ' \t\r':
+                value.append(c)
+                trailing += 1
+            else:
+                value.append(c)
+                trailing = 0
+        if quoted:
+            raise ValueError('Unterminated quote at %d' % pos)
+        if trailing:
+            value = value[:-trailing]
+        return ''.join(value), pos
+
+
+ESCAPES = {'n': '\n', 't': '\t', 'b': '\b', '\\': '\\', '"': '"'}
+
+
+def skip_line(text, pos):
+    end = text.find('\n', pos)
+    if end < 0:
+        return len(text)
+    return end + 1
+
+
+def readline(filename):
+    with open(filename, 'rt') as file:
+        return file.readline().rstrip('\r\n')
+
+
+def is_true(value):
+    # A key without value is true
+    return value is None or value.lower() in ('true', 'yes', 'on', '1')
+
+
+def is_gitdir(dir):
+    return (isfile(join(dir, 'HEAD')) and
+            (isdir(join(dir, 'objects')) or isfile(join(dir, 'commondir'))))
+
+
+def is_safe_refname(name):
+    if not name or name.startswith('/') or name.endswith(('/', '.lock', '.')):
+        return False
+    for part in name.split('/'):
+        if not part or part.startswith('.'):
+            return False
+    for c in name:
+        if c in ' ~^:?*[\\' or ord(c) < 32 or ord(c) == 127:
+            return False
+    return '..' not in name and '@{' not in name
+
+
+def glob_to_regex(pattern):
+    """Translate a wildmatch pattern into a regex."""
+    regex = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            regex.append('[^/]')
+            i += 1
+        elif pattern[i] in '[\\':
+            raise Unsupported(pattern)
+        else:
+            regex.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(regex) + r'\Z'
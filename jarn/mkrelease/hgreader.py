@@ -0,0 +1,205 @@
+import os
+import re
+
+from glob import glob
+from os.path import join, dirname, realpath, expanduser, expandvars, normpath
+from os.path import isabs, isdir, isfile
+
+from gitreader import Unsupported, fallback
+
+MAXDEPTH = 10
+
+ENVIRON = ('HGRCPATH', 'HGRCSKIPREPO')
+
+# Repository formats we know the layout of
+REQUIREMENTS = ('revlogv1', 'store', 'fncache', 'dotencode', 'generaldelta',
+                'sparserevlog', 'shared', 'relshared')
+
+
+class HgReader(object):
+    """Answer questions about Mercurial sandboxes from the files in .hg.
+
+    Reads .hg/requires, .hg/branch, and the [paths] section of the
+    config files including %include and %unset directives.
+
+    All methods return None when the answer cannot be determined
+    reliably, e.g. for unknown repository formats, non-ASCII branch
+    names, or when HGRCPATH is set. The caller should then ask hg.
+    """
+
+    @fallback
+    def is_valid_sandbox(self, dir):
+        """Return True if 'dir' is inside a Mercurial repository."""
+        root = self.find_root(dir)
+        if root is None:
+            return False
+        self.check_requires(root)
+        return True
+
+    @fallback
+    def get_root(self, dir):
+        """Return the root directory of the repository."""
+        return self.get_repo(dir)
+
+    @fallback
+    def get_branch(self, dir):
+        """Return the name of the working directory's branch."""
+        root = self.get_repo(dir)
+        filename = join(root, '.hg', 'branch')
+        if not isfile(filename):
+            return 'default'
+        with open(filename, 'rb') as file:
+            branch = file.read().strip()
+        if not branch:
+            return 'default'
+        if re.search(r'[^\x20-\x7e]', branch):
+            raise Unsupported('non-ASCII branch name')
+        return branch
+
+    @fallback
+    def get_path(self, dir, name='default'):
+        """Return the location of path 'name' like 'hg show paths.name'
+        does, or '' if it is not configured.
+        """
+        root = self.get_repo(dir)
+        value = None
+        for filename, base in self.get_config_files(root):
+            for section, key, item in ConfigReader().read(filename):
+                if section == 'paths' and key == name:
+                    value = item
+                    if value is not None:
+                        value = resolve_path(value, base)
+        if not value:
+            return ''
+        if '\n' in value:
+            raise Unsupported('multi-line path')
+        return value
+
+    def get_repo(self, dir):
+        root = self.find_root(dir)
+        if root is None:
+            raise Unsupported(dir)
+        self.check_requires(root)
+        return root
+
+    def find_root(self, dir):
+        """Search 'dir' and its parents for a .hg directory.
+
+        Returns the repository root or None.
+        """
+        for name in ENVIRON:
+            if name in os.environ:
+                raise Unsupported(name)
+        dir = realpath(dir)
+        if not isdir(dir):
+            raise Unsupported(dir)
+        while True:
+            if isdir(join(dir, '.hg')):
+                return dir
+            parent = dirname(dir)
+            if parent == dir:
+                return None
+            dir = parent
+
+    def check_requires(self, root):
+        hgdir = join(root, '.hg')
+        filename = join(hgdir, 'requires')
+        if isfile(filename):
+            with open(filename, 'rt') as file:
+                for line in file:
+                    requirement = line.strip()
+                    if requirement and requirement not in REQUIREMENTS:
+                        raise Unsupported(requirement)
+        sharedpath = join(hgdir, 'sharedpath')
+        if isfile(sharedpath):
+            with open(sharedpath, 'rt') as file:
+                path = file.read().rstrip('\n')
+            if not isdir(join(hgdir, path)):
+                raise Unsupported(sharedpath)
+
+    def get_config_files(self, root):
+        # Return (filename, base) pairs; relative paths are resolved
+        # against 'base'
+        home = expanduser('~')
+        files = []
+        files.append(('/etc/mercurial/hgrc', home))
+        files.extend((x, home) for x in sorted(glob('/etc/mercurial/hgrc.d/*.rc')))
+        files.append((join(home, '.hgrc'), home))
+        xdg = os.environ.get('XDG_CONFIG_HOME') or join(home, '.config')
+        files.append((join(xdg, 'hg', 'hgrc'), home))
+        files.append((join(root, '.hg', 'hgrc'), root))
+        return [x for x in files if isfile(x[0])]
+
+
+class ConfigReader(object):
+    """Parse a Mercurial config file into (section, key, value) triples.
+
+    Keys removed by %unset have value None.
+    """
+
+    section_re = re.compile(r'\[([^\[]+)\]')
+    item_re = re.compile(r'([^=\s][^=]*?)\s*=\s*(.*\S|)')
+    cont_re = re.compile(r'\s+(\S|\S.*\S)\s*$')
+    empty_re = re.compile(r'(;|#|\s*$)')
+    comment_re = re.compile(r'(;|#)')
+    include_re = re.compile(r'%include\s+(\S|\S.*\S)\s*$')
+    unset_re = re.compile(r'%unset\s+(\S+)')
+
+    def __init__(self, depth=0):
+        self.depth = depth
+
+    def read(self, filename):
+        if self.depth > MAXDEPTH:
+            raise Unsupported('include depth')
+        with open(filename, 'rt') as file:
+            text = file.read()
+        return self.parse(text, filename)
+
+    def parse(self, text, filename=None):
+        config = []
+        section = ''
+        item = None
+        for line in text.splitlines():
+            if item is not None:
+                if self.comment_re.match(line):
+                    continue
+                match = self.cont_re.match(line)
+                if match is not None:
+                    name, key, value = config[item]
+                    config[item] = (name, key, value + '\n' + match.group(1))
+                    continue
+                item = None
+            match = self.include_re.match(line)
+            if match is not None:
+                if filename is None:
+                    raise Unsupported('%include')
+                path = expanduser(expandvars(match.group(1)))
+                path = normpath(join(dirname(filename), path))
+                if isfile(path):
+                    config.extend(ConfigReader(self.depth+1).read(path))
+                continue
+            if self.empty_re.match(line):
+                continue
+            match = self.section_re.match(line)
+            if match is not None:
+                section = match.group(1)
+                continue
+            match = self.item_re.match(line)
+            if match is not None:
+                config.append((section, match.group(1), match.group(2)))
+                item = len(config) - 1
+                continue
+            match = self.unset_re.match(line)
+            if match is not None:
+                config.append((section, match.group(1), None))
+                continue
+            raise ValueError('Bad config line: %r' % line)
+        return config
+
+
+def resolve_path(value, base):
+    """Expand 'value' like Mercurial expands entries of [paths]."""
+    value = expanduser(expandvars(value))
+    if re.match(r'[a-zA-Z0-9+.\-]+:', value) or isabs(value):
+        return value
+    return normpath(join(base, value))
@@ -0,0 +1,56 @@
+import time
+
+from hashlib import sha1
+from os.path import join
+
+from diskcache import read_file, write_file
+
+TTL = 7 * 24 * 3600
+
+
+class LayoutCache(object):
+    """A persistent cache of Subversion repository layouts.
+
+    Entries are keyed by the repository's base URL and UUID and
+    expire after 'ttl' seconds. If 'refresh' is true, lookups miss
+    and every layout is determined anew.
+
+    Install a cache by assigning it to the SCM's 'layoutcache'
+    attribute.
+    """
+
+    def __init__(self, dir, ttl=TTL, refresh=False):
+        self.dir = dir
+        self.ttl = ttl
+        self.refresh = refresh
+
+    def get_filename(self, url, uuid):
+        return join(self.dir, sha1('%s\n%s' % (url, uuid)).hexdigest())
+
+    def lookup(self, url, uuid):
+        """Return the layout tuple of 'url', or None if it is not
+        cached or has expired.
+        """
+        if self.refresh:
+            return None
+        data = read_file(self.get_filename(url, uuid))
+        if data is None:
+            return None
+        lines = data.split('\n')
+        if len(lines) < 4 or lines[1] != url or lines[2] != uuid:
+            return None
+        try:
+            stored = float(lines[0])
+        except ValueError:
+            return None
+        if not (0 <= time.time() - stored < self.ttl):
+            return None
+        layout = tuple(lines[3].split())
+        if len(layout) != 3:
+            return None
+        return layout
+
+    def store(self, url, uuid, layout):
+        """Write the layout of 'url'."""
+        data = '%f\n%s\n%s\n%s\n' % (time.time(), url, uuid, ' '.join(layout))
+        return write_file(self.get_filename(url, uuid), data)
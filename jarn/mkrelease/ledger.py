@@ -0,0 +1,108 @@
+import sys
+import pipes
+
+from operator import attrgetter
+
+CMDWIDTH = 60
+
+
+class Entry(object):
+    """A command recorded in the ledger."""
+
+    def __init__(self, cmd, cwd, start, end, returncode, nbytes, nbytes2):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.start = start
+        self.end = end
+        self.returncode = returncode
+        self.nbytes = nbytes
+        self.nbytes2 = nbytes2
+
+    @property
+    def elapsed(self):
+        return self.end - self.start
+
+    @property
+    def key(self):
+        """Return a hashable (cmd, cwd) key."""
+        cmd = self.cmd
+        if not isinstance(cmd, basestring):
+            cmd = tuple(cmd)
+        return cmd, self.cwd
+
+
+class Ledger(object):
+    """Record the commands run by Process objects.
+
+    Install a ledger by assigning it to Process.ledger.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, child):
+        """Record a finished tee.Child."""
+        nbytes, nbytes2 = child.nbytes
+        self.entries.append(Entry(child.cmd, child.cwd, child.start, child.end,
+                                  child.returncode, nbytes, nbytes2))
+
+    def get_slowest(self, count=5):
+        """Return the 'count' slowest entries."""
+        return sorted(self.entries, key=attrgetter('elapsed'), reverse=True)[:count]
+
+    def get_repeated(self):
+        """Return a list of (count, elapsed, entry) tuples for
+        commands run more than once in the same directory.
+        """
+        seen = {}
+        order = []
+        for entry in self.entries:
+            if entry.key not in seen:
+                seen[entry.key] = []
+                order.append(entry.key)
+            seen[entry.key].append(entry)
+        repeated = []
+        for key in order:
+            entries = seen[key]
+            if len(entries) > 1:
+                elapsed = sum(x.elapsed for x in entries)
+                repeated.append((len(entries), elapsed, entries[0]))
+        return sorted(repeated, key=lambda x: x[0], reverse=True)
+
+    def report(self, file=None, count=5):
+        """Print totals, slowest, and repeated commands to 'file'."""
+        if file is None:
+            file = sys.stderr
+
+        elapsed = sum(x.elapsed for x in self.entries)
+        nbytes = sum(x.nbytes for x in self.entries)
+        nbytes2 = sum(x.nbytes2 for x in self.entries)
+        print >>file, 'Commands: %d run, %.3f s total, %d bytes stdout, %d bytes stderr' % (
+            len(self.entries), elapsed, nbytes, nbytes2)
+
+        slowest = self.get_slowest(count)
+        if slowest:
+            print >>file, 'Slowest commands:'
+            for entry in slowest:
+                print >>file, '  %8.3f s  %s  (rc=%s)' % (
+                    entry.elapsed, format_cmd(entry.cmd), entry.returncode)
+
+        repeated = self.get_repeated()
+        if repeated:
+            print >>file, 'Repeated commands:'
+            for times, elapsed, entry in repeated:
+                print >>file, '  %3dx %8.3f s  %s  (in %s)' % (
+                    times, elapsed, format_cmd(entry.cmd), entry.cwd)
+
+
+def format_cmd(cmd, width=CMDWIDTH):
+    """Return 'cmd' as a shell-like string of at most 'width' chars."""
+    if not isinstance(cmd, basestring):
+        cmd = ' '.join(pipes.quote(x) for x in cmd)
+    cmd = ' '.join(cmd.split())
+    if len(cmd) > width:
+        cmd = cmd[:width-3] + '...'
+    return cmd
@@ -0,0 +1,96 @@
+import sys
+
+
+class Memo(object):
+    """Cache the results of read-only SCM queries.
+
+    Install a memo by assigning it to the SCM's 'memo' attribute.
+    Queries are cached per method, sandbox, and arguments; methods
+    changing the sandbox invalidate the entries they affect.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+        self.stats = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def lookup(self, key):
+        """Return (True, value) on a hit, (False, None) on a miss."""
+        name = key[0]
+        hits, misses = self.stats.get(name, (0, 0))
+        if key in self.values:
+            self.hits += 1
+            self.stats[name] = (hits+1, misses)
+            return True, self.values[key]
+        self.misses += 1
+        self.stats[name] = (hits, misses+1)
+        return False, None
+
+    def store(self, key, value):
+        self.values[key] = value
+
+    def invalidate(self, *names):
+        """Drop the entries of methods 'names', or all entries."""
+        if not names:
+            self.values.clear()
+        else:
+            for key in self.values.keys():
+                if key[0] in names:
+                    del self.values[key]
+
+    def report(self, file=None):
+        """Print hit and miss counts to 'file'."""
+        if file is None:
+            file = sys.stderr
+        print >>file, 'SCM queries: %d hits, %d misses' % (self.hits, self.misses)
+        for name, (hits, misses) in sorted(self.stats.items()):
+            print >>file, '  %-32s %3d hits %3d misses' % (name, hits, misses)
+
+
+def memoize(method):
+    """Decorator caching the result of method(self, dir, *args)
+    in self.memo.
+    """
+    name = method.__name__
+
+    def wrapped_method(self, dir, *args):
+        memo = self.memo
+        if memo is None:
+            return method(self, dir, *args)
+        key = (name, dir, args)
+        found, value = memo.lookup(key)
+        if not found:
+            value = method(self, dir, *args)
+            memo.store(key, value)
+        return value
+
+    wrapped_method.__name__ = method.__name__
+    wrapped_method.__module__ = method.__module__
+    wrapped_method.__doc__ = method.__doc__
+    wrapped_method.__dict__.update(method.__dict__)
+    return wrapped_method
+
+
+def invalidates(*names):
+    """Decorator dropping the cached results of methods 'names'
+    after the decorated method ran. If no names are given, the
+    whole memo is dropped.
+    """
+    def decorator(method):
+        def wrapped_method(self, *args, **kw):
+            try:
+                return method(self, *args, **kw)
+            finally:
+                if self.memo is not None:
+                    self.memo.invalidate(*names)
+
+        wrapped_method.__name__ = method.__name__
+        wrapped_method.__module__ = method.__module__
+        wrapped_method.__doc__ = method.__doc__
+        wrapped_method.__dict__.update(method.__dict__)
+        return wrapped_method
+    return decorator
@@ -0,0 +1,170 @@
+import os
+import errno
+import fcntl
+import shutil
+
+from hashlib import sha1
+from os.path import join, exists
+
+from urlparser import URLParser
+
+MAXCOUNT = 10
+
+
+class Lock(object):
+    """An flock(2) lock on 'filename'."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+
+    def acquire(self, exclusive=True, blocking=True):
+        """Return True if the lock was acquired.
+
+        Raises IOError with ENOENT if the directory of the lock
+        file does not exist.
+        """
+        if self.file is None:
+            self.file = open(self.filename, 'a')
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self.file.fileno(), flags)
+        except IOError, e:
+            if not blocking and e.errno in (errno.EAGAIN, errno.EACCES):
+                self.release()
+                return False
+            self.release()
+            raise
+        return True
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def is_current(self):
+        """Return True if the lock file has not been removed."""
+        try:
+            return os.fstat(self.file.fileno()).st_ino == os.stat(self.filename).st_ino
+        except OSError:
+            return False
+
+
+class Mirrors(object):
+    """Keep local mirrors of remote repositories.
+
+    A mirror lives in a directory named after the SHA-1 of its
+    normalized URL and is fetched incrementally before each use.
+    Checkouts borrow from the mirror and fetch only what it lacks.
+
+    The 'update.lock' serializes creating and fetching a mirror. The
+    'use.lock' is held shared for as long as a checkout borrows from
+    the mirror; call close() when done. Once there are more than
+    'maxcount' mirrors, the least recently used ones not in use are
+    removed.
+    """
+
+    supported = ('hg', 'git')
+
+    def __init__(self, dir, maxcount=MAXCOUNT, urlparser=None):
+        self.dir = dir
+        self.maxcount = maxcount
+        self.urlparser = urlparser or URLParser()
+        self.locks = []
+
+    def get_mirror_dir(self, url):
+        url = self.urlparser.abspath(url)
+        return join(self.dir, sha1(url).hexdigest())
+
+    def clone_url(self, scm, url, dir):
+        """Check out 'url' into 'dir' using a mirror if 'scm'
+        supports it.
+        """
+        if scm.name not in self.supported:
+            return scm.clone_url(url, dir)
+
+        mirrordir = self.get_mirror_dir(url)
+        self.locks.append(self.use(mirrordir))
+        repo = join(mirrordir, 'repo')
+
+        update = Lock(join(mirrordir, 'update.lock'))
+        update.acquire()
+        try:
+            if exists(repo):
+                scm.update_mirror(repo)
+            else:
+                # Do not leave a partial mirror behind
+                temp = join(mirrordir, 'repo.tmp')
+                if exists(temp):
+                    shutil.rmtree(temp)
+                scm.mirror_url(url, temp)
+                os.rename(temp, repo)
+        finally:
+            update.release()
+
+        rc = scm.clone_url_with_mirror(url, dir, repo)
+        self.evict()
+        return rc
+
+    def use(self, mirrordir):
+        # Return the shared use lock of 'mirrordir', creating the
+        # directory if necessary. Retry if the mirror is evicted
+        # while we wait.
+        while True:
+            try:
+                os.makedirs(mirrordir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            lock = Lock(join(mirrordir, 'use.lock'))
+            try:
+                lock.acquire(exclusive=False)
+            except IOError, e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+            if lock.is_current():
+                os.utime(lock.filename, None)
+                return lock
+            lock.release()
+
+    def close(self):
+        """Release the mirrors used by this instance."""
+        for lock in self.locks:
+            lock.release()
+        self.locks = []
+
+    def evict(self):
+        """Remove least recently used mirrors."""
+        entries = []
+        for name in os.listdir(self.dir):
+            try:
+                mtime = os.stat(join(self.dir, name, 'use.lock')).st_mtime
+            except OSError:
+                continue
+            entries.append((mtime, name))
+        entries.sort(reverse=True)
+        for mtime, name in entries[self.maxcount:]:
+            self.remove(join(self.dir, name))
+
+    def remove(self, mirrordir):
+        """Remove 'mirrordir' unless it is in use."""
+        use = Lock(join(mirrordir, 'use.lock'))
+        try:
+            if not use.acquire(blocking=False):
+                return False
+        except IOError:
+            return False
+        try:
+            update = Lock(join(mirrordir, 'update.lock'))
+            if not update.acquire(blocking=False):
+                return False
+            try:
+                shutil.rmtree(mirrordir)
+            finally:
+                update.release()
+        finally:
+            use.release()
+        return True
@@ -17,6 +17,15 @@ from python import Python
 from setuptools import Setuptools
 from scp import SCP
 from scm import SCMFactory
+from process import Process
+from ledger import Ledger
+from memo import Memo
+from tagindex import TagIndex
+from mirror import Mirrors, MAXCOUNT
+from cmdserver import CommandServerProcess
+from layoutcache import LayoutCache
+from versioncache import VersionCache
+from diskcache import get_cache_dir
 from urlparser import URLParser
 from configparser import ConfigParser
 from exit import err_exit, msg_exit, warn
@@ -54,6 +63,14 @@ Options:
   -b, --binary        Release a binary egg.
   -q, --quiet         Suppress output of setuptools commands.
 
+  --shallow           When releasing from an scm-url, check out only
+                      the requested revision.
+
+  --refresh-layout    Do not use cached Subversion repository layouts.
+
+  --trace-commands    Print statistics about the commands run by
+                      mkrelease to stderr.
+
   -c config-file, --config-file=config-file
                       Use config-file instead of the default ~/.mkrelease.
 
@@ -87,6 +104,12 @@ class Defaults(object):
         self.sign = parser.getboolean(main_section, 'sign', False)
         self.identity = parser.getstring(main_section, 'identity', '')
         self.push = parser.getboolean(main_section, 'push', False)
+        self.tagindex = parser.getboolean(main_section, 'tagindex', False)
+        self.mirrordir = parser.getstring(main_section, 'mirrordir', '')
+        self.mirrormax = parser.getint(main_section, 'mirrormax', MAXCOUNT)
+        self.cmdserver = parser.getboolean(main_section, 'cmdserver', False)
+        self.layoutttl = parser.getint(main_section, 'layoutttl', 7)
+        self.svnmucc = parser.getboolean(main_section, 'svnmucc', False)
 
         self.aliases = {}
         if parser.has_section('aliases'):
@@ -227,14 +250,23 @@ class ReleaseMaker(object):
         self.quiet = False
         self.sign = False
         self.list = False
+        self.trace = False
+        self.shallow = False
+        self.refreshlayout = False
         self.identity = ''
         self.branch = ''
         self.scmtype = ''
         self.distcmd = 'sdist'
-        self.infoflags = ['--no-svn-revision', '--no-date', '--tag-build=""']
-        self.distflags = ['--formats="zip"']
+        self.infoflags = ['--no-svn-revision', '--no-date', '--tag-build=']
+        self.distflags = ['--formats=zip']
         self.directory = os.curdir
         self.scm = None
+        self.committed = False
+        self.deferred = False
+        self.mirrors = None
+        self.cmdserver = None
+        if self.defaults.mirrordir:
+            self.mirrors = Mirrors(expanduser(self.defaults.mirrordir), self.defaults.mirrormax)
 
     def parse_options(self, args, depth=0):
         """Parse command line options.
@@ -245,7 +277,8 @@ class ReleaseMaker(object):
                 ('no-commit', 'no-tag', 'no-upload', 'dry-run',
                  'sign', 'identity=', 'dist-location=', 'version', 'help',
                  'push', 'quiet', 'svn', 'hg', 'git', 'develop', 'binary',
-                 'list-locations', 'config-file='))
+                 'list-locations', 'config-file=', 'trace-commands', 'shallow',
+                 'refresh-layout'))
         except getopt.GetoptError, e:
             err_exit('mkrelease: %s\n%s' % (e.msg, USAGE))
 
@@ -270,6 +303,12 @@ class ReleaseMaker(object):
                 self.locations.extend(self.locations.get_location(value))
             elif name in ('-l', '--list-locations'):
                 self.list = True
+            elif name in ('--trace-commands',):
+                self.trace = True
+            elif name in ('--shallow',):
+                self.shallow = True
+            elif name in ('--refresh-layout',):
+                self.refreshlayout = True
             elif name in ('-h', '--help'):
                 msg_exit(HELP)
             elif name in ('-v', '--version'):
@@ -281,7 +320,7 @@ class ReleaseMaker(object):
                 self.infoflags = []
             elif name in ('-b', '--binary'):
                 self.distcmd = 'bdist'
-                self.distflags = ['--formats="egg"']
+                self.distflags = ['--formats=egg']
             elif name in ('-c', '--config-file') and depth == 0:
                 config_file = abspath(expanduser(value))
                 self.check_valid_file(config_file)
@@ -332,13 +371,13 @@ class ReleaseMaker(object):
         if self.identity:
             if '--sign' not in uploadflags:
                 uploadflags.append('--sign')
-            uploadflags.append('--identity="%s"' % self.identity)
+            uploadflags.append('--identity=%s' % self.identity)
         elif '--sign' in uploadflags:
             if server.identity is not None:
                 if server.identity:
-                    uploadflags.append('--identity="%s"' % server.identity)
+                    uploadflags.append('--identity=%s' % server.identity)
             elif self.defaults.identity:
-                uploadflags.append('--identity="%s"' % self.defaults.identity)
+                uploadflags.append('--identity=%s' % self.defaults.identity)
 
         return uploadflags
 
@@ -383,6 +422,16 @@ class ReleaseMaker(object):
         develop = not self.infoflags
 
         self.scm = self.scms.get_scm(scmtype, directory)
+        self.scm.memo = Memo()
+        self.scm.versioncache = VersionCache(get_cache_dir('versions'))
+        if self.defaults.tagindex:
+            self.scm.tagindex = TagIndex(get_cache_dir('tags'))
+        if self.scm.name == 'svn' and self.defaults.layoutttl > 0:
+            self.scm.layoutcache = LayoutCache(get_cache_dir('layouts'),
+                                               self.defaults.layoutttl * 24 * 3600,
+                                               self.refreshlayout)
+        if self.scm.name == 'hg' and self.defaults.cmdserver:
+            self.scm.process = self.cmdserver = CommandServerProcess(env=self.scm.get_env())
 
         if self.scm.is_valid_url(directory):
             directory = self.urlparser.abspath(directory)
@@ -401,7 +450,19 @@ class ReleaseMaker(object):
 
             if not self.skipcommit:
                 if self.scm.is_dirty_sandbox(directory):
-                    self.scm.commit_sandbox(directory, name, version, self.push)
+                    if self.can_defer_commit():
+                        # Committed together with the tag
+                        self.deferred = True
+                    else:
+                        # Pushed together with the tag
+                        self.scm.commit_sandbox(directory, name, version, False)
+                    self.committed = True
+
+    def can_defer_commit(self):
+        """Return True if the commit can go into the tag's revision.
+        """
+        return (self.scm.name == 'svn' and self.defaults.svnmucc and
+                not self.skiptag and self.scm.has_svnmucc)
 
     def make_release(self):
         """Build and distribute the egg.
@@ -418,16 +479,23 @@ class ReleaseMaker(object):
         try:
             if self.isremote:
                 directory = join(tempdir, 'build')
-                self.scm.clone_url(self.remoteurl, directory)
+                if self.shallow:
+                    branch = self.scm.make_branchid(directory, branch)
+                    self.scm.shallow_clone_url(self.remoteurl, directory, branch)
+                elif self.mirrors is not None:
+                    self.mirrors.clone_url(self.scm, self.remoteurl, directory)
+                else:
+                    self.scm.clone_url(self.remoteurl, directory)
             else:
                 directory = abspath(expanduser(directory))
 
             self.scm.check_valid_sandbox(directory)
 
             if self.isremote:
-                branch = self.scm.make_branchid(directory, branch)
-                if branch:
-                    self.scm.switch_branch(directory, branch)
+                if not self.shallow:
+                    branch = self.scm.make_branchid(directory, branch)
+                    if branch:
+                        self.scm.switch_branch(directory, branch)
                 if scmtype != 'svn':
                     branch = self.scm.get_branch_from_sandbox(directory)
                     print 'Releasing branch', branch
@@ -435,18 +503,32 @@ class ReleaseMaker(object):
             self.setuptools.check_valid_package(directory)
 
             if not (self.skipcommit and self.skiptag):
-                self.scm.check_dirty_sandbox(directory)
-                self.scm.check_unclean_sandbox(directory)
+                if not self.deferred:
+                    self.scm.check_dirty_sandbox(directory)
+                    self.scm.check_unclean_sandbox(directory)
 
             name, version = self.setuptools.get_package_info(directory, develop)
             if self.isremote:
                 print 'Releasing', name, version
 
+            tagid = None
             if not self.skiptag:
                 print 'Tagging', name, version
                 tagid = self.scm.make_tagid(directory, version)
                 self.scm.check_tag_exists(directory, tagid)
-                self.scm.create_tag(directory, tagid, name, version, self.push)
+                if self.deferred:
+                    # svnmucc takes text modifications only, anything
+                    # else is committed separately
+                    if not self.scm.commit_and_tag_sandbox(directory, tagid, name, version):
+                        self.scm.commit_sandbox(directory, name, version, False)
+                        self.scm.check_dirty_sandbox(directory)
+                        self.scm.check_unclean_sandbox(directory)
+                        self.scm.create_tag(directory, tagid, name, version, False)
+                else:
+                    self.scm.create_tag(directory, tagid, name, version, False)
+
+            if self.push and (self.committed or tagid):
+                self.scm.push_sandbox(directory, tagid, self.committed)
 
             if scmtype == 'svn' and self.scm.version_info[:2] < (1, 7):
                 scmtype = 'svn_cvs'
@@ -457,6 +539,9 @@ class ReleaseMaker(object):
                 directory, infoflags, distcmd, distflags, scmtype, self.quiet)
 
             if not self.skipupload:
+                # Copies to dist locations run concurrently, after the
+                # uploads to index servers
+                uploads = []
                 for location in self.locations:
                     if self.locations.is_server(location):
                         uploadflags = self.get_uploadflags(location)
@@ -471,20 +556,35 @@ class ReleaseMaker(object):
                         scheme = self.urlparser.get_scheme(location)
                         location = self.urlparser.to_ssh_url(location)
                         if scheme == 'sftp':
-                            self.scp.run_sftp(distfile, location)
+                            uploads.append(('sftp', location))
                         else:
-                            self.scp.run_scp(distfile, location)
+                            uploads.append(('scp', location))
                     else:
-                        self.scp.run_scp(distfile, location)
+                        uploads.append(('scp', location))
+                if uploads:
+                    self.scp.run_uploads(distfile, uploads)
         finally:
             shutil.rmtree(tempdir)
+            if self.mirrors is not None:
+                self.mirrors.close()
 
     def run(self):
         self.get_python()
         self.get_options()
-        self.get_package()
-        self.make_release()
-        print 'done'
+        if self.trace:
+            Process.ledger = Ledger()
+        try:
+            self.get_package()
+            self.make_release()
+            print 'done'
+        finally:
+            if self.cmdserver is not None:
+                self.cmdserver.close()
+            if self.trace:
+                Process.ledger.report()
+                Process.ledger = None
+                if self.scm is not None:
+                    self.scm.memo.report()
 
 
 def main(args=None):
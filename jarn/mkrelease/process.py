@@ -1,30 +1,64 @@
 import os
+import sys
 import tee
 
 
 class Process(object):
     """Process related functions using the tee module."""
 
+    # Assign a ledger.Ledger to record all commands
+    ledger = None
+
+    # Assign a cassette.Cassette to record or replay all commands
+    cassette = None
+
     def __init__(self, quiet=False, env=None):
         self.quiet = quiet
         self.env = env
 
-    def popen(self, cmd, echo=True, echo2=True):
+    def popen(self, cmd, echo=True, echo2=True, capture=None, cwd=None):
         # env *replaces* os.environ
         if self.quiet:
-            echo = echo2 = False
-        return tee.popen(cmd, echo, echo2, env=self.env)
+            echo, echo2 = tee.mute(echo), tee.mute(echo2)
+        loop = tee.Loop()
+        child = loop.add(self.spawn(cmd, echo, echo2, capture, cwd))
+        loop.run(child)
+        self.record(child)
+        return child.returncode, child.lines
 
-    def pipe(self, cmd):
-        rc, lines = self.popen(cmd, echo=False)
+    def pipe(self, cmd, cwd=None):
+        rc, lines = self.popen(cmd, echo=False, cwd=cwd)
         if rc == 0 and lines:
             return lines[0]
         return ''
 
-    def system(self, cmd):
-        rc, lines = self.popen(cmd)
+    def system(self, cmd, cwd=None):
+        # Pass output through unless it must be read by us
+        if self.cassette is None:
+            child = self.passthrough(cmd, cwd)
+            if child is not None:
+                self.record(child)
+                return child.returncode
+        rc, lines = self.popen(cmd, cwd=cwd)
         return rc
 
+    def query(self, cmd, predicate, cwd=None):
+        # Read stdout until a line matches 'predicate', then stop the
+        # command. Returns (0, line) on a match, (rc, None) otherwise.
+        echo2 = not self.quiet
+        capture = tee.Capture(predicate, maxlen=0)
+        loop = tee.Loop()
+        child = loop.add(self.spawn(cmd, False, echo2, capture, cwd))
+        while not child.done and not capture.values:
+            loop.step()
+        if not child.done:
+            loop.remove(child)
+            child.kill()
+        self.record(child)
+        if capture.values:
+            return 0, capture.values[0]
+        return child.returncode, None
+
     def os_system(self, cmd):
         # env *updates* os.environ
         if self.quiet:
@@ -33,3 +67,99 @@ class Process(object):
             cmd = ''.join('export %s="%s"\n' % (k, v) for k, v in self.env.items()) + cmd
         return os.system(cmd)
 
+    def passthrough(self, cmd, cwd=None):
+        # Let the child write to our stdout and stderr directly.
+        # Returns None if they are not real files.
+        if self.quiet:
+            with open(os.devnull, 'wb') as devnull:
+                return tee.call(cmd, devnull, devnull, env=self.env, cwd=cwd)
+        if tee.fileno(sys.stdout) is None or tee.fileno(sys.stderr) is None:
+            return None
+        sys.stdout.flush()
+        sys.stderr.flush()
+        return tee.call(cmd, sys.stdout, sys.stderr, env=self.env, cwd=cwd)
+
+    def spawn(self, cmd, echo, echo2, capture=None, cwd=None):
+        if self.cassette is not None:
+            return self.cassette.spawn(cmd, echo, echo2, self.env, capture, cwd)
+        return tee.spawn(cmd, echo, echo2, env=self.env, capture=capture, cwd=cwd)
+
+    def record(self, child):
+        if self.ledger is not None:
+            self.ledger.add(child)
+        if self.cassette is not None:
+            self.cassette.add(child)
+
+
+class Job(object):
+    """A command started by AsyncProcess.
+
+    Jobs share their AsyncProcess' select loop; waiting for one job
+    keeps all other running jobs flowing.
+    """
+
+    def __init__(self, process, child, result):
+        self.process = process
+        self.child = child
+        self.result = result
+        self.recorded = False
+
+    def done(self):
+        return self.child.done
+
+    def wait(self):
+        self.process.loop.run(self.child)
+        if not self.recorded:
+            self.process.record(self.child)
+            self.recorded = True
+        return self.result(self.child.returncode, self.child.lines)
+
+
+class AsyncProcess(object):
+    """Start commands without waiting for them.
+
+    A standalone primitive, not a drop-in Process: popen, pipe, and
+    system return Jobs instead of results. Commands start immediately
+    and run concurrently; call Job.wait() or AsyncProcess.gather() to
+    collect results.
+
+    Commands are spawned and recorded by the wrapped 'process', so
+    its ledger, cassette, and spawn hooks apply to jobs as well.
+    """
+
+    def __init__(self, quiet=False, env=None, process=None):
+        if process is None:
+            process = Process(quiet, env)
+        self.process = process
+        self.loop = tee.Loop()
+
+    @property
+    def quiet(self):
+        return self.process.quiet
+
+    def popen(self, cmd, echo=True, echo2=True, capture=None, cwd=None):
+        return self._start(cmd, echo, echo2, lambda rc, lines: (rc, lines), capture, cwd)
+
+    def pipe(self, cmd, cwd=None):
+        def result(rc, lines):
+            if rc == 0 and lines:
+                return lines[0]
+            return ''
+        return self._start(cmd, False, True, result, cwd=cwd)
+
+    def system(self, cmd, cwd=None):
+        return self._start(cmd, True, True, lambda rc, lines: rc, cwd=cwd)
+
+    def gather(self, *jobs):
+        """Wait for all 'jobs' and return their results in order."""
+        self.loop.run(*[job.child for job in jobs])
+        return [job.wait() for job in jobs]
+
+    def record(self, child):
+        self.process.record(child)
+
+    def _start(self, cmd, echo, echo2, result, capture=None, cwd=None):
+        if self.quiet:
+            echo, echo2 = tee.mute(echo), tee.mute(echo2)
+        child = self.loop.add(self.process.spawn(cmd, echo, echo2, capture, cwd))
+        return Job(self, child, result)
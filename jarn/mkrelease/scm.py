@@ -3,31 +3,49 @@ import re
 import tee
 
 from operator import itemgetter
+from urllib import unquote
+from collections import namedtuple
 
-from os.path import abspath, join, expanduser, dirname
+from os.path import abspath, join, expanduser, dirname, realpath
 from os.path import exists, isdir, isfile
 
 from process import Process
 from urlparser import URLParser
-from chdir import ChdirStack, chdir
+from gitreader import GitReader, readline
+from gitreader import ENVIRON as GIT_ENVIRON
+from hgreader import HgReader
+from svnreader import SvnReader, parse_info, parse_infos, parse_propnames
+from memo import memoize, invalidates
 from exit import err_exit, warn
 from lazy import lazy
 
 
+# The result of scanning a sandbox
+Status = namedtuple('Status', 'dirty unclean')
+
+
 class SCM(object):
     """Interface to source code management systems."""
 
     name = ''
     version_re = re.compile(r'version ([0-9.]+)', re.IGNORECASE)
 
+    # Assign a memo.Memo to cache read-only queries
+    memo = None
+
+    # Assign a tagindex.TagIndex to keep tag names on disk
+    tagindex = None
+
+    # Assign a versioncache.VersionCache to keep binary versions
+    versioncache = None
+
     def __init__(self, process=None, urlparser=None):
         self.process = process or Process(env=self.get_env())
         self.urlparser = urlparser or URLParser()
-        self.dirstack = ChdirStack()
 
     @lazy
     def version_info(self):
-        version = self.get_version()
+        version = self.get_cached_version()
         info = []
         if version:
             for number in version.split('.'):
@@ -37,6 +55,16 @@ class SCM(object):
                     break
         return tuple(info)
 
+    def get_cached_version(self):
+        if self.versioncache is None:
+            return self.get_version()
+        version = self.versioncache.lookup(self.name)
+        if version is None:
+            version = self.get_version()
+            if version:
+                self.versioncache.store(self.name, version)
+        return version
+
     def get_version(self):
         raise NotImplementedError
 
@@ -59,6 +87,9 @@ class SCM(object):
     def is_unclean_sandbox(self, dir):
         raise NotImplementedError
 
+    def get_status_from_sandbox(self, dir):
+        raise NotImplementedError
+
     def is_remote_sandbox(self, dir):
         raise NotImplementedError
 
@@ -77,6 +108,18 @@ class SCM(object):
     def clone_url(self, url, dir):
         raise NotImplementedError
 
+    def shallow_clone_url(self, url, dir, branch):
+        raise NotImplementedError
+
+    def mirror_url(self, url, dir):
+        raise NotImplementedError
+
+    def update_mirror(self, dir):
+        raise NotImplementedError
+
+    def clone_url_with_mirror(self, url, dir, mirror):
+        raise NotImplementedError
+
     def make_branchid(self, dir, branch):
         raise NotImplementedError
 
@@ -92,6 +135,16 @@ class SCM(object):
     def create_tag(self, dir, tagid, name, version, push):
         raise NotImplementedError
 
+    def atomic_unsupported(self, errors):
+        # Not 'atomic push failed for ref', which is a rejection
+        for line in errors:
+            if 'does not support --atomic' in line:
+                return True
+        return False
+
+    def push_sandbox(self, dir, tagid=None, branch=True):
+        raise NotImplementedError
+
     def check_valid_sandbox(self, dir):
         if not exists(dir):
             err_exit('No such file or directory: %(dir)s' % locals())
@@ -116,9 +169,16 @@ class Subversion(SCM):
 
     name = 'svn'
 
+    # Assign a layoutcache.LayoutCache to keep layouts on disk
+    layoutcache = None
+
+    def __init__(self, process=None, urlparser=None, reader=None):
+        SCM.__init__(self, process, urlparser)
+        self.reader = reader or SvnReader()
+
     def get_version(self):
         rc, lines = self.process.popen(
-            'svn --version', echo=False)
+            ['svn', '--version'], echo=False)
         if rc == 0 and lines:
             match = self.version_re.search(lines[0])
             if match is not None:
@@ -129,65 +189,87 @@ class Subversion(SCM):
         return self.urlparser.get_scheme(url) in \
             ('svn', 'svn+ssh', 'http', 'https', 'file')
 
+    @memoize
     def is_valid_sandbox(self, dir):
         if isdir(dir):
+            valid = self.reader.is_valid_sandbox(dir)
+            if valid is not None:
+                return valid
             rc, lines = self.process.popen(
-                'svn info "%(dir)s"' % locals(), echo=False, echo2=False)
+                ['svn', 'info', dir], echo=False, echo2=False)
             if rc == 0:
                 return True
         return False
 
+    @memoize
     def is_same_sandbox(self, dir, child_url):
-        rc, lines = self.process.popen(
-            'svn info "%(dir)s"' % locals(), echo=False, echo2=False)
-        if rc == 0 and lines:
-            if self.version_info[:2] >= (1, 7):
-                url = lines[2][5:]
-            else:
-                url = lines[1][5:]
-            if child_url.startswith(url):
+        info = self.get_info_from_sandbox(dir)
+        if info is not None:
+            if child_url.startswith(info.url):
                 return True
         return False
 
-    def is_dirty_sandbox(self, dir):
+    @memoize
+    def get_info_from_sandbox(self, dir):
+        # Returns an svnreader.Info or None
+        info = self.reader.get_info(dir)
+        if info is not None:
+            return info
         rc, lines = self.process.popen(
-            'svn status "%(dir)s"' % locals(), echo=False)
-        if rc == 0:
-            for line in lines:
-                if line[0:1] in ('M', 'A', 'R', 'D'):
-                    return True
-                if line[1:2] in ('M',):
-                    return True
-            return False
-        err_exit('Failed to get status from %(dir)s' % locals())
+            ['svn', 'info', '--xml', dir], echo=False, echo2=False)
+        if rc == 0 and lines:
+            return parse_info('\n'.join(lines))
+        return None
+
+    def is_dirty_sandbox(self, dir):
+        return self.get_status_from_sandbox(dir).dirty
 
     def is_unclean_sandbox(self, dir):
-        rc, lines = self.process.popen(
-            'svn status "%(dir)s"' % locals(), echo=False)
-        if rc == 0:
-            for line in lines:
-                if line[0:1] in ('M', 'A', 'R', 'D', 'C', '!', '~'):
-                    return True
-                if line[1:2] in ('M', 'C'):
-                    return True
-                if self.version_info[:2] >= (1, 6):
-                    if line[6:7] in ('C',):
-                        return True
+        return self.get_status_from_sandbox(dir).unclean
+
+    @memoize
+    def get_status_from_sandbox(self, dir):
+        # A dirty sandbox is unclean as well, so the scan can stop
+        # at the first dirty line. Unversioned items do not count
+        # and are not listed (-q).
+        unclean = []
+        def is_dirty(line):
+            if line[0:1] in ('M', 'A', 'R', 'D'):
+                return True
+            if line[1:2] in ('M',):
+                return True
+            if not unclean and self.is_unclean_line(line):
+                unclean.append(line)
             return False
+        rc, line = self.process.query(
+            ['svn', 'status', '-q', dir], is_dirty)
+        if rc == 0:
+            if line is not None:
+                return Status(True, True)
+            return Status(False, bool(unclean))
         err_exit('Failed to get status from %(dir)s' % locals())
 
+    def is_unclean_line(self, line):
+        if line[0:1] in ('C', '!', '~'):
+            return True
+        if line[1:2] in ('C',):
+            return True
+        if self.version_info[:2] >= (1, 6):
+            if line[6:7] in ('C',):
+                return True
+        return False
+
     def is_remote_sandbox(self, dir):
         return bool(self.get_url_from_sandbox(dir))
 
+    @memoize
     def get_root_from_sandbox(self, dir):
-        rc, lines = self.process.popen(
-            'svn info "%(dir)s"' % locals(), echo=False)
-        if rc == 0 and lines:
-            if self.version_info[:2] >= (1, 7):
-                url = lines[2][5:]
-            else:
-                url = lines[1][5:]
-            if not self.is_same_sandbox(dirname(dir), url):
+        root = self.reader.get_root(dir)
+        if root is not None:
+            return root
+        info = self.get_info_from_sandbox(dir)
+        if info is not None:
+            if dir == info.wcroot or not self.is_same_sandbox(dirname(dir), info.url):
                 return dir
             return self.get_root_from_sandbox(dirname(dir))
         err_exit('Failed to get root from %(dir)s' % locals())
@@ -217,38 +299,64 @@ class Subversion(SCM):
             err_exit('Failed to get layout from %(url)s' % locals())
         return '/'.join(parts)
 
+    @memoize
     def get_layout_from_sandbox(self, dir):
         url = self.get_base_url_from_sandbox(dir)
+        uuid = None
+        if self.layoutcache is not None:
+            info = self.get_info_from_sandbox(dir)
+            if info is not None:
+                uuid = info.uuid
+            if uuid:
+                layout = self.layoutcache.lookup(url, uuid)
+                if layout is not None:
+                    return layout
         rc, lines = self.process.popen(
-            'svn list "%(url)s"' % locals(), echo=False)
+            ['svn', 'list', url], echo=False)
         if rc == 0:
+            layout = None
             for line in lines:
                 if line[:-1] == 'tag':
-                    return ('trunk', 'branch', 'tag')
+                    layout = ('trunk', 'branch', 'tag')
+                    break
                 if line[:-1] == 'tags':
-                    return ('trunk', 'branches', 'tags')
+                    layout = ('trunk', 'branches', 'tags')
+                    break
+            if layout is not None:
+                if uuid:
+                    self.layoutcache.store(url, uuid, layout)
+                return layout
         err_exit('No tags directory found in %(url)s' % locals())
 
+    @memoize
     def get_url_from_sandbox(self, dir):
-        rc, lines = self.process.popen(
-            'svn info "%(dir)s"' % locals(), echo=False)
-        if rc == 0 and lines:
-            if self.version_info[:2] >= (1, 7):
-                return lines[2][5:]
-            else:
-                return lines[1][5:]
+        info = self.get_info_from_sandbox(dir)
+        if info is not None:
+            return info.url
         err_exit('Failed to get URL from %(dir)s' % locals())
 
+    @invalidates('get_status_from_sandbox')
     def commit_sandbox(self, dir, name, version, push):
         rc = self.process.system(
-            'svn commit -m"Prepare %(name)s %(version)s." "%(dir)s"' % locals())
+            ['svn', 'commit', '-m', 'Prepare %(name)s %(version)s.' % locals(), dir])
         if rc != 0:
             err_exit('Commit failed')
         return rc
 
+    @invalidates()
     def clone_url(self, url, dir):
         rc = self.process.system(
-            'svn checkout "%(url)s" "%(dir)s"' % locals())
+            ['svn', 'checkout', url, dir])
+        if rc != 0:
+            err_exit('Checkout failed')
+        return rc
+
+    @invalidates()
+    def shallow_clone_url(self, url, dir, branch):
+        # A working copy holds no history; check out the branch
+        # directly instead of switching to it afterwards
+        rc = self.process.system(
+            ['svn', 'checkout', branch or url, dir])
         if rc != 0:
             err_exit('Checkout failed')
         return rc
@@ -258,10 +366,10 @@ class Subversion(SCM):
             return self.urlparser.abspath(branch)
         return branch
 
-    @chdir
+    @invalidates()
     def switch_branch(self, dir, branch):
         rc = self.process.system(
-            'svn switch "%(branch)s"' % locals())
+            ['svn', 'switch', branch], cwd=dir)
         if rc != 0:
             err_exit('Switch failed')
         return rc
@@ -278,34 +386,132 @@ class Subversion(SCM):
         layout = self.get_layout_from_sandbox(dir)
         return '/'.join(parts + [layout[2], version])
 
+    @memoize
     def tag_exists(self, dir, tagid):
-        url, version = tagid.rsplit('/', 1)
+        # Probe the tag itself; listing the tags directory gets
+        # slower with every tag. Asking for the tags directory in the
+        # same call tells a missing tag from an unreachable server.
+        url = tagid.rsplit('/', 1)[0]
         rc, lines = self.process.popen(
-            'svn list "%(url)s"' % locals(), echo=False)
-        if rc == 0:
-            for line in lines:
-                if line[:-1] == version:
-                    return True
+            ['svn', 'info', '--xml', url, tagid], echo=False, echo2=False)
+        urls = [unquote(x.url) for x in parse_infos('\n'.join(lines))]
+        if unquote(tagid) in urls:
+            return True
+        if unquote(url) in urls:
             return False
         err_exit('Failed to get tags from %(url)s' % locals())
 
+    @invalidates('tag_exists', 'get_status_from_sandbox')
     def create_tag(self, dir, tagid, name, version, push):
         url = self.get_url_from_sandbox(dir)
         rc, lines = self.process.popen(
-            ('svn copy -m"Tagged %(name)s %(version)s." "%(url)s" "%(tagid)s"' % locals()),
+            ['svn', 'copy', '-m', 'Tagged %(name)s %(version)s.' % locals(), url, tagid],
             echo=tee.NotEmpty())
         if rc != 0:
             err_exit('Tag failed')
         return rc
 
+    @lazy
+    def has_svnmucc(self):
+        rc, lines = self.process.popen(
+            ['svnmucc', '--version'], echo=False, echo2=False)
+        return rc == 0
+
+    def get_modified_files(self, dir):
+        """Return (path, info) pairs for the modified files in 'dir'.
+
+        Returns None if the sandbox has changes other than text
+        modifications of versioned files, or if a modified file has
+        svn:keywords or svn:eol-style set.
+        """
+        rc, lines = self.process.popen(
+            ['svn', 'status', '-q', dir], echo=False)
+        if rc != 0:
+            return None
+        paths = []
+        for line in lines:
+            if line[0:1] != 'M' or line[1:8].strip():
+                return None
+            paths.append(line[8:])
+        if not paths:
+            return []
+        rc, lines = self.process.popen(
+            ['svn', 'info', '--xml'] + paths, echo=False)
+        if rc != 0:
+            return None
+        infos = parse_infos('\n'.join(lines))
+        if len(infos) != len(paths):
+            return None
+        # svn commit contracts keywords and normalizes line endings,
+        # svnmucc put uploads the file as it is
+        rc, lines = self.process.popen(
+            ['svn', 'proplist', '--xml'] + paths, echo=False)
+        if rc != 0:
+            return None
+        names = parse_propnames('\n'.join(lines))
+        if names is None or names & set(['svn:keywords', 'svn:eol-style']):
+            return None
+        return zip(paths, infos)
+
+    @invalidates('tag_exists', 'get_status_from_sandbox')
+    def commit_and_tag_sandbox(self, dir, tagid, name, version):
+        """Commit the modified files in 'dir' and create the tag in one
+        revision, using svnmucc.
+
+        Returns False if this is not possible, in which case nothing
+        has been committed. Use commit_sandbox and create_tag instead.
+        """
+        if not self.has_svnmucc:
+            return False
+        files = self.get_modified_files(dir)
+        if files is None:
+            return False
+        url = self.get_url_from_sandbox(dir)
+        cmd = ['svnmucc', '-m', 'Prepare and tag %(name)s %(version)s.' % locals()]
+        if files:
+            # Fail like svn commit if a file changed in the repository
+            cmd += ['-r', str(min([info.revision for path, info in files]))]
+        cmd += ['cp', 'HEAD', url, tagid]
+        for path, info in files:
+            if not info.url.startswith(url + '/'):
+                return False
+            cmd += ['put', path, info.url, 'put', path, tagid + info.url[len(url):]]
+        rc, lines = self.process.popen(cmd, echo=tee.NotEmpty())
+        if rc != 0:
+            return False
+        if files:
+            # Bring the sandbox up to the revision containing its changes
+            rc = self.process.system(
+                ['svn', 'update', '-q', dir])
+            if rc != 0:
+                warn('Update failed')
+        return True
+
+    def atomic_unsupported(self, errors):
+        # Not 'atomic push failed for ref', which is a rejection
+        for line in errors:
+            if 'does not support --atomic' in line:
+                return True
+        return False
+
+    def push_sandbox(self, dir, tagid=None, branch=True):
+        # Commits and tags go to the server directly
+        return 0
+
 
 class Mercurial(SCM):
 
     name = 'hg'
 
+    def __init__(self, process=None, urlparser=None, reader=None):
+        SCM.__init__(self, process, urlparser)
+        self.reader = reader or HgReader()
+        # Maps shallow sandboxes to the URLs they were cloned from
+        self.shallow_urls = {}
+
     def get_version(self):
         rc, lines = self.process.popen(
-            'hg --version', echo=False)
+            ['hg', '--version'], echo=False)
         if rc == 0 and lines:
             match = self.version_re.search(lines[0])
             if match is not None:
@@ -316,59 +522,70 @@ class Mercurial(SCM):
         return self.urlparser.get_scheme(url) in \
             ('ssh', 'http', 'https', 'file')
 
+    @memoize
     def is_valid_sandbox(self, dir):
         if isdir(dir):
-            self.dirstack.push(dir)
-            try:
-                rc, lines = self.process.popen(
-                    'hg status', echo=False, echo2=False)
-                if rc == 0:
-                    return True
-            finally:
-                self.dirstack.pop()
+            valid = self.reader.is_valid_sandbox(dir)
+            if valid is not None:
+                return valid
+            rc, lines = self.process.popen(
+                ['hg', 'status'], echo=False, echo2=False, cwd=dir)
+            if rc == 0:
+                return True
         return False
 
-    @chdir
     def is_dirty_sandbox(self, dir):
-        rc, lines = self.process.popen(
-            'hg status -mar .', echo=False)
-        if rc == 0:
-            return bool(lines)
-        err_exit('Failed to get status from %(dir)s' % locals())
+        return self.get_status_from_sandbox(dir).dirty
 
-    @chdir
     def is_unclean_sandbox(self, dir):
+        return self.get_status_from_sandbox(dir).unclean
+
+    @memoize
+    def get_status_from_sandbox(self, dir):
         rc, lines = self.process.popen(
-            'hg status -mard .', echo=False)
+            ['hg', 'status', '-mard', '.'], echo=False, cwd=dir)
         if rc == 0:
-            return bool(lines)
+            dirty = False
+            for line in lines:
+                if line[0:1] in ('M', 'A', 'R'):
+                    dirty = True
+                    break
+            return Status(dirty, bool(lines))
         err_exit('Failed to get status from %(dir)s' % locals())
 
-    @chdir
     def is_remote_sandbox(self, dir):
         return bool(self.get_url_from_sandbox(dir))
 
-    @chdir
+    @memoize
     def get_root_from_sandbox(self, dir):
+        root = self.reader.get_root(dir)
+        if root is not None:
+            return root
         rc, lines = self.process.popen(
-            'hg root', echo=False)
+            ['hg', 'root'], echo=False, cwd=dir)
         if rc == 0 and lines:
             return lines[0]
         err_exit('Failed to get root from %(dir)s' % locals())
 
-    @chdir
+    @memoize
     def get_branch_from_sandbox(self, dir):
+        branch = self.reader.get_branch(dir)
+        if branch is not None:
+            return branch
         rc, lines = self.process.popen(
-            'hg branch', echo=False)
+            ['hg', 'branch'], echo=False, cwd=dir)
         if rc == 0 and lines:
             return lines[0]
         err_exit('Failed to get branch from %(dir)s' % locals())
 
-    @chdir
+    @memoize
     def get_url_from_sandbox(self, dir):
         self.get_branch_from_sandbox(dir) # Called here for its error checking only
+        url = self.reader.get_path(dir)
+        if url is not None:
+            return url
         rc, lines = self.process.popen(
-            'hg show paths.default', echo=False)
+            ['hg', 'show', 'paths.default'], echo=False, cwd=dir)
         if rc == 0:
             if lines:
                 return lines[0]
@@ -376,17 +593,17 @@ class Mercurial(SCM):
             err_exit('Failed to get URL from %(dir)s' % locals())
         return ''
 
-    @chdir
+    @invalidates('get_status_from_sandbox')
     def commit_sandbox(self, dir, name, version, push):
         rc = self.process.system(
-            'hg commit -v -m"Prepare %(name)s %(version)s." .' % locals())
+            ['hg', 'commit', '-v', '-m', 'Prepare %(name)s %(version)s.' % locals(), '.'], cwd=dir)
         if rc not in (0, 1):    # 1 means empty commit
             err_exit('Commit failed')
         rc = 0
         if push:
             if self.is_remote_sandbox(dir):
                 rc = self.process.system(
-                    'hg push default')
+                    ['hg', 'push', 'default'], cwd=dir)
                 if self.version_info[:2] >= (2, 1):
                     if rc not in (0, 1):    # 1 means empty push
                         err_exit('Push failed')
@@ -398,20 +615,57 @@ class Mercurial(SCM):
                 warn('No default path found; not pushing the commit')
         return rc
 
+    @invalidates()
     def clone_url(self, url, dir):
         rc = self.process.system(
-            'hg clone "%(url)s" "%(dir)s"' % locals())
+            ['hg', 'clone', url, dir])
+        if rc != 0:
+            err_exit('Clone failed')
+        return rc
+
+    def mirror_url(self, url, dir):
+        rc = self.process.system(
+            ['hg', 'clone', '-U', url, dir])
         if rc != 0:
             err_exit('Clone failed')
         return rc
 
+    def update_mirror(self, dir):
+        rc = self.process.system(
+            ['hg', 'pull'], cwd=dir)
+        if rc != 0:
+            err_exit('Pull failed')
+        return rc
+
+    @invalidates()
+    def clone_url_with_mirror(self, url, dir, mirror):
+        rc = self.process.system(
+            ['hg', 'clone', mirror, dir])
+        if rc != 0:
+            err_exit('Clone failed')
+        # Pull from and push to 'url', not the mirror
+        with open(join(dir, '.hg', 'hgrc'), 'wt') as file:
+            file.write('[paths]\ndefault = %s\n' % url)
+        return rc
+
+    @invalidates()
+    def shallow_clone_url(self, url, dir, branch):
+        # Pull the ancestors of 'branch' only
+        branch = branch or 'default'
+        rc = self.process.system(
+            ['hg', 'clone', '-r', branch, '-u', branch, url, dir])
+        if rc != 0:
+            err_exit('Clone failed')
+        self.shallow_urls[abspath(dir)] = url
+        return rc
+
     def make_branchid(self, dir, branch):
         return branch
 
-    @chdir
+    @invalidates()
     def switch_branch(self, dir, branch):
         rc = self.process.system(
-            'hg update "%(branch)s"' % locals())
+            ['hg', 'update', branch], cwd=dir)
         if rc != 0:
             err_exit('Update failed')
         return rc
@@ -419,41 +673,139 @@ class Mercurial(SCM):
     def make_tagid(self, dir, version):
         return version
 
-    @chdir
+    @memoize
     def tag_exists(self, dir, tagid):
+        exists = self.local_tag_exists(dir, tagid)
+        if not exists and abspath(dir) in self.shallow_urls:
+            # A shallow clone lacks the tags committed on other heads
+            return self.remote_tag_exists(dir, tagid)
+        return exists
+
+    def local_tag_exists(self, dir, tagid):
+        if self.tagindex is not None:
+            exists = self.tag_exists_in_index(dir, tagid)
+            if exists is not None:
+                return exists
+        # A literal tag() aborts if the tag does not exist, a regex
+        # match does not
+        revset = "tag(r're:^%s$')" % re.escape(tagid)
         rc, lines = self.process.popen(
-            'hg tags', echo=False)
+            ['hg', 'log', '-r', revset, '--template', 'x'], echo=False, cwd=dir)
         if rc == 0:
-            for line in lines:
-                if line.split()[0] == tagid:
-                    return True
-            return False
+            return lines != []
         err_exit('Failed to get tags from %(dir)s' % locals())
 
-    @chdir
+    def remote_tag_exists(self, dir, tagid):
+        # Remote repositories resolve symbols, not revsets. A branch
+        # or bookmark of the same name counts as a tag, which errs on
+        # the safe side.
+        url = self.shallow_urls[abspath(dir)]
+        errors = []
+        rc, lines = self.process.popen(
+            ['hg', 'identify', '-r', tagid, url], echo=False,
+            echo2=tee.Tap(False, errors))
+        if rc == 0:
+            return True
+        for line in errors:
+            if line.startswith('abort: unknown revision'):
+                return False
+        err_exit('Failed to get tags from %(url)s' % locals())
+
+    def tag_exists_in_index(self, dir, tagid):
+        # Return None if the index cannot be used
+        stamp = self.get_tags_stamp_from_sandbox(dir)
+        if stamp is None:
+            return None
+        root, stamp = stamp
+        exists = self.tagindex.lookup(root, stamp, tagid)
+        if exists is None:
+            rc, lines = self.process.popen(
+                ['hg', 'tags', '-q'], echo=False, echo2=False, cwd=dir)
+            if rc != 0:
+                return None
+            self.tagindex.store(root, stamp, lines)
+            exists = tagid in lines
+        return exists
+
+    def get_tags_stamp_from_sandbox(self, dir):
+        # Tags change only with the changelog, the local tags, or
+        # the obsolescence markers. Returns (root, stamp) or None.
+        root = abspath(dir)
+        while not isdir(join(root, '.hg')):
+            parent = dirname(root)
+            if parent == root:
+                return None
+            root = parent
+        hgdir = join(root, '.hg')
+        if exists(join(hgdir, 'sharedpath')):
+            return None
+        store = join(hgdir, 'store')
+        if not isdir(store):
+            store = hgdir
+        stamp = []
+        for filename in (join(store, '00changelog.i'),
+                         join(store, 'obsstore'),
+                         join(hgdir, 'localtags')):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                stamp.append('-')
+            else:
+                stamp.append('%d:%d:%r' % (st.st_ino, st.st_size, st.st_mtime))
+        return root, ' '.join(stamp)
+
+    @invalidates('tag_exists', 'get_status_from_sandbox')
     def create_tag(self, dir, tagid, name, version, push):
         rc = self.process.system(
-            'hg tag -m"Tagged %(name)s %(version)s." "%(tagid)s"' % locals())
+            ['hg', 'tag', '-m', 'Tagged %(name)s %(version)s.' % locals(), tagid], cwd=dir)
         if rc != 0:
             err_exit('Tag failed')
         if push:
             if self.is_remote_sandbox(dir):
                 rc = self.process.system(
-                    'hg push default')
+                    ['hg', 'push', 'default'], cwd=dir)
                 if rc != 0:
                     err_exit('Push failed')
             else:
                 warn('No default path found; not pushing the tag')
         return rc
 
+    def atomic_unsupported(self, errors):
+        # Not 'atomic push failed for ref', which is a rejection
+        for line in errors:
+            if 'does not support --atomic' in line:
+                return True
+        return False
+
+    def push_sandbox(self, dir, tagid=None, branch=True):
+        # A push applies all changesets in one transaction
+        if self.is_remote_sandbox(dir):
+            rc = self.process.system(
+                ['hg', 'push', 'default'], cwd=dir)
+            if self.version_info[:2] >= (2, 1):
+                if rc not in (0, 1):    # 1 means empty push
+                    err_exit('Push failed')
+                rc = 0
+            else:
+                if rc != 0:
+                    err_exit('Push failed')
+            return rc
+        warn('No default path found; not pushing')
+        return 0
+
 
 class Git(SCM):
 
     name = 'git'
+    commit_re = re.compile(r'^[0-9a-f]{40}$')
+
+    def __init__(self, process=None, urlparser=None, reader=None):
+        SCM.__init__(self, process, urlparser)
+        self.reader = reader or GitReader()
 
     def get_version(self):
         rc, lines = self.process.popen(
-            'git --version', echo=False)
+            ['git', '--version'], echo=False)
         if rc == 0 and lines:
             match = self.version_re.search(lines[0])
             if match is not None:
@@ -468,65 +820,75 @@ class Git(SCM):
             return True
         return False
 
+    @memoize
     def is_valid_sandbox(self, dir):
         if isdir(dir):
-            self.dirstack.push(dir)
-            try:
-                rc, lines = self.process.popen(
-                    'git rev-parse --is-inside-work-tree', echo=False, echo2=False)
-                if rc == 0 and lines:
-                    return lines[0] == 'true'
-            finally:
-                self.dirstack.pop()
+            valid = self.reader.is_valid_sandbox(dir)
+            if valid is not None:
+                return valid
+            rc, lines = self.process.popen(
+                ['git', 'rev-parse', '--is-inside-work-tree'], echo=False, echo2=False, cwd=dir)
+            if rc == 0 and lines:
+                return lines[0] == 'true'
         return False
 
-    @chdir
     def is_dirty_sandbox(self, dir):
+        return self.get_status_from_sandbox(dir).dirty
+
+    def is_unclean_sandbox(self, dir):
+        return self.get_status_from_sandbox(dir).unclean
+
+    @memoize
+    def get_status_from_sandbox(self, dir):
+        # Untracked files do not count; git uses fsmonitor if the
+        # repository is configured for it
         if self.version_info[:2] >= (1, 7):
-            rc, lines = self.process.popen(
-                'git status --porcelain --untracked-files=no .', echo=False)
+            cmd = ['git', 'status', '--porcelain', '--untracked-files=no']
+            if self.version_info[:2] >= (2, 18):
+                cmd.append('--no-renames')
+            rc, line = self.process.query(
+                cmd + ['.'], tee.NotEmpty(), cwd=dir)
             if rc == 0:
-                return bool(lines)
+                dirty = line is not None
+                return Status(dirty, dirty)
         else:
             rc, lines = self.process.popen(
-                'git status .', echo=False)
+                ['git', 'status', '.'], echo=False, cwd=dir)
             if rc == 0:
-                return True
+                return Status(True, True)
             if rc == 1:
-                return False
+                return Status(False, False)
         err_exit('Failed to get status from %(dir)s' % locals())
 
-    @chdir
-    def is_unclean_sandbox(self, dir):
-        return self.is_dirty_sandbox(dir)
-
-    @chdir
     def is_remote_sandbox(self, dir):
         return bool(self.get_remote_from_sandbox(dir))
 
-    @chdir
+    @memoize
     def get_root_from_sandbox(self, dir):
+        root = self.reader.get_root(dir)
+        if root is not None:
+            return root
         rc, lines = self.process.popen(
-            'git rev-parse --show-toplevel', echo=False)
+            ['git', 'rev-parse', '--show-toplevel'], echo=False, cwd=dir)
         if rc == 0 and lines:
             return lines[0]
         err_exit('Failed to get root from %(dir)s' % locals())
 
-    @chdir
+    @memoize
     def get_branch_from_sandbox(self, dir):
-        rc, lines = self.process.popen(
-            'git branch', echo=False)
-        if rc == 0:
-            for line in lines:
-                if line.startswith('*'):
-                    return line[2:]
+        branch = self.reader.get_branch(dir)
+        if branch is not None:
+            return branch
+        rc, line = self.process.query(
+            ['git', 'branch'], tee.StartsWith('*'), cwd=dir)
+        if rc == 0 and line is not None:
+            return line[2:]
         err_exit('Failed to get branch from %(dir)s' % locals())
 
-    @chdir
+    @memoize
     def get_remote_from_sandbox(self, dir):
         branch = self.get_branch_from_sandbox(dir)
-        rc, lines = self.process.popen(
-            'git config -l', echo=False)
+        rc, lines = self.get_config_from_sandbox(dir)
         if rc == 0 and lines:
             key = 'branch.%(branch)s.remote=' % locals()
             for line in reversed(lines):
@@ -536,11 +898,10 @@ class Git(SCM):
             err_exit('Failed to get remote from %(branch)s' % locals())
         return ''
 
-    @chdir
+    @memoize
     def get_tracked_branch_from_sandbox(self, dir):
         branch = self.get_branch_from_sandbox(dir)
-        rc, lines = self.process.popen(
-            'git config -l', echo=False)
+        rc, lines = self.get_config_from_sandbox(dir)
         if rc == 0 and lines:
             key = 'branch.%(branch)s.merge=' % locals()
             for line in reversed(lines):
@@ -550,12 +911,11 @@ class Git(SCM):
             err_exit('Failed to get tracked branch from %(branch)s' % locals())
         return ''
 
-    @chdir
+    @memoize
     def get_url_from_sandbox(self, dir):
         remote = self.get_remote_from_sandbox(dir)
         if remote:
-            rc, lines = self.process.popen(
-                'git config -l', echo=False)
+            rc, lines = self.get_config_from_sandbox(dir)
             if rc == 0 and lines:
                 key = 'remote.%(remote)s.url=' % locals()
                 for line in reversed(lines):
@@ -565,10 +925,18 @@ class Git(SCM):
                 err_exit('Failed to get URL from %(dir)s' % locals())
         return ''
 
-    @chdir
+    @memoize
+    def get_config_from_sandbox(self, dir):
+        lines = self.reader.get_config_lines(dir)
+        if lines is not None:
+            return 0, lines
+        return self.process.popen(
+            ['git', 'config', '-l'], echo=False, cwd=dir)
+
+    @invalidates('get_status_from_sandbox')
     def commit_sandbox(self, dir, name, version, push):
         rc = self.process.system(
-            'git commit -m"Prepare %(name)s %(version)s." .' % locals())
+            ['git', 'commit', '-m', 'Prepare %(name)s %(version)s.' % locals(), '.'], cwd=dir)
         if rc not in (0, 1):
             err_exit('Commit failed')
         rc = 0
@@ -579,7 +947,7 @@ class Git(SCM):
                 tracked = self.get_tracked_branch_from_sandbox(dir)
                 if tracked:
                     rc = self.process.system(
-                        'git push "%(remote)s" "%(branch)s:%(tracked)s"' % locals())
+                        ['git', 'push', remote, '%(branch)s:%(tracked)s' % locals()], cwd=dir)
                     if rc != 0:
                         err_exit('Push failed')
                     return rc
@@ -587,20 +955,75 @@ class Git(SCM):
                  'not pushing the commit' % locals())
         return rc
 
+    @invalidates()
     def clone_url(self, url, dir):
         rc = self.process.system(
-            'git clone "%(url)s" "%(dir)s"' % locals())
+            ['git', 'clone', url, dir])
         if rc != 0:
             err_exit('Clone failed')
         return rc
 
+    def mirror_url(self, url, dir):
+        rc = self.process.system(
+            ['git', 'clone', '--mirror', url, dir])
+        if rc != 0:
+            err_exit('Clone failed')
+        return rc
+
+    def update_mirror(self, dir):
+        # Neither prune nor gc; checkouts may borrow any object
+        rc = self.process.system(
+            ['git', '-c', 'gc.auto=0', 'fetch', 'origin'], cwd=dir)
+        if rc != 0:
+            err_exit('Fetch failed')
+        return rc
+
+    @invalidates()
+    def clone_url_with_mirror(self, url, dir, mirror):
+        rc = self.process.system(
+            ['git', 'clone', '--reference', mirror, url, dir])
+        if rc != 0:
+            err_exit('Clone failed')
+        return rc
+
+    @invalidates()
+    def shallow_clone_url(self, url, dir, branch):
+        if self.commit_re.match(branch):
+            return self._shallow_fetch_url(url, dir, branch)
+        rc = self.process.system(
+            ['git', 'clone', '--depth', '1', '--single-branch', '--branch', branch, url, dir])
+        if rc != 0:
+            err_exit('Clone failed; shallow clones need a branch, a tag, '
+                     'or a full commit id')
+        return rc
+
+    def _shallow_fetch_url(self, url, dir, commit):
+        # Clone --branch does not take commit ids; fetch the commit
+        rc = self.process.system(
+            ['git', 'init', '-q', dir])
+        if rc == 0:
+            rc = self.process.system(
+                ['git', 'remote', 'add', 'origin', url], cwd=dir)
+        if rc != 0:
+            err_exit('Clone failed')
+        rc = self.process.system(
+            ['git', 'fetch', '--depth', '1', 'origin', commit], cwd=dir)
+        if rc != 0:
+            err_exit('Clone failed; the remote may not allow to fetch '
+                     'commit %(commit)s by id' % locals())
+        rc = self.process.system(
+            ['git', 'checkout', '-q', 'FETCH_HEAD'], cwd=dir)
+        if rc != 0:
+            err_exit('Checkout failed')
+        return rc
+
     def make_branchid(self, dir, branch):
         return branch or 'master'
 
-    @chdir
+    @invalidates()
     def switch_branch(self, dir, branch):
         rc = self.process.system(
-            'git checkout -q "%(branch)s"' % locals())
+            ['git', 'checkout', '-q', branch], cwd=dir)
         if rc != 0:
             err_exit('Checkout failed')
         return rc
@@ -608,21 +1031,46 @@ class Git(SCM):
     def make_tagid(self, dir, version):
         return version
 
-    @chdir
+    @memoize
     def tag_exists(self, dir, tagid):
+        exists = self.reader.tag_exists(dir, tagid)
+        if exists is None:
+            rc, lines = self.process.popen(
+                ['git', 'show-ref', '--verify', '--quiet', 'refs/tags/' + tagid],
+                echo=False, cwd=dir)
+            if rc not in (0, 1):
+                err_exit('Failed to get tags from %(dir)s' % locals())
+            exists = rc == 0
+        if not exists and self.is_shallow_sandbox(dir):
+            # A shallow clone lacks the tags of older commits
+            return self.remote_tag_exists(dir, tagid)
+        return exists
+
+    @memoize
+    def is_shallow_sandbox(self, dir):
+        shallow = self.reader.is_shallow(dir)
+        if shallow is not None:
+            return shallow
         rc, lines = self.process.popen(
-            'git tag', echo=False)
-        if rc == 0:
-            for line in lines:
-                if line == tagid:
-                    return True
+            ['git', 'rev-parse', '--is-shallow-repository'], echo=False, cwd=dir)
+        if rc == 0 and lines:
+            return lines[0] == 'true'
+        err_exit('Failed to get status from %(dir)s' % locals())
+
+    def remote_tag_exists(self, dir, tagid):
+        remote = self.get_remote_from_sandbox(dir)
+        if not remote:
             return False
-        err_exit('Failed to get tags from %(dir)s' % locals())
+        rc, lines = self.process.popen(
+            ['git', 'ls-remote', '--tags', remote, 'refs/tags/' + tagid], echo=False, cwd=dir)
+        if rc == 0:
+            return bool(lines)
+        err_exit('Failed to get tags from %(remote)s' % locals())
 
-    @chdir
+    @invalidates('tag_exists', 'get_status_from_sandbox')
     def create_tag(self, dir, tagid, name, version, push):
         rc = self.process.system(
-            'git tag -m"Tagged %(name)s %(version)s." "%(tagid)s"' % locals())
+            ['git', 'tag', '-m', 'Tagged %(name)s %(version)s.' % locals(), tagid], cwd=dir)
         if rc != 0:
             err_exit('Tag failed')
         if push:
@@ -632,7 +1080,7 @@ class Git(SCM):
                 tracked = self.get_tracked_branch_from_sandbox(dir)
                 if tracked:
                     rc = self.process.system(
-                        'git push "%(remote)s" tag "%(tagid)s"' % locals())
+                        ['git', 'push', remote, 'tag', tagid], cwd=dir)
                     if rc != 0:
                         err_exit('Push failed')
                     return rc
@@ -640,6 +1088,48 @@ class Git(SCM):
                  'not pushing the tag' % locals())
         return rc
 
+    def atomic_unsupported(self, errors):
+        # Not 'atomic push failed for ref', which is a rejection
+        for line in errors:
+            if 'does not support --atomic' in line:
+                return True
+        return False
+
+    def push_sandbox(self, dir, tagid=None, branch=True):
+        # Push the branch and the tag in one go
+        current = self.get_branch_from_sandbox(dir)
+        remote = self.get_remote_from_sandbox(dir)
+        if remote:
+            tracked = self.get_tracked_branch_from_sandbox(dir)
+            if tracked:
+                refs = []
+                if branch:
+                    refs.append('%(current)s:%(tracked)s' % locals())
+                if tagid:
+                    refs.append('refs/tags/%(tagid)s' % locals())
+                if not refs:
+                    return 0
+                rc = None
+                if len(refs) > 1 and self.version_info[:2] >= (2, 4):
+                    errors = []
+                    rc, lines = self.process.popen(
+                        ['git', 'push', '--atomic', remote] + refs,
+                        echo2=tee.Tap(True, errors), cwd=dir)
+                    # Retry only if the remote lacks atomic pushes; it
+                    # must not get a second chance to prompt or to
+                    # take rejected refs one by one.
+                    if rc != 0 and self.atomic_unsupported(errors):
+                        rc = None
+                if rc is None:
+                    rc = self.process.system(
+                        ['git', 'push', remote] + refs, cwd=dir)
+                if rc != 0:
+                    err_exit('Push failed')
+                return rc
+        warn('%(current)s does not track a remote branch; '
+             'not pushing' % locals())
+        return 0
+
 
 class SCMFactory(object):
     """Hands out SCM objects."""
@@ -659,6 +1149,9 @@ class SCMFactory(object):
         dir = abspath(expanduser(dir))
         if not exists(dir):
             err_exit('No such file or directory: %(dir)s' % locals())
+        scm = self._find_marked_scm(dir)
+        if scm is not None:
+            return scm
         matches = self._find_scms(dir)
         if not matches:
             err_exit('Not a sandbox: %(dir)s' % locals())
@@ -676,12 +1169,59 @@ class SCMFactory(object):
         err_exit('%(names)s found in %(dir)s\n'
                  'Please specify %(flags)s to resolve' % locals())
 
+    def _find_marked_scm(self, dir):
+        # Find the SCM whose marker is closest to dir, without
+        # running SCM binaries. Returns None if the markers are
+        # ambiguous; the SCMs must decide then.
+        names = self._find_markers(dir)
+        if names is None or len(names) != 1:
+            return None
+        scm = self.get_scm_from_type(names[0])
+        if scm.is_valid_sandbox(dir):
+            return scm
+        return None
+
+    def _find_markers(self, dir):
+        # Walk up from dir and return the names of the SCMs marking
+        # the first directory that has any, or None
+        for name in GIT_ENVIRON:
+            if name in os.environ:
+                return None
+        dir = realpath(dir)
+        if not isdir(dir):
+            return None
+        device = os.stat(dir).st_dev
+        while True:
+            names = []
+            for klass in self.scms:
+                marker = join(dir, '.' + klass.name)
+                if isdir(marker):
+                    if klass.name == 'svn' and not isfile(join(marker, 'wc.db')):
+                        # Subversion 1.6 marks every directory, not
+                        # just the root
+                        return None
+                    names.append(klass.name)
+                elif klass.name == 'git' and isfile(marker):
+                    # A linked work tree or submodule
+                    try:
+                        if readline(marker).startswith('gitdir: '):
+                            names.append(klass.name)
+                    except EnvironmentError:
+                        return None
+            if names:
+                return names
+            parent = dirname(dir)
+            if parent == dir or os.stat(parent).st_dev != device:
+                return None
+            dir = parent
+
     def _find_scms(self, dir):
         # Find all SCMs in dir
         matches = []
         for klass in self.scms:
-            if klass().is_valid_sandbox(dir):
-                matches.append(klass())
+            scm = klass()
+            if scm.is_valid_sandbox(dir):
+                matches.append(scm)
         return matches
 
     def _find_closest(self, dir, matches):
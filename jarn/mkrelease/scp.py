@@ -4,7 +4,7 @@ import random
 
 from os.path import basename
 
-from process import Process
+from process import Process, AsyncProcess
 from exit import err_exit
 
 
@@ -19,46 +19,60 @@ class SCP(object):
         time.sleep(random.choice([0.3, 0.4]))
 
     def run_scp(self, distfile, location):
-        if not self.process.quiet:
-            print 'running scp_upload'
-            self.delay()
-            name = basename(distfile)
-            print 'Uploading dist/%(name)s to %(location)s' % locals()
-
-        try:
-            rc, lines = self.process.popen(
-                'scp "%(distfile)s" "%(location)s"' % locals(),
-                echo=False)
-            if rc == 0:
-                if not self.process.quiet:
-                    print 'OK'
-                return rc
-        except KeyboardInterrupt:
-            pass
-        err_exit('ERROR: scp failed')
+        return self.run_uploads(distfile, [('scp', location)])
 
     def run_sftp(self, distfile, location):
+        return self.run_uploads(distfile, [('sftp', location)])
+
+    def run_uploads(self, distfile, uploads):
+        """Upload 'distfile' to several locations at once.
+
+        'uploads' is a list of (scheme, location) tuples, where scheme
+        is 'scp' or 'sftp'.
+        """
         if not self.process.quiet:
-            print 'running sftp_upload'
             self.delay()
             name = basename(distfile)
-            print 'Uploading dist/%(name)s to %(location)s' % locals()
-
-        with tempfile.NamedTemporaryFile() as file:
-            file.write('put "%(distfile)s"\n' % locals())
-            file.write('bye\n')
-            file.flush()
-            cmdfile = file.name
+            for scheme, location in uploads:
+                print 'running %(scheme)s_upload' % locals()
+                print 'Uploading dist/%(name)s to %(location)s' % locals()
 
+        process = AsyncProcess(process=self.process)
+        cmdfiles = []
+        results = []
+        try:
             try:
-                rc, lines = self.process.popen(
-                    'sftp -b "%(cmdfile)s" "%(location)s"' % locals(),
-                    echo=False)
-                if rc == 0:
-                    if not self.process.quiet:
-                        print 'OK'
-                    return rc
+                jobs = []
+                for scheme, location in uploads:
+                    if scheme == 'sftp':
+                        cmdfile = self.make_cmdfile(distfile)
+                        cmdfiles.append(cmdfile)
+                        cmd = ['sftp', '-b', cmdfile.name, location]
+                    else:
+                        cmd = ['scp', distfile, location]
+                    jobs.append(process.popen(cmd, echo=False))
+                results = process.gather(*jobs)
             except KeyboardInterrupt:
                 pass
-            err_exit('ERROR: sftp failed')
+        finally:
+            for cmdfile in cmdfiles:
+                cmdfile.close()
+
+        # Interrupted uploads count as failed
+        results += [(1, [])] * (len(uploads) - len(results))
+        for (scheme, location), (rc, lines) in zip(uploads, results):
+            if rc != 0:
+                if len(uploads) > 1:
+                    err_exit('ERROR: %(scheme)s to %(location)s failed' % locals())
+                err_exit('ERROR: %(scheme)s failed' % locals())
+        if not self.process.quiet:
+            print 'OK'
+        return 0
 
+    def make_cmdfile(self, distfile):
+        # The file is deleted when closed
+        file = tempfile.NamedTemporaryFile()
+        file.write('put "%(distfile)s"\n' % locals())
+        file.write('bye\n')
+        file.flush()
+        return file
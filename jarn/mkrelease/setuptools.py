@@ -1,4 +1,5 @@
 import os
+import sys
 import distutils.command
 import pkg_resources
 
@@ -7,7 +8,6 @@ from os.path import abspath, join, isfile
 from python import Python
 from process import Process
 from configparser import ConfigParser
-from chdir import chdir
 from exit import err_exit, warn
 from tee import *
 
@@ -44,21 +44,19 @@ class Setuptools(object):
         if not self.is_valid_package(dir):
             err_exit('No setup.py found in %(dir)s' % locals())
 
-    @chdir
     def get_package_info(self, dir, develop=False):
-        python = self.python
+        python = str(self.python)
         rc, lines = self.process.popen(
-            '"%(python)s" setup.py --name --version' % locals(), echo=False)
+            [python, 'setup.py', '--name', '--version'], echo=False, cwd=dir)
         if rc == 0 and len(lines) == 2:
             name, version = lines
             if develop:
                 parser = ConfigParser(warn)
-                parser.read('setup.cfg')
+                parser.read(join(dir, 'setup.cfg'))
                 version += parser.get('egg_info', 'tag_build', '').strip()
             return name, pkg_resources.safe_version(version)
         err_exit('Bad setup.py')
 
-    @chdir
     def run_egg_info(self, dir, infoflags, ff='', quiet=False):
         if not self.process.quiet:
             print 'running egg_info'
@@ -67,18 +65,24 @@ class Setuptools(object):
         if quiet:
             echo = And(echo, StartsWith('running'))
 
+        capture = Capture(StartsWith("writing manifest file '"))
+
         rc, lines = self._run_setup_py(
             ['egg_info'] + infoflags,
             echo=echo,
-            ff=ff)
+            ff=ff,
+            capture=capture,
+            cwd=dir)
 
         if rc == 0:
             filename = self._parse_egg_info_results(lines)
-            if filename and isfile(filename):
-                return abspath(filename)
+            if filename:
+                filename = join(dir, filename)
+                if isfile(filename):
+                    return abspath(filename)
+        self._print_tail(capture, quiet)
         err_exit('egg_info failed')
 
-    @chdir
     def run_dist(self, dir, infoflags, distcmd, distflags, ff='', quiet=False):
         if not self.process.quiet:
             print 'running', distcmd
@@ -91,19 +95,25 @@ class Setuptools(object):
         if 'check' in distutils.command.__all__:
             checkcmd = ['check']
 
+        capture = Capture(StartsWith("creating '"))
+
         rc, lines = self._run_setup_py(
             ['egg_info'] + infoflags + checkcmd +
             [distcmd] + distflags,
             echo=echo,
-            ff=ff)
+            ff=ff,
+            capture=capture,
+            cwd=dir)
 
         if rc == 0:
             filename = self._parse_dist_results(lines)
-            if filename and isfile(filename):
-                return abspath(filename)
+            if filename:
+                filename = join(dir, filename)
+                if isfile(filename):
+                    return abspath(filename)
+        self._print_tail(capture, quiet)
         err_exit('%(distcmd)s failed' % locals())
 
-    @chdir
     def run_register(self, dir, infoflags, location, ff='', quiet=False):
         if not self.process.quiet:
             print 'running register'
@@ -116,22 +126,26 @@ class Setuptools(object):
         if 'check' in distutils.command.__all__:
             checkcmd = ['check']
 
-        serverflags = ['--repository="%(location)s"' % locals()]
+        serverflags = ['--repository=%(location)s' % locals()]
+
+        capture = Capture(Equals('running register', OK_RESPONSE))
 
         rc, lines = self._run_setup_py(
             ['egg_info'] + infoflags + checkcmd +
             ['register'] + serverflags,
             echo=echo,
-            ff=ff)
+            ff=ff,
+            capture=capture,
+            cwd=dir)
 
         if rc == 0:
             if self._parse_register_results(lines):
                 if not self.process.quiet and quiet:
                     print 'OK'
                 return rc
+        self._print_tail(capture, quiet)
         err_exit('ERROR: register failed')
 
-    @chdir
     def run_upload(self, dir, infoflags, distcmd, distflags, location, uploadflags, ff='', quiet=False):
         if not self.process.quiet:
             print 'running upload'
@@ -140,22 +154,27 @@ class Setuptools(object):
         if quiet:
             echo = And(echo, Not(Equals(OK_RESPONSE)))
 
-        serverflags = ['--repository="%(location)s"' % locals()]
+        serverflags = ['--repository=%(location)s' % locals()]
+
+        capture = Capture(Equals('running upload', OK_RESPONSE))
 
         rc, lines = self._run_setup_py(
             ['egg_info'] + infoflags + [distcmd] + distflags +
             ['upload'] + serverflags + uploadflags,
             echo=echo,
-            ff=ff)
+            ff=ff,
+            capture=capture,
+            cwd=dir)
 
         if rc == 0:
             if self._parse_upload_results(lines):
                 if not self.process.quiet and quiet:
                     print 'OK'
                 return rc
+        self._print_tail(capture, quiet)
         err_exit('ERROR: upload failed')
 
-    def _run_setup_py(self, args, echo=True, echo2=True, ff=''):
+    def _run_setup_py(self, args, echo=True, echo2=True, ff='', capture=None, cwd=None):
         """Run setup.py with monkey-patched setuptools.
 
         The patch forces setuptools to use the file-finder 'ff'.
@@ -163,23 +182,35 @@ class Setuptools(object):
 
         'args' is the list of arguments that should be passed to
         setup.py.
+
+        If 'capture' is given, only lines matched by it are returned.
+
+        setup.py is run in directory 'cwd', which defaults to the
+        current working directory.
         """
-        python = self.python
+        python = str(self.python)
 
         if ff:
             patch = WALK_REVCTRL % locals()
-            setup_py = '-c"%(patch)s"' % locals()
+            setup_py = ['-c', patch]
         else:
-            setup_py = 'setup.py %s' % ' '.join(args)
+            setup_py = ['setup.py'] + args
 
         rc, lines = self.process.popen(
-            '"%(python)s" %(setup_py)s' % locals(), echo=echo, echo2=echo2)
+            [python] + setup_py, echo=echo, echo2=echo2, capture=capture, cwd=cwd)
 
-        if isfile('setup.pyc'):
-            os.remove('setup.pyc')
+        setup_pyc = join(cwd or os.curdir, 'setup.pyc')
+        if isfile(setup_pyc):
+            os.remove(setup_pyc)
 
         return rc, lines
 
+    def _print_tail(self, capture, quiet=False):
+        # Show the last lines of suppressed output
+        if self.process.quiet or quiet:
+            for line in capture.tail:
+                print >>sys.stderr, line
+
     def _parse_egg_info_results(self, lines):
         for line in lines:
             if line.startswith("writing manifest file '"):
@@ -0,0 +1,206 @@
+from collections import namedtuple
+from os.path import join, dirname, abspath, isdir, isfile
+from urllib import quote
+from xml.etree import ElementTree
+from xml.parsers.expat import ExpatError
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from gitreader import Unsupported, fallback
+
+# Working copy formats of Subversion 1.7 to 1.14
+FORMATS = (29, 30, 31)
+
+# Characters svn leaves alone when turning paths into URLs
+URLSAFE = "!$&'()*+,-./:;=@_~"
+
+Info = namedtuple('Info', 'url repos uuid wcroot revision')
+
+# ElementTree raises ExpatError on Python 2.6 and ParseError,
+# a SyntaxError, on 2.7
+XML_ERRORS = (ExpatError, SyntaxError)
+
+
+class SvnReader(object):
+    """Answer questions about Subversion sandboxes from .svn/wc.db.
+
+    Reads the URL, repository root and UUID, working copy root, and
+    revision of a directory with one query.
+
+    All methods return None when the answer cannot be determined
+    reliably, e.g. for Subversion 1.6 working copies, directories with
+    local changes to their tree, or when wc.db is busy. The caller
+    should then ask svn.
+    """
+
+    @fallback
+    def is_valid_sandbox(self, dir):
+        """Return True if 'dir' is a versioned directory."""
+        wcroot = self.find_wcroot(dir)
+        if wcroot is None:
+            return False
+        path, info = self.get_nodes(wcroot, dir)[0]
+        return info is not None
+
+    @fallback
+    def get_info(self, dir):
+        """Return an Info tuple for 'dir'."""
+        wcroot = self.get_wcroot(dir)
+        path, info = self.get_nodes(wcroot, dir)[0]
+        if info is None:
+            raise Unsupported(dir)
+        return info
+
+    @fallback
+    def get_root(self, dir):
+        """Return the topmost directory of 'dir''s checkout, i.e. the
+        last parent whose URL is a prefix of its child's URL.
+        """
+        wcroot = self.get_wcroot(dir)
+        nodes = self.get_nodes(wcroot, dir)
+        if nodes[0][1] is None:
+            raise Unsupported(dir)
+        for (path, info), (parent, parentinfo) in zip(nodes, nodes[1:] + [(None, None)]):
+            if parentinfo is None or not info.url.startswith(parentinfo.url):
+                return path
+
+    def get_wcroot(self, dir):
+        wcroot = self.find_wcroot(dir)
+        if wcroot is None:
+            raise Unsupported(dir)
+        return wcroot
+
+    def find_wcroot(self, dir):
+        """Search 'dir' and its parents for a .svn directory.
+
+        Returns the working copy root or None.
+        """
+        dir = abspath(dir)
+        if not isdir(dir):
+            raise Unsupported(dir)
+        while True:
+            dotsvn = join(dir, '.svn')
+            if isdir(dotsvn):
+                if not isfile(join(dotsvn, 'wc.db')):
+                    # Subversion 1.6 and older
+                    raise Unsupported(dotsvn)
+                return dir
+            parent = dirname(dir)
+            if parent == dir:
+                return None
+            dir = parent
+
+    def get_nodes(self, wcroot, dir):
+        """Return (path, info) pairs for 'dir' and its parents up to
+        'wcroot'.
+
+        The info is None for directories not in the working copy.
+        """
+        paths = [abspath(dir)]
+        while paths[-1] != wcroot:
+            paths.append(dirname(paths[-1]))
+        relpaths = [get_relpath(wcroot, x) for x in paths]
+
+        rows = self.query(join(wcroot, '.svn', 'wc.db'),
+            'SELECT n.local_relpath, n.op_depth, n.presence, n.repos_path, n.revision, r.root, r.uuid '
+            'FROM nodes n JOIN wcroot w ON n.wc_id = w.id '
+            'LEFT JOIN repository r ON n.repos_id = r.id '
+            'WHERE w.local_abspath IS NULL AND n.local_relpath IN (%s)' %
+            ', '.join(['?'] * len(relpaths)), relpaths)
+
+        nodes = {}
+        for relpath, op_depth, presence, repos_path, revision, repos, uuid in rows:
+            if op_depth > 0:
+                # Added, copied, moved, or deleted locally
+                raise Unsupported(relpath)
+            if presence != 'normal' or repos is None:
+                continue
+            repos = repos.encode('utf-8')
+            url = repos
+            if repos_path:
+                url += '/' + quote(repos_path.encode('utf-8'), URLSAFE)
+            nodes[relpath] = Info(url, repos, uuid.encode('utf-8'), wcroot, revision)
+        return [(x, nodes.get(y)) for x, y in zip(paths, relpaths)]
+
+    def query(self, filename, sql, args):
+        if sqlite3 is None:
+            raise Unsupported('sqlite3')
+        try:
+            connection = sqlite3.connect(filename, timeout=0)
+            try:
+                format = connection.execute('PRAGMA user_version').fetchone()[0]
+                if format not in FORMATS:
+                    raise Unsupported('format %d' % format)
+                return connection.execute(sql, args).fetchall()
+            finally:
+                connection.close()
+        except sqlite3.Error, e:
+            raise Unsupported(str(e))
+
+
+def get_relpath(wcroot, path):
+    # Relative paths in wc.db are unicode and use '/'
+    if path == wcroot:
+        return u''
+    return path[len(wcroot)+1:].decode('utf-8')
+
+
+def parse_info(text):
+    """Return an Info tuple for the first entry of 'svn info --xml'
+    output, or None.
+    """
+    try:
+        root = ElementTree.fromstring(text)
+    except XML_ERRORS:
+        return None
+    entry = root.find('entry')
+    if entry is None:
+        return None
+    url = entry.findtext('url')
+    repos = entry.findtext('repository/root')
+    uuid = entry.findtext('repository/uuid')
+    wcroot = entry.findtext('wc-info/wcroot-abspath')
+    revision = entry.get('revision')
+    if not url:
+        return None
+    if revision is not None:
+        revision = int(revision)
+    return Info(encode(url), encode(repos), encode(uuid), encode(wcroot), revision)
+
+
+def parse_infos(text):
+    """Return Info tuples for all entries of 'svn info --xml' output.
+
+    svn skips targets it cannot describe, and may stop early, so the
+    output can lack entries or be cut short.
+    """
+    infos = []
+    for chunk in text.split('<entry')[1:]:
+        end = chunk.find('</entry>')
+        if end < 0:
+            break
+        info = parse_info('<info><entry%s</entry></info>' % chunk[:end])
+        if info is None:
+            break
+        infos.append(info)
+    return infos
+
+
+def parse_propnames(text):
+    """Return the set of property names in 'svn proplist --xml'
+    output, or None.
+    """
+    try:
+        root = ElementTree.fromstring(text)
+    except XML_ERRORS:
+        return None
+    return set([encode(x.get('name')) for x in root.findall('target/property')])
+
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
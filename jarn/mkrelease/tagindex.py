@@ -0,0 +1,41 @@
+from hashlib import sha1
+from os.path import join
+
+from diskcache import read_file, write_file
+
+
+class TagIndex(object):
+    """A persistent index of the tags in a repository.
+
+    An index file holds a stamp and the tag names. The SCM computes
+    the stamp from the repository files that change whenever tags
+    change; an index with a different stamp is stale and must be
+    rebuilt. Lookups do not depend on the number of tags beyond
+    reading one file.
+
+    Install an index by assigning it to the SCM's 'tagindex'
+    attribute.
+    """
+
+    def __init__(self, dir):
+        self.dir = dir
+
+    def get_filename(self, root):
+        return join(self.dir, sha1(root).hexdigest())
+
+    def lookup(self, root, stamp, tagid):
+        """Return True or False, or None if the index of 'root' is
+        missing or stale.
+        """
+        data = read_file(self.get_filename(root))
+        if data is None:
+            return None
+        header, sep, tags = data.partition('\n')
+        if header != stamp:
+            return None
+        return ('\n%s\n' % tagid) in ('\n' + tags)
+
+    def store(self, root, stamp, tags):
+        """Write the index of 'root'."""
+        tags = ''.join('%s\n' % x for x in sorted(tags))
+        return write_file(self.get_filename(root), '%s\n%s' % (stamp, tags))
@@ -1,73 +1,374 @@
+import os
+import re
 import sys
+import time
+import errno
+import select
 import threading
 
+from collections import deque
+from os.path import abspath, isdir
 from subprocess import Popen, PIPE
 
-__all__ = ['popen', 'On', 'Off', 'NotEmpty', 'Equals',
+__all__ = ['popen', 'spawn', 'play', 'call', 'Loop', 'Capture',
+           'On', 'Off', 'NotEmpty', 'Equals',
            'StartsWith', 'EndsWith', 'Before', 'NotAfter',
-           'After', 'NotBefore', 'Not', 'And', 'Or']
+           'After', 'NotBefore', 'Not', 'And', 'Or',
+           'compile_filter']
 
+BUFSIZE = 65536
+TAILSIZE = 20
 
-def tee(process, filter):
-    """Read lines from process.stdout and echo them to sys.stdout.
+# Pipes are inheritable; creating children one at a time keeps threads
+# from leaking each other's pipe ends into their children.
+spawn_lock = threading.Lock()
 
-    Returns a list of lines read. Lines are not newline terminated.
 
-    The 'filter' is a callable which is invoked for every line,
-    receiving the line as argument. If the filter returns True, the
-    line is echoed to sys.stdout.
-    """
-    # We simply use readline here, more fancy IPC is not warranted
-    # in the context of this package.
-    lines = []
+def eintr_retry(func, *args):
+    """Call 'func' until it is not interrupted by a signal."""
     while True:
-        line = process.stdout.readline()
-        if line:
-            stripped_line = line.rstrip()
-            if filter(stripped_line):
-                sys.stdout.write(line)
-            lines.append(stripped_line)
-        elif process.poll() is not None:
-            break
-    return lines
+        try:
+            return func(*args)
+        except (OSError, IOError, select.error), e:
+            if e.args[0] != errno.EINTR:
+                raise
 
 
-def tee2(process, filter):
-    """Read lines from process.stderr and echo them to sys.stderr.
+class Stream(object):
+    """Split data read from a pipe into lines and echo them to 'file'.
 
     The 'filter' is a callable which is invoked for every line,
     receiving the line as argument. If the filter returns True, the
-    line is echoed to sys.stderr.
+    line is echoed to 'file'.
+
+    If 'lines' is a list, stripped lines are appended to it.
+
+    Data is split into lines in bulk; only the filter is called once
+    per line. The On and Off filters are not called at all.
     """
-    while True:
-        line = process.stderr.readline()
-        if line:
-            stripped_line = line.rstrip()
-            if filter(stripped_line):
-                sys.stderr.write(line)
-        elif process.poll() is not None:
-            break
 
+    def __init__(self, pipe, filter, file, lines=None):
+        self.pipe = pipe
+        self.filter = filter
+        self.file = file
+        self.lines = lines
+        self.buffer = ''
+        self.nbytes = 0
+
+    def fileno(self):
+        return self.pipe.fileno()
+
+    def feed(self, data):
+        """Process a chunk of data read from the pipe."""
+        self.nbytes += len(data)
+        if self.buffer:
+            data = self.buffer + data
+        raw_lines = data.split('\n')
+        self.buffer = raw_lines.pop()
+        if not raw_lines:
+            return
+
+        stripped_lines = map(str.rstrip, raw_lines)
+        filter = self.filter
+
+        if isinstance(filter, On):
+            self.file.write(data[:len(data)-len(self.buffer)])
+        elif not isinstance(filter, Off):
+            echoed = [raw for raw, stripped in zip(raw_lines, stripped_lines)
+                      if filter(stripped)]
+            if echoed:
+                self.file.write('\n'.join(echoed) + '\n')
+
+        if self.lines is not None:
+            self.lines.extend(stripped_lines)
+
+    def line(self, line):
+        """Process a single line."""
+        stripped_line = line.rstrip()
+        if self.filter(stripped_line):
+            self.file.write(line)
+        if self.lines is not None:
+            self.lines.append(stripped_line)
+
+    def close(self):
+        """Process a trailing partial line and close the pipe."""
+        if self.buffer:
+            self.line(self.buffer)
+            self.buffer = ''
+        if self.pipe is not None:
+            self.pipe.close()
+
+
+class Capture(object):
+    """Keep only the lines a caller is interested in.
+
+    The 'matchers' are tee filters; lines for which any matcher returns
+    True are collected in 'values'. All other lines go to 'tail', a ring
+    buffer holding the last 'maxlen' lines for use in error reports.
+    """
+
+    def __init__(self, *matchers, **kw):
+        self.matchers = matchers
+        self.match = compile_filter(reduce(Or, matchers)) if matchers else Off()
+        self.values = []
+        self.tail = deque(maxlen=kw.get('maxlen', TAILSIZE))
+
+    def append(self, line):
+        if self.match(line):
+            self.values.append(line)
+        else:
+            self.tail.append(line)
 
-class background_thread(object):
-    """Context manager to start and stop a background thread."""
+    def extend(self, lines):
+        if self.tail.maxlen == 0:
+            self.values.extend(filter(self.match, lines))
+        else:
+            for line in lines:
+                self.append(line)
 
-    def __init__(self, target, args):
-        self.target = target
-        self.args = args
 
-    def __enter__(self):
-        self._t = threading.Thread(target=self.target, args=self.args)
-        self._t.start()
-        return self._t
+class Child(object):
+    """A child process and the streams reading its pipes.
+
+    Lines read from stdout are collected in 'lines'. The 'returncode'
+    is None until all pipes are closed and the process has been reaped.
+    The 'start' and 'end' attributes hold wall clock times.
+    """
 
-    def __exit__(self, *ignored):
-        self._t.join()
+    def __init__(self, process, streams, lines=None, cmd=None, cwd=None, start=None):
+        self.process = process
+        self.streams = streams
+        self.lines = lines
+        self.cmd = cmd
+        self.cwd = cwd
+        self.start = start or time.time()
+        self.end = None
+        self.returncode = None
+        self.played = (0, 0)
+        self._open = len(streams)
+
+    @property
+    def done(self):
+        return self.returncode is not None
+
+    def close(self, stream):
+        """Close 'stream' and reap the process after the last one."""
+        stream.close()
+        self._open -= 1
+        if self._open == 0:
+            self.returncode = eintr_retry(self.process.wait)
+            self.end = time.time()
+
+    def kill(self):
+        """Close all pipes, terminate the process, and reap it.
+
+        Remove the child from its Loop first.
+        """
+        for stream in self.streams:
+            if not stream.pipe.closed:
+                stream.pipe.close()
+        self._open = 0
+        if self.returncode is None:
+            try:
+                self.process.terminate()
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
+            self.returncode = eintr_retry(self.process.wait)
+            self.end = time.time()
+
+    @property
+    def nbytes(self):
+        """Return a two-tuple of bytes read from stdout and stderr."""
+        counts = [stream.nbytes for stream in self.streams]
+        return tuple(counts) or self.played
+
+
+class Loop(object):
+    """Serve the pipes of any number of children from one select loop."""
 
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, child):
+        """Register a child with the loop."""
+        for stream in child.streams:
+            self.pending[stream.fileno()] = (child, stream)
+        return child
+
+    def remove(self, child):
+        """Unregister a child which is not done."""
+        for fd, (other, stream) in self.pending.items():
+            if other is child:
+                del self.pending[fd]
+
+    def step(self):
+        """Wait for pipes to become readable and process what arrived."""
+        # No threads and no polling: we sleep in select until at least
+        # one pipe becomes readable.
+        ready = eintr_retry(select.select, list(self.pending), [], [])[0]
+        for fd in ready:
+            child, stream = self.pending[fd]
+            data = eintr_retry(os.read, fd, BUFSIZE)
+            if data:
+                stream.feed(data)
+            else:
+                del self.pending[fd]
+                child.close(stream)
+
+    def run(self, *children):
+        """Run the loop until all 'children' are done.
+
+        If no children are given, run until the loop is empty.
+        """
+        if children:
+            while not all(child.done for child in children):
+                self.step()
+        else:
+            while self.pending:
+                self.step()
+
+
+def to_filter(echo):
+    """Turn a boolean 'echo' argument into a tee filter.
+
+    Trees of filters are compiled into a single predicate.
+    """
+    if not callable(echo):
+        echo = On() if echo else Off()
+    return compile_filter(echo)
 
-def popen(cmd, echo=True, echo2=True, env=None):
+
+def spawn(cmd, echo=True, echo2=True, env=None, capture=None, cwd=None):
+    """Start 'cmd' and return a Child ready to be added to a Loop.
+
+    Arguments are the same as for popen.
+    """
+    echo = to_filter(echo)
+    echo2 = to_filter(echo2)
+
+    # Only strings are passed to the shell, argument vectors
+    # are executed directly.
+    shell = isinstance(cmd, basestring)
+
+    if capture is None:
+        lines = sink = []
+    else:
+        lines, sink = capture.values, capture
+
+    cwd = abspath(cwd) if cwd else os.getcwd()
+    start = time.time()
+
+    try:
+        with spawn_lock:
+            process = Popen(
+                cmd,
+                shell=shell,
+                stdout=PIPE,
+                stderr=PIPE,
+                env=env,
+                cwd=cwd
+            )
+    except OSError, e:
+        if shell or e.errno not in (errno.ENOENT, errno.EACCES) or not isdir(cwd):
+            raise
+        # Fail like the shell would
+        line = '%s: %s' % (cmd[0], e.strerror)
+        if echo2(line):
+            sys.stderr.write(line + '\n')
+        child = Child(None, (), lines, cmd, cwd, start)
+        child.returncode = 127 if e.errno == errno.ENOENT else 126
+        child.end = time.time()
+        return child
+
+    streams = (Stream(process.stdout, echo, sys.stdout, sink),
+               Stream(process.stderr, echo2, sys.stderr))
+    return Child(process, streams, lines, cmd, cwd, start)
+
+
+def play(cmd, returncode, stdout, stderr, echo=True, echo2=True, capture=None, cwd=None,
+         start=None):
+    """Feed recorded output through the tee filters.
+
+    Returns a Child that looks like 'cmd' has just produced 'stdout'
+    and 'stderr' (lists of lines) and exited with 'returncode'. Pass
+    'start' if the output was produced earlier, e.g. by a server.
+    """
+    echo = to_filter(echo)
+    echo2 = to_filter(echo2)
+
+    if capture is None:
+        lines = sink = []
+    else:
+        lines, sink = capture.values, capture
+
+    start = start or time.time()
+    streams = (Stream(None, echo, sys.stdout, sink), Stream(None, echo2, sys.stderr))
+    for stream, recorded in zip(streams, (stdout, stderr)):
+        if recorded:
+            stream.feed('\n'.join(recorded) + '\n')
+        stream.close()
+
+    child = Child(None, (), lines, cmd, abspath(cwd) if cwd else os.getcwd(), start)
+    child.returncode = returncode
+    child.played = tuple([stream.nbytes for stream in streams])
+    child.end = time.time()
+    return child
+
+
+def fileno(file):
+    """Return the file descriptor of 'file' or None."""
+    try:
+        return file.fileno()
+    except (AttributeError, ValueError, IOError):
+        return None
+
+
+def call(cmd, stdout=None, stderr=None, env=None, cwd=None):
+    """Run 'cmd' with its output going to 'stdout' and 'stderr'.
+
+    The output is not read by us, the child writes to the files
+    directly. If 'stdout' or 'stderr' is None, the child inherits
+    the respective file descriptor.
+
+    Returns a Child which is done.
+    """
+    shell = isinstance(cmd, basestring)
+    cwd = abspath(cwd) if cwd else os.getcwd()
+    start = time.time()
+
+    try:
+        with spawn_lock:
+            process = Popen(
+                cmd,
+                shell=shell,
+                stdout=stdout,
+                stderr=stderr,
+                env=env,
+                cwd=cwd
+            )
+    except OSError, e:
+        if shell or e.errno not in (errno.ENOENT, errno.EACCES) or not isdir(cwd):
+            raise
+        # Fail like the shell would
+        file = stderr or sys.stderr
+        file.write('%s: %s\n' % (cmd[0], e.strerror))
+        returncode = 127 if e.errno == errno.ENOENT else 126
+    else:
+        returncode = eintr_retry(process.wait)
+
+    child = Child(None, (), None, cmd, cwd, start)
+    child.returncode = returncode
+    child.end = time.time()
+    return child
+
+
+def popen(cmd, echo=True, echo2=True, env=None, capture=None, cwd=None):
     """Run 'cmd' and return a two-tuple of exit code and lines read.
 
+    If 'cmd' is a string it is executed through the shell. If it is a
+    list it is used as argument vector and executed directly.
+
     If 'echo' is True, the stdout stream is echoed to sys.stdout.
     If 'echo2' is True, the stderr stream is echoed to sys.stderr.
 
@@ -75,25 +376,18 @@ def popen(cmd, echo=True, echo2=True, env=None):
     case they are used as tee filters.
 
     The 'env' argument allows to pass a dict replacing os.environ.
-    """
-    if not callable(echo):
-        echo = On() if echo else Off()
-
-    if not callable(echo2):
-        echo2 = On() if echo2 else Off()
 
-    process = Popen(
-        cmd,
-        shell=True,
-        stdout=PIPE,
-        stderr=PIPE,
-        env=env
-    )
+    The 'cwd' argument sets the working directory of the command; the
+    working directory of the calling process is not changed.
 
-    with background_thread(tee2, (process, echo2)):
-        lines = tee(process, echo)
-
-    return process.returncode, lines
+    If 'capture' is a Capture object, only lines matched by it are
+    returned. This keeps memory use flat for commands producing lots
+    of output.
+    """
+    loop = Loop()
+    child = loop.add(spawn(cmd, echo, echo2, env, capture, cwd))
+    loop.run(child)
+    return child.returncode, child.lines
 
 
 class On(object):
@@ -245,3 +539,228 @@ class Or(object):
     def __call__(self, line):
         return self.filter1(line) or self.filter2(line)
 
+
+
+class Tap(object):
+    """A tee filter recording every line before passing it on.
+
+    Use it to look at output that is not captured, e.g. stderr.
+    """
+
+    def __init__(self, filter, lines):
+        self.filter = to_filter(filter)
+        self.lines = lines
+
+    def __call__(self, line):
+        self.lines.append(line)
+        return self.filter(line)
+
+
+def mute(echo):
+    """Turn off echoing but keep recording taps."""
+    if isinstance(echo, Tap):
+        return Tap(False, echo.lines)
+    return False
+
+
+
+STATELESS = (On, Off, NotEmpty, Equals, StartsWith, EndsWith)
+STATEFUL = (Before, NotAfter, After, NotBefore)
+COMBINATORS = (Not, And, Or)
+
+
+def compile_filter(filter):
+    """Turn a tree of tee filters into a single predicate.
+
+    Stateless subtrees with more than one test become one precompiled
+    regular expression, the line-tracking filters become a small state
+    machine. And and Or short-circuit as before, so stateful filters
+    see exactly the lines they would see uncompiled.
+
+    The compiled predicate takes its initial state from 'filter' but
+    keeps its own state from then on. Filters not known to the
+    compiler, including subclasses of the filter classes, are called
+    as they are. If there is nothing to gain, 'filter' is returned
+    unchanged.
+    """
+    if type(filter) not in COMBINATORS + STATEFUL + STATELESS:
+        return filter
+    if type(filter) in (On, Off):
+        return filter
+    try:
+        return FilterCompiler().compile(filter)
+    except SharedStateError:
+        return filter
+
+
+class SharedStateError(Exception):
+    """Raised when a stateful filter occurs twice in a tree."""
+
+
+class FilterCompiler(object):
+    """Generate the source of a predicate from a filter tree."""
+
+    def __init__(self):
+        self.names = {}
+        self.state = []
+        self.seen = set()
+        self.nvars = 0
+
+    def compile(self, filter):
+        code = []
+        result = self.emit(filter, code, 1)
+        source = 'def compiled(line, s=s):\n%s    return %s\n' % (
+            ''.join(code), result)
+        namespace = dict(self.names, s=self.state)
+        exec compile(source, '<tee filter>', 'exec') in namespace
+        compiled = namespace['compiled']
+        compiled.source = source
+        return compiled
+
+    def const(self, value, prefix='k'):
+        name = '%s%d' % (prefix, len(self.names))
+        self.names[name] = value
+        return name
+
+    def var(self):
+        self.nvars += 1
+        return 'r%d' % self.nvars
+
+    def emit(self, filter, code, level):
+        """Append statements for 'filter' to 'code' and return an
+        expression holding its result.
+        """
+        if is_stateless(filter):
+            if count_tests(filter) > 1:
+                regex = re.compile(to_regex(filter), re.DOTALL)
+                return '(%s(line) is not None)' % self.const(regex.match, 'm')
+            return self.inline(filter)
+
+        kind = type(filter)
+        indent = '    ' * level
+
+        if kind is Not:
+            return '(not %s)' % self.emit(filter.filter, code, level)
+
+        if kind in (And, Or):
+            first = self.emit(filter.filter1, code, level)
+            body = []
+            second = self.emit(filter.filter2, body, level+1)
+            if not body:
+                return '(%s %s %s)' % (first, kind is And and 'and' or 'or', second)
+            result = self.var()
+            code.append('%s%s = %s\n' % (indent, result, first))
+            code.append('%sif %s%s:\n' % (indent, kind is Or and 'not ' or '', result))
+            code.extend(body)
+            code.append('%s    %s = %s\n' % (indent, result, second))
+            return result
+
+        if kind in STATEFUL:
+            if id(filter) in self.seen:
+                raise SharedStateError(filter)
+            self.seen.add(id(filter))
+            return self.state_machine(filter, code, indent)
+
+        # Anything else is called as it is
+        return '%s(line)' % self.const(filter, 'f')
+
+    def state_machine(self, filter, code, indent):
+        kind = type(filter)
+        echo = 's[%d]' % len(self.state)
+        self.state.append(filter.echo)
+
+        if kind is Before or kind is NotAfter:
+            # Echo until the stopline
+            stop = self.const(filter.stopline)
+            code.append('%sif %s and line == %s:\n' % (indent, echo, stop))
+            code.append('%s    %s = False\n' % (indent, echo))
+            if kind is Before:
+                return echo
+            result = self.var()
+            code.append('%s    %s = True\n' % (indent, result))
+        else:
+            # Echo from the startline
+            start = self.const(filter.startline)
+            code.append('%sif not %s and line == %s:\n' % (indent, echo, start))
+            code.append('%s    %s = True\n' % (indent, echo))
+            if kind is NotBefore:
+                return echo
+            result = self.var()
+            code.append('%s    %s = False\n' % (indent, result))
+
+        code.append('%selse:\n' % indent)
+        code.append('%s    %s = %s\n' % (indent, result, echo))
+        return result
+
+    def inline(self, filter):
+        """Return an expression for a stateless filter with one test."""
+        kind = type(filter)
+        if kind is On:
+            return 'True'
+        if kind is Off:
+            return 'False'
+        if kind is NotEmpty:
+            return "(line != '')"
+        if kind is Equals:
+            if len(filter.patterns) == 1:
+                return '(line == %s)' % self.const(filter.patterns[0])
+            return '(line in %s)' % self.const(frozenset(filter.patterns))
+        if kind is StartsWith:
+            return 'line.startswith(%s)' % self.const(tuple(filter.patterns))
+        if kind is EndsWith:
+            return 'line.endswith(%s)' % self.const(tuple(filter.patterns))
+        if kind is Not:
+            return '(not %s)' % self.inline(filter.filter)
+        # And and Or have at least two tests
+        raise TypeError('Not a simple filter: %r' % filter)
+
+
+def is_stateless(filter):
+    """Return True if 'filter' is a tree of stateless filters."""
+    kind = type(filter)
+    if kind in STATELESS:
+        return True
+    if kind is Not:
+        return is_stateless(filter.filter)
+    if kind is And or kind is Or:
+        return is_stateless(filter.filter1) and is_stateless(filter.filter2)
+    return False
+
+
+def count_tests(filter):
+    """Return the number of leaves of a stateless filter tree."""
+    kind = type(filter)
+    if kind is Not:
+        return count_tests(filter.filter)
+    if kind is And or kind is Or:
+        return count_tests(filter.filter1) + count_tests(filter.filter2)
+    return 1
+
+
+def to_regex(filter):
+    """Turn a stateless filter tree into a zero-width regex matching
+    at the start of lines the tree accepts.
+    """
+    kind = type(filter)
+    if kind is On:
+        return ''
+    if kind is Off:
+        return '(?!)'
+    if kind is NotEmpty:
+        return '(?=.)'
+    if kind in (Equals, StartsWith, EndsWith):
+        if not filter.patterns:
+            return '(?!)'
+        alternatives = '|'.join(re.escape(x) for x in filter.patterns)
+        if kind is Equals:
+            return r'(?=(?:%s)\Z)' % alternatives
+        if kind is StartsWith:
+            return '(?=%s)' % alternatives
+        return r'(?=.*(?:%s)\Z)' % alternatives
+    if kind is Not:
+        return '(?!%s)' % to_regex(filter.filter)
+    if kind is And:
+        return to_regex(filter.filter1) + to_regex(filter.filter2)
+    if kind is Or:
+        return '(?:%s|%s)' % (to_regex(filter.filter1), to_regex(filter.filter2))
+    raise TypeError('Not a stateless filter: %r' % filter)
@@ -275,7 +275,7 @@ class MockProcess(Process):
 
     - passing rc and lines, or
     - passing a function called as ``func(cmd)`` which returns
-      rc and lines.
+      rc and lines, or rc, lines, and stderr lines.
     """
 
     def __init__(self, rc=None, lines=None, func=None):
@@ -284,14 +284,36 @@ class MockProcess(Process):
         self.lines = lines or []
         self.func = func
 
-    def popen(self, cmd, echo=True, echo2=True):
+    def popen(self, cmd, echo=True, echo2=True, capture=None, cwd=None):
         if self.func is not None:
             rc_lines = self.func(cmd)
-            if rc_lines is not None:
-                return rc_lines
-            else:
+            if rc_lines is None:
                 raise MockProcessError('Unhandled command: %s' % cmd)
-        return self.rc, self.lines
+        else:
+            rc_lines = self.rc, self.lines
+        if len(rc_lines) == 3:
+            rc, lines, errors = rc_lines
+            if callable(echo2):
+                for line in errors:
+                    echo2(line)
+            rc_lines = rc, lines
+        if capture is not None:
+            rc, lines = rc_lines
+            for line in lines:
+                capture.append(line)
+            return rc, capture.values
+        return rc_lines
+
+    def system(self, cmd, cwd=None):
+        rc, lines = self.popen(cmd)
+        return rc
+
+    def query(self, cmd, predicate, cwd=None):
+        rc, lines = self.popen(cmd, echo=False)
+        for line in lines:
+            if predicate(line):
+                return 0, line
+        return rc, None
 
     def os_system(self, cmd):
         if self.func is not None:
@@ -303,6 +325,16 @@ class MockProcess(Process):
         return self.rc
 
 
+class NullReader(object):
+    """A metadata reader that never knows the answer.
+
+    Pass it to SCMs under test to make them ask their Process.
+    """
+
+    def __getattr__(self, name):
+        return lambda *args, **kw: None
+
+
 def quiet(func):
     """Decorator swallowing stdout and stderr output.
     """
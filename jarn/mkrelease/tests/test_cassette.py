@@ -0,0 +1,158 @@
+import unittest
+import os
+import sys
+import StringIO
+
+from os.path import isfile
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.process import AsyncProcess
+from jarn.mkrelease.cassette import Cassette
+from jarn.mkrelease.cassette import CassetteError
+from jarn.mkrelease.scm import Git
+from jarn.mkrelease.tee import Capture
+from jarn.mkrelease.tee import StartsWith
+
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import GitSetup
+from jarn.mkrelease.testing import NullReader
+from jarn.mkrelease.testing import quiet
+
+
+class CassetteSetup(JailSetup):
+
+    def tearDown(self):
+        Process.cassette = None
+        JailSetup.tearDown(self)
+
+    def record(self, func):
+        Process.cassette = Cassette('cassette.json', 'record')
+        try:
+            return func()
+        finally:
+            Process.cassette.save()
+            Process.cassette = None
+
+    def replay(self, func):
+        Process.cassette = Cassette('cassette.json')
+        try:
+            return func()
+        finally:
+            Process.cassette = None
+
+
+class RecordReplayTests(CassetteSetup):
+
+    def testReplay(self):
+        process = Process(quiet=True)
+        func = lambda: process.popen(['sh', '-c', 'echo $$; touch output; exit 3'])
+        recorded = self.record(func)
+        self.assertEqual(recorded[0], 3)
+        self.assertEqual(isfile('output'), True)
+        os.remove('output')
+        replayed = self.replay(func)
+        self.assertEqual(replayed, recorded)
+        # The command was not executed
+        self.assertEqual(isfile('output'), False)
+
+    def testReplayCwd(self):
+        os.mkdir('foo')
+        process = Process(quiet=True)
+        func = lambda: (process.pipe(['pwd'], cwd='foo'), process.pipe(['pwd']))
+        recorded = self.record(func)
+        self.assertEqual(recorded, (os.path.join(self.tempdir, 'foo'), self.tempdir))
+        self.assertEqual(self.replay(func), recorded)
+
+    def testReplayInOrder(self):
+        process = Process(quiet=True)
+        func = lambda: [process.pipe(['sh', '-c', 'echo $$']) for i in range(3)]
+        recorded = self.record(func)
+        self.assertEqual(len(set(recorded)), 3)
+        self.assertEqual(self.replay(func), recorded)
+
+    def testReplayEcho(self):
+        process = Process()
+        func = lambda: process.popen('echo foo; echo bar; echo baz >&2',
+                                     echo=StartsWith('b'))
+        self.record(quiet(func))
+        saved = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+        try:
+            rc, lines = self.replay(func)
+            self.assertEqual(sys.stdout.getvalue(), 'bar\n')
+            self.assertEqual(sys.stderr.getvalue(), 'baz\n')
+        finally:
+            sys.stdout, sys.stderr = saved
+        self.assertEqual(lines, ['foo', 'bar'])
+
+    def testReplayCapture(self):
+        process = Process(quiet=True)
+        self.record(lambda: process.popen(['seq', '1', '100']))
+        capture = Capture(StartsWith('5'))
+        rc, lines = self.replay(lambda: process.popen(['seq', '1', '100'], capture=capture))
+        self.assertEqual(lines, ['5', '50', '51', '52', '53', '54', '55', '56', '57', '58', '59'])
+        self.assertEqual(list(capture.tail)[-1], '100')
+
+    def testReplayAsync(self):
+        process = AsyncProcess(quiet=True)
+        func = lambda: process.gather(process.pipe(['echo', 'foo']), process.system(['true']))
+        self.assertEqual(self.record(func), ['foo', 0])
+        self.assertEqual(self.replay(func), ['foo', 0])
+
+    def testNotRecorded(self):
+        process = Process(quiet=True)
+        self.record(lambda: process.popen(['echo', 'foo']))
+        self.assertRaises(CassetteError, self.replay, lambda: process.popen(['echo', 'bar']))
+
+    def testExhausted(self):
+        process = Process(quiet=True)
+        self.record(lambda: process.popen(['echo', 'foo']))
+        func = lambda: [process.popen(['echo', 'foo']) for i in range(2)]
+        self.assertRaises(CassetteError, self.replay, func)
+
+    def testRewind(self):
+        process = Process(quiet=True)
+        self.record(lambda: process.pipe(['echo', 'foo']))
+        Process.cassette = Cassette('cassette.json')
+        self.assertEqual(process.pipe(['echo', 'foo']), 'foo')
+        Process.cassette.rewind()
+        self.assertEqual(process.pipe(['echo', 'foo']), 'foo')
+
+    def testBinaryOutput(self):
+        process = Process(quiet=True)
+        func = lambda: process.popen(['printf', '\\377\\n'])
+        recorded = self.record(func)
+        self.assertEqual(recorded, (0, ['\xff']))
+        self.assertEqual(self.replay(func), recorded)
+
+    def testBadMode(self):
+        self.assertRaises(ValueError, Cassette, 'cassette.json', 'play')
+
+
+class GitReplayTests(GitSetup):
+
+    def tearDown(self):
+        Process.cassette = None
+        GitSetup.tearDown(self)
+
+    def testReplayWithoutSandbox(self):
+        # Cassettes hold command output, not the files in .git
+        scm = Git(Process(quiet=True), reader=NullReader())
+
+        def func():
+            return (scm.get_branch_from_sandbox(self.packagedir),
+                    scm.is_dirty_sandbox(self.packagedir),
+                    scm.tag_exists(self.packagedir, '2.6'))
+
+        Process.cassette = Cassette('cassette.json', 'record')
+        recorded = func()
+        Process.cassette.save()
+
+        self.destroy()
+
+        Process.cassette = Cassette('cassette.json')
+        self.assertEqual(func(), recorded)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,209 @@
+import unittest
+import time
+
+from os.path import join
+
+from jarn.mkrelease.scm import Mercurial
+from jarn.mkrelease.cmdserver import CommandServer
+from jarn.mkrelease.cmdserver import CommandServerError
+from jarn.mkrelease.cmdserver import CommandServerProcess
+from jarn.mkrelease.cmdserver import find_root
+from jarn.mkrelease.ledger import Ledger
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.mkrelease import Defaults
+
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import MercurialSetup
+from jarn.mkrelease.testing import quiet
+
+
+class CommandServerSetup(MercurialSetup):
+
+    def setUp(self):
+        MercurialSetup.setUp(self)
+        self.process = CommandServerProcess(quiet=True)
+
+    def tearDown(self):
+        self.process.close()
+        MercurialSetup.tearDown(self)
+
+
+class CommandServerTests(CommandServerSetup):
+
+    def testRunCommand(self):
+        server = CommandServer(self.packagedir)
+        server.start()
+        try:
+            rc, stdout, stderr = server.runcommand(['root'])
+            self.assertEqual(rc, 0)
+            self.assertEqual(stdout, self.packagedir + '\n')
+            self.assertEqual(stderr, '')
+        finally:
+            server.close()
+
+    def testRunCommandInSubdir(self):
+        server = CommandServer(self.packagedir)
+        server.start()
+        try:
+            rc, stdout, stderr = server.runcommand(['status', '.'], join(self.packagedir, 'testpackage'))
+            self.assertEqual(rc, 0)
+            self.assertEqual(stdout, '')
+        finally:
+            server.close()
+
+    def testBadCommand(self):
+        server = CommandServer(self.packagedir)
+        server.start()
+        try:
+            rc, stdout, stderr = server.runcommand(['nosuchcommand'])
+            self.assertEqual(rc, 255)
+            self.failUnless('nosuchcommand' in stderr)
+        finally:
+            server.close()
+
+    def testMissingDirectory(self):
+        server = CommandServer(join(self.tempdir, 'nosuchdir'))
+        self.assertRaises(CommandServerError, server.start)
+
+    def testClosedServer(self):
+        server = CommandServer(self.packagedir)
+        server.start()
+        server.server.stdin.close()
+        self.assertRaises(CommandServerError, server.send, ['root'])
+        server.close()
+
+
+class CommandServerProcessTests(CommandServerSetup):
+
+    def testOneServerPerRepository(self):
+        self.clone()
+        self.process.popen(['hg', 'root'], cwd=self.packagedir)
+        self.process.popen(['hg', 'branch'], cwd=join(self.packagedir, 'testpackage'))
+        self.process.popen(['hg', 'root'], cwd=self.clonedir)
+        self.assertEqual(sorted(self.process.servers), [self.clonedir, self.packagedir])
+
+    def testPopen(self):
+        rc, lines = self.process.popen(['hg', 'root'], cwd=self.packagedir)
+        self.assertEqual(rc, 0)
+        self.assertEqual(lines, [self.packagedir])
+        self.failIfEqual(self.process.servers[self.packagedir], None)
+
+    def testPipe(self):
+        self.assertEqual(self.process.pipe(['hg', 'branch'], cwd=self.packagedir), 'default')
+
+    def testQuery(self):
+        self.mkfile(join(self.packagedir, 'foo'))
+        rc, line = self.process.query(['hg', 'status'], lambda x: x.endswith('foo'),
+                                      cwd=self.packagedir)
+        self.assertEqual(rc, 0)
+        self.assertEqual(line, '? foo')
+
+    def testSystem(self):
+        self.modify(self.packagedir)
+        rc = self.process.system(['hg', 'commit', '-m', 'Modified'], cwd=self.packagedir)
+        self.assertEqual(rc, 0)
+        rc, lines = Process(quiet=True).popen(['hg', 'status', '-m'], cwd=self.packagedir)
+        self.assertEqual(lines, [])
+
+    def testSeesChanges(self):
+        rc, lines = self.process.popen(['hg', 'status', '-m'], cwd=self.packagedir)
+        self.assertEqual(lines, [])
+        self.modify(self.packagedir)
+        rc, lines = self.process.popen(['hg', 'status', '-m'], cwd=self.packagedir)
+        self.assertEqual(lines, ['M setup.py'])
+
+    def testNotServed(self):
+        self.process.popen(['hg', '--version'])
+        self.process.popen(['hg', 'root'], cwd=self.tempdir)
+        self.process.system(['hg', 'clone', 'testpackage', 'testclone'])
+        self.process.popen(['echo', 'foo'], cwd=self.packagedir)
+        self.assertEqual(self.process.servers, {})
+
+    def testFailedServer(self):
+        self.process.popen(['hg', 'root'], cwd=self.packagedir)
+        self.process.servers[self.packagedir].server.stdin.close()
+        rc, lines = self.process.popen(['hg', 'root'], cwd=self.packagedir)
+        self.assertEqual(rc, 0)
+        self.assertEqual(lines, [self.packagedir])
+        self.assertEqual(self.process.servers[self.packagedir], None)
+
+    def testLedger(self):
+        Process.ledger = Ledger()
+        try:
+            self.process.popen(['hg', 'root'], cwd=self.packagedir)
+            self.assertEqual(len(Process.ledger), 1)
+            entry = Process.ledger.entries[0]
+            self.assertEqual(entry.cmd, ['hg', 'root'])
+            self.assertEqual(entry.nbytes, len(self.packagedir) + 1)
+            self.assertEqual(entry.nbytes2, 0)
+        finally:
+            Process.ledger = None
+
+    def testLedgerElapsed(self):
+        # Time spent in the server counts
+        self.process.popen(['hg', 'root'], cwd=self.packagedir)
+        server = self.process.servers[self.packagedir]
+        receive = server.receive
+        def slow_receive():
+            time.sleep(0.1)
+            return receive()
+        server.receive = slow_receive
+        Process.ledger = Ledger()
+        try:
+            self.process.popen(['hg', 'root'], cwd=self.packagedir)
+            self.failUnless(Process.ledger.entries[0].elapsed >= 0.1)
+        finally:
+            Process.ledger = None
+
+    def testClose(self):
+        self.process.popen(['hg', 'root'], cwd=self.packagedir)
+        server = self.process.servers[self.packagedir]
+        child = server.server
+        self.process.close()
+        self.assertEqual(self.process.servers, {})
+        self.failIfEqual(child.returncode, None)
+
+
+class MercurialTests(CommandServerSetup):
+
+    @quiet
+    def testMercurial(self):
+        scm = Mercurial(self.process)
+        self.assertEqual(scm.is_valid_sandbox(self.packagedir), True)
+        self.assertEqual(scm.get_root_from_sandbox(self.packagedir), self.packagedir)
+        self.assertEqual(scm.get_branch_from_sandbox(self.packagedir), 'default')
+        self.assertEqual(scm.is_dirty_sandbox(self.packagedir), False)
+        self.modify(self.packagedir)
+        self.assertEqual(scm.is_dirty_sandbox(self.packagedir), True)
+        scm.commit_sandbox(self.packagedir, 'testpackage', '2.6', False)
+        self.assertEqual(scm.is_dirty_sandbox(self.packagedir), False)
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), False)
+        scm.create_tag(self.packagedir, '2.6', 'testpackage', '2.6', False)
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), True)
+        self.assertEqual(self.process.servers.keys(), [self.packagedir])
+
+
+class FindRootTests(CommandServerSetup):
+
+    def testFindRoot(self):
+        self.assertEqual(find_root(self.packagedir), self.packagedir)
+        self.assertEqual(find_root(join(self.packagedir, 'testpackage')), self.packagedir)
+
+    def testNoRoot(self):
+        self.assertEqual(find_root(self.tempdir), None)
+
+
+class DefaultsTests(JailSetup):
+
+    def testOffByDefault(self):
+        self.mkfile('mkrelease.cfg', '[mkrelease]\n')
+        self.assertEqual(Defaults('mkrelease.cfg').cmdserver, False)
+
+    def testEnabled(self):
+        self.mkfile('mkrelease.cfg', '[mkrelease]\ncmdserver = yes\n')
+        self.assertEqual(Defaults('mkrelease.cfg').cmdserver, True)
+
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -4,11 +4,15 @@ import os
 from os.path import join, isdir
 
 from jarn.mkrelease.scm import Git
+from jarn.mkrelease.scm import Status
+from jarn.mkrelease.memo import Memo
 
 from jarn.mkrelease.process import Process
+from jarn.mkrelease.ledger import Ledger
 
 from jarn.mkrelease.testing import GitSetup
 from jarn.mkrelease.testing import MockProcess
+from jarn.mkrelease.testing import NullReader
 from jarn.mkrelease.testing import quiet
 
 
@@ -115,7 +119,7 @@ class RootFromSandboxTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=1))
+        scm = Git(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_root_from_sandbox, self.packagedir)
 
 
@@ -143,7 +147,7 @@ class BranchFromSandboxTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=1))
+        scm = Git(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_branch_from_sandbox, self.packagedir)
 
 
@@ -166,17 +170,17 @@ class RemoteFromSandboxTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=1))
+        scm = Git(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_remote_from_sandbox, self.packagedir)
 
     @quiet
     def testWhitebox(self):
         def func(cmd):
-            if cmd == 'git branch':
+            if cmd == ['git', 'branch']:
                 return 0, ['* master']
             return 1, []
 
-        scm = Git(MockProcess(func=func))
+        scm = Git(MockProcess(func=func), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_remote_from_sandbox, self.packagedir)
 
 
@@ -199,17 +203,17 @@ class TrackedBranchFromSandboxTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=1))
+        scm = Git(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_tracked_branch_from_sandbox, self.packagedir)
 
     @quiet
     def testWhitebox(self):
         def func(cmd):
-            if cmd == 'git branch':
+            if cmd == ['git', 'branch']:
                 return 0, ['* master']
             return 1, []
 
-        scm = Git(MockProcess(func=func))
+        scm = Git(MockProcess(func=func), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_tracked_branch_from_sandbox, self.packagedir)
 
 
@@ -232,7 +236,7 @@ class UrlFromSandboxTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=1))
+        scm = Git(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_url_from_sandbox, self.packagedir)
 
     @quiet
@@ -240,15 +244,15 @@ class UrlFromSandboxTests(GitSetup):
         self.called = 0
 
         def func(cmd):
-            if cmd == 'git branch':
+            if cmd == ['git', 'branch']:
                 return 0, ['* master']
-            if cmd == 'git config -l':
+            if cmd == ['git', 'config', '-l']:
                 self.called += 1
                 if self.called == 1:
                     return 0, ['branch.master.remote=origin']
             return 1, []
 
-        scm = Git(MockProcess(func=func))
+        scm = Git(MockProcess(func=func), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_url_from_sandbox, self.packagedir)
 
 
@@ -271,7 +275,7 @@ class RemoteSandboxTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=1))
+        scm = Git(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.is_remote_sandbox, self.packagedir)
 
 
@@ -305,7 +309,7 @@ class DirtySandboxTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=128))
+        scm = Git(MockProcess(rc=128), reader=NullReader())
         self.assertRaises(SystemExit, scm.is_dirty_sandbox, self.packagedir)
 
     @quiet
@@ -345,7 +349,7 @@ class UncleanSandboxTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=128))
+        scm = Git(MockProcess(rc=128), reader=NullReader())
         self.assertRaises(SystemExit, scm.is_unclean_sandbox, self.packagedir)
 
     @quiet
@@ -355,6 +359,43 @@ class UncleanSandboxTests(GitSetup):
         self.assertRaises(SystemExit, scm.check_unclean_sandbox, self.packagedir)
 
 
+class StatusTests(GitSetup):
+
+    def testCleanSandbox(self):
+        scm = Git()
+        self.assertEqual(scm.get_status_from_sandbox(self.packagedir), Status(False, False))
+
+    def testModifiedFile(self):
+        scm = Git()
+        self.modify(self.packagedir)
+        self.assertEqual(scm.get_status_from_sandbox(self.packagedir), Status(True, True))
+
+    def testDeletedButTrackedFile(self):
+        scm = Git()
+        self.delete(self.packagedir)
+        self.assertEqual(scm.get_status_from_sandbox(self.packagedir), Status(True, True))
+
+    def testOneScan(self):
+        scm = Git()
+        scm.memo = Memo()
+        self.modify(self.packagedir)
+        self.assertEqual(scm.is_dirty_sandbox(self.packagedir), True)
+        self.assertEqual(scm.is_unclean_sandbox(self.packagedir), True)
+        self.assertEqual(scm.memo.stats['get_status_from_sandbox'], (1, 1))
+
+    def testStopsAtFirstLine(self):
+        commands = []
+        def func(cmd):
+            commands.append(cmd)
+            if cmd == ['git', '--version']:
+                return 0, ['git version 2.18.0']
+            return 0, [' M setup.py', ' M README.txt']
+        scm = Git(MockProcess(func=func), reader=NullReader())
+        self.assertEqual(scm.get_status_from_sandbox(self.packagedir), Status(True, True))
+        self.assertEqual(commands[-1], ['git', 'status', '--porcelain', '--untracked-files=no',
+                                        '--no-renames', '.'])
+
+
 class CommitSandboxTests(GitSetup):
 
     def testCommitCleanSandbox(self):
@@ -406,7 +447,7 @@ class CommitSandboxTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=255))
+        scm = Git(MockProcess(rc=255), reader=NullReader())
         self.assertRaises(SystemExit, scm.commit_sandbox, self.packagedir, 'testpackage', '2.6', False)
 
 
@@ -425,10 +466,97 @@ class CloneUrlTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=1))
+        scm = Git(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.clone_url, self.packagedir, 'testclone')
 
 
+class ShallowCloneUrlTests(GitSetup):
+
+    def testShallowCloneUrl(self):
+        scm = Git(Process(quiet=True))
+        self.assertEqual(scm.shallow_clone_url('file://'+self.packagedir, 'testclone', 'master'), 0)
+        clonedir = join(self.tempdir, 'testclone')
+        self.assertEqual(scm.get_branch_from_sandbox(clonedir), 'master')
+        self.assertEqual(scm.is_shallow_sandbox(clonedir), True)
+        self.assertEqual(scm.is_shallow_sandbox(self.packagedir), False)
+
+    def testShallowCloneTag(self):
+        scm = Git(Process(quiet=True))
+        self.tag(self.packagedir, '2.6')
+        self.assertEqual(scm.shallow_clone_url('file://'+self.packagedir, 'testclone', '2.6'), 0)
+        self.assertEqual(isdir('testclone'), True)
+
+    def testIsShallowNoReader(self):
+        scm = Git(Process(quiet=True), reader=NullReader())
+        scm.shallow_clone_url('file://'+self.packagedir, 'testclone', 'master')
+        self.assertEqual(scm.is_shallow_sandbox(join(self.tempdir, 'testclone')), True)
+        self.assertEqual(scm.is_shallow_sandbox(self.packagedir), False)
+
+    def testRemoteTagExists(self):
+        scm = Git(Process(quiet=True))
+        Process(quiet=True).system(['git', 'tag', '2.6', 'master~1'], cwd=self.packagedir)
+        scm.shallow_clone_url('file://'+self.packagedir, 'testclone', 'master')
+        clonedir = join(self.tempdir, 'testclone')
+        self.assertEqual(Git(reader=NullReader()).tag_exists(clonedir, '2.6'), True)
+        self.assertEqual(Git().tag_exists(clonedir, '2.6'), True)
+        self.assertEqual(Git().tag_exists(clonedir, '2.7'), False)
+
+    def testCreateTag(self):
+        scm = Git(Process(quiet=True))
+        scm.shallow_clone_url('file://'+self.packagedir, 'testclone', 'master')
+        clonedir = join(self.tempdir, 'testclone')
+        self.assertEqual(scm.tag_exists(clonedir, '2.6'), False)
+        self.assertEqual(scm.create_tag(clonedir, '2.6', 'testpackage', '2.6', True), 0)
+        self.assertEqual(scm.tag_exists(clonedir, '2.6'), True)
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), True)
+
+    def testShallowCloneCommit(self):
+        scm = Git(Process(quiet=True))
+        commit = Process(quiet=True).pipe(['git', 'rev-parse', 'master~1'], cwd=self.packagedir)
+        self.assertEqual(scm.shallow_clone_url('file://'+self.packagedir, 'testclone', commit), 0)
+        clonedir = join(self.tempdir, 'testclone')
+        self.assertEqual(Process(quiet=True).pipe(['git', 'rev-parse', 'HEAD'], cwd=clonedir), commit)
+        self.assertEqual(scm.is_shallow_sandbox(clonedir), True)
+        self.assertEqual(Process(quiet=True).pipe(['git', 'remote'], cwd=clonedir), 'origin')
+
+    def testShallowCloneCommitCommands(self):
+        commands = []
+        def func(cmd):
+            commands.append(cmd)
+            return 0, []
+        scm = Git(MockProcess(func=func), reader=NullReader())
+        commit = 'a' * 40
+        self.assertEqual(scm.shallow_clone_url('file://'+self.packagedir, 'testclone', commit), 0)
+        self.assertEqual(commands, [
+            ['git', 'init', '-q', 'testclone'],
+            ['git', 'remote', 'add', 'origin', 'file://'+self.packagedir],
+            ['git', 'fetch', '--depth', '1', 'origin', commit],
+            ['git', 'checkout', '-q', 'FETCH_HEAD'],
+        ])
+
+    @quiet
+    def testBadCommit(self):
+        scm = Git(Process(quiet=True))
+        self.assertRaises(SystemExit, scm.shallow_clone_url, 'file://'+self.packagedir, 'testclone', 'a' * 40)
+
+    @quiet
+    def testAbbreviatedCommit(self):
+        scm = Git(Process(quiet=True))
+        commit = Process(quiet=True).pipe(['git', 'rev-parse', '--short', 'master~1'], cwd=self.packagedir)
+        self.assertRaises(SystemExit, scm.shallow_clone_url, 'file://'+self.packagedir, 'testclone', commit)
+
+    @quiet
+    def testBadBranch(self):
+        scm = Git(Process(quiet=True))
+        self.assertRaises(SystemExit, scm.shallow_clone_url, 'file://'+self.packagedir, 'testclone', 'peng')
+
+    @quiet
+    def testBadServer(self):
+        scm = Git(Process(quiet=True))
+        self.destroy()
+        self.assertRaises(SystemExit, scm.shallow_clone_url, 'file://'+self.packagedir, 'testclone', 'master')
+
+
 class BranchIdTests(GitSetup):
 
     def testMakeBranchId(self):
@@ -479,7 +607,7 @@ class SwitchBranchTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=1))
+        scm = Git(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.switch_branch, self.packagedir, 'master')
 
 
@@ -502,7 +630,7 @@ class TagExistsTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=1))
+        scm = Git(MockProcess(rc=128), reader=NullReader())
         self.assertRaises(SystemExit, scm.check_tag_exists, self.packagedir, '2.6')
 
     @quiet
@@ -511,6 +639,22 @@ class TagExistsTests(GitSetup):
         self.tag(self.packagedir, '2.6')
         self.assertRaises(SystemExit, scm.check_tag_exists, self.packagedir, '2.6')
 
+    def testPackedTag(self):
+        scm = Git()
+        self.tag(self.packagedir, '2.6')
+        Process(quiet=True).system(['git', 'pack-refs', '--all'], cwd=self.packagedir)
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), True)
+        self.assertEqual(scm.tag_exists(self.packagedir, '2'), False)
+
+    def testTagDoesNotExistNoReader(self):
+        scm = Git(reader=NullReader())
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), False)
+
+    def testTagExistsNoReader(self):
+        scm = Git(reader=NullReader())
+        self.tag(self.packagedir, '2.6')
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), True)
+
 
 class CreateTagTests(GitSetup):
 
@@ -555,10 +699,150 @@ class CreateTagTests(GitSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Git(MockProcess(rc=1))
+        scm = Git(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.create_tag, self.packagedir, '2.6', 'testpackage', '2.6', False)
 
 
+class PushSandboxTests(GitSetup):
+
+    def setUp(self):
+        GitSetup.setUp(self)
+        self.clone()
+        Process(quiet=True).system(['git', 'checkout', '-q', 'master'], cwd=self.clonedir)
+
+    def testPushCommitAndTag(self):
+        scm = Git(Process(quiet=True))
+        self.modify(self.clonedir)
+        scm.commit_sandbox(self.clonedir, 'testpackage', '2.6', False)
+        scm.create_tag(self.clonedir, '2.6', 'testpackage', '2.6', False)
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), False)
+        self.assertEqual(scm.push_sandbox(self.clonedir, '2.6'), 0)
+        self.assertEqual(Git().tag_exists(self.packagedir, '2.6'), True)
+        self.update(self.packagedir)
+        self.verify(self.packagedir)
+
+    def testPushCommit(self):
+        scm = Git(Process(quiet=True))
+        self.modify(self.clonedir)
+        scm.commit_sandbox(self.clonedir, 'testpackage', '2.6', False)
+        self.assertEqual(scm.push_sandbox(self.clonedir), 0)
+        self.update(self.packagedir)
+        self.verify(self.packagedir)
+
+    def testPushTag(self):
+        scm = Git(Process(quiet=True))
+        scm.create_tag(self.clonedir, '2.6', 'testpackage', '2.6', False)
+        self.assertEqual(scm.push_sandbox(self.clonedir, '2.6', False), 0)
+        self.assertEqual(Git().tag_exists(self.packagedir, '2.6'), True)
+
+    @quiet
+    def testPushLocalSandbox(self):
+        scm = Git(Process(quiet=True))
+        self.assertEqual(scm.push_sandbox(self.packagedir, '2.6'), 0)
+
+    @quiet
+    def testBadPush(self):
+        scm = Git(Process(quiet=True))
+        scm.create_tag(self.clonedir, '2.6', 'testpackage', '2.6', False)
+        self.destroy()
+        self.assertRaises(SystemExit, scm.push_sandbox, self.clonedir, '2.6')
+
+    def testAtomic(self):
+        commands = []
+        def func(cmd):
+            commands.append(cmd)
+            if cmd == ['git', '--version']:
+                return 0, ['git version 2.4.0']
+            return 0, []
+        scm = Git(MockProcess(func=func))
+        self.assertEqual(scm.push_sandbox(self.clonedir, '2.6'), 0)
+        self.assertEqual(commands[-1], ['git', 'push', '--atomic', 'origin',
+                                        'master:master', 'refs/tags/2.6'])
+
+    def testNotAtomic(self):
+        commands = []
+        def func(cmd):
+            commands.append(cmd)
+            if cmd == ['git', '--version']:
+                return 0, ['git version 2.3.9']
+            return 0, []
+        scm = Git(MockProcess(func=func))
+        self.assertEqual(scm.push_sandbox(self.clonedir, '2.6'), 0)
+        self.assertEqual(commands[-1], ['git', 'push', 'origin',
+                                        'master:master', 'refs/tags/2.6'])
+
+    def testAtomicNotSupported(self):
+        commands = []
+        def func(cmd):
+            commands.append(cmd)
+            if cmd == ['git', '--version']:
+                return 0, ['git version 2.4.0']
+            if '--atomic' in cmd:
+                return 128, [], ['fatal: the receiving end does not support --atomic push']
+            return 0, []
+        scm = Git(MockProcess(func=func))
+        self.assertEqual(scm.push_sandbox(self.clonedir, '2.6'), 0)
+        self.assertEqual(commands[-2:], [
+            ['git', 'push', '--atomic', 'origin', 'master:master', 'refs/tags/2.6'],
+            ['git', 'push', 'origin', 'master:master', 'refs/tags/2.6']])
+
+    @quiet
+    def testAtomicRejected(self):
+        commands = []
+        def func(cmd):
+            commands.append(cmd)
+            if cmd == ['git', '--version']:
+                return 0, ['git version 2.4.0']
+            if cmd[:2] == ['git', 'push']:
+                return 1, []
+            return 0, []
+        scm = Git(MockProcess(func=func))
+        self.assertRaises(SystemExit, scm.push_sandbox, self.clonedir, '2.6')
+        self.assertEqual(len([x for x in commands if x[:2] == ['git', 'push']]), 1)
+
+    @quiet
+    def testAtomicAuthFailed(self):
+        commands = []
+        def func(cmd):
+            commands.append(cmd)
+            if cmd == ['git', '--version']:
+                return 0, ['git version 2.4.0']
+            if cmd[:2] == ['git', 'push']:
+                return 128, [], ["fatal: Authentication failed for 'https://example.com/repo.git/'"]
+            return 0, []
+        scm = Git(MockProcess(func=func))
+        self.assertRaises(SystemExit, scm.push_sandbox, self.clonedir, '2.6')
+        self.assertEqual(len([x for x in commands if x[:2] == ['git', 'push']]), 1)
+
+    @quiet
+    def testAtomicRefRejected(self):
+        commands = []
+        def func(cmd):
+            commands.append(cmd)
+            if cmd == ['git', '--version']:
+                return 0, ['git version 2.4.0']
+            if cmd[:2] == ['git', 'push']:
+                return 1, [], ['error: atomic push failed for ref refs/heads/master. status: 2']
+            return 0, []
+        scm = Git(MockProcess(func=func))
+        self.assertRaises(SystemExit, scm.push_sandbox, self.clonedir, '2.6')
+        self.assertEqual(len([x for x in commands if x[:2] == ['git', 'push']]), 1)
+
+    @quiet
+    def testAtomicUnreachable(self):
+        scm = Git(Process(quiet=True))
+        scm.create_tag(self.clonedir, '2.6', 'testpackage', '2.6', False)
+        Process(quiet=True).system(['git', 'remote', 'set-url', 'origin', join(self.tempdir, 'missing')],
+                                   cwd=self.clonedir)
+        Process.ledger = Ledger()
+        try:
+            self.assertRaises(SystemExit, scm.push_sandbox, self.clonedir, '2.6')
+            pushes = [x for x in Process.ledger.entries if x.cmd[:2] == ['git', 'push']]
+        finally:
+            Process.ledger = None
+        self.assertEqual(len(pushes), 1)
+
+
 class GetVersionTests(unittest.TestCase):
 
     def testGetVersion(self):
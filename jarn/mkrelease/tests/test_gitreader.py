@@ -0,0 +1,210 @@
+import unittest
+import os
+
+from os.path import join
+
+from jarn.mkrelease.gitreader import GitReader
+from jarn.mkrelease.gitreader import ConfigReader
+from jarn.mkrelease.gitreader import is_safe_refname
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.scm import Git
+
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import GitSetup
+from jarn.mkrelease.testing import NullReader
+
+
+class ReaderSetup(GitSetup):
+
+    def setUp(self):
+        GitSetup.setUp(self)
+        self.reader = GitReader()
+        self.git = Git(Process(quiet=True), reader=NullReader())
+        self.process = Process(quiet=True)
+
+    def assertSameAsGit(self, dir):
+        git = self.git
+        reader = self.reader
+        self.assertEqual(reader.is_valid_sandbox(dir), git.is_valid_sandbox(dir))
+        self.assertEqual(reader.get_root(dir), git.get_root_from_sandbox(dir))
+        self.assertEqual(reader.get_branch(dir), git.get_branch_from_sandbox(dir))
+        self.assertEqual(reader.get_config_lines(dir), git.get_config_from_sandbox(dir)[1])
+
+
+class ReaderTests(ReaderSetup):
+
+    def testSandbox(self):
+        self.assertSameAsGit(self.packagedir)
+
+    def testSubdirectory(self):
+        self.assertSameAsGit(join(self.packagedir, 'testpackage'))
+
+    def testClone(self):
+        self.clone()
+        self.assertSameAsGit(self.clonedir)
+        self.assertEqual(self.reader.get_config_lines(self.clonedir),
+                         self.git.get_config_from_sandbox(self.clonedir)[1])
+
+    def testBranch(self):
+        self.branch(self.packagedir, 'feature/foo')
+        self.assertEqual(self.reader.get_branch(self.packagedir), 'feature/foo')
+
+    def testDetachedHead(self):
+        self.tag(self.packagedir, '2.6')
+        self.assertEqual(self.reader.get_branch(self.packagedir), None)
+
+    def testUnbornBranch(self):
+        self.process.system(['git', 'checkout', '-q', '--orphan', 'empty'], cwd=self.packagedir)
+        self.assertEqual(self.reader.get_branch(self.packagedir), None)
+
+    def testTags(self):
+        self.process.system(['git', 'tag', '2.6'], cwd=self.packagedir)
+        self.process.system(['git', 'tag', 'foo/bar'], cwd=self.packagedir)
+        self.assertEqual(self.reader.tag_exists(self.packagedir, '2.6'), True)
+        self.assertEqual(self.reader.tag_exists(self.packagedir, 'foo/bar'), True)
+        self.assertEqual(self.reader.tag_exists(self.packagedir, 'foo'), False)
+        self.assertEqual(self.reader.tag_exists(self.packagedir, '2.7'), False)
+
+    def testPackedTags(self):
+        self.process.system(['git', 'tag', '2.6'], cwd=self.packagedir)
+        self.process.system(['git', 'pack-refs', '--all'], cwd=self.packagedir)
+        self.assertEqual(os.path.exists(join(self.packagedir, '.git', 'refs', 'tags', '2.6')), False)
+        self.assertEqual(self.reader.tag_exists(self.packagedir, '2.6'), True)
+        self.assertEqual(self.reader.tag_exists(self.packagedir, '2'), False)
+        self.assertSameAsGit(self.packagedir)
+
+    def testBadTagName(self):
+        self.assertEqual(self.reader.tag_exists(self.packagedir, '../HEAD'), None)
+
+    def testWorktree(self):
+        rc = self.process.system(['git', 'worktree', 'add', '-q', '-b', 'other',
+                                  join(self.tempdir, 'worktree')], cwd=self.packagedir)
+        if rc != 0:
+            return # Git too old
+        worktree = join(self.tempdir, 'worktree')
+        self.assertSameAsGit(worktree)
+        self.assertEqual(self.reader.get_branch(worktree), 'other')
+        self.process.system(['git', 'tag', '2.6'], cwd=self.packagedir)
+        self.assertEqual(self.reader.tag_exists(worktree, '2.6'), True)
+
+    def testInclude(self):
+        self.mkfile('included', '[remote "origin"]\n\turl = /foo\n')
+        self.process.system(['git', 'config', 'include.path', join(self.tempdir, 'included')],
+                            cwd=self.packagedir)
+        self.assertSameAsGit(self.packagedir)
+        self.failUnless('remote.origin.url=/foo' in self.reader.get_config_lines(self.packagedir))
+
+    def testIncludeIf(self):
+        self.mkfile('included', '[remote "origin"]\n\turl = /foo\n')
+        self.mkfile('excluded', '[remote "origin"]\n\turl = /bar\n')
+        config = join(self.packagedir, '.git', 'config')
+        with open(config, 'at') as file:
+            file.write('[includeIf "gitdir:testpackage/"]\n\tpath = %s\n' % join(self.tempdir, 'included'))
+            file.write('[includeIf "gitdir:other/"]\n\tpath = %s\n' % join(self.tempdir, 'excluded'))
+            file.write('[includeIf "onbranch:ma*"]\n\tpath = %s\n' % join(self.tempdir, 'included'))
+        lines = self.reader.get_config_lines(self.packagedir)
+        self.assertSameAsGit(self.packagedir)
+        self.failUnless('remote.origin.url=/foo' in lines)
+        self.failIf('remote.origin.url=/bar' in lines)
+
+    def testUnknownIncludeIf(self):
+        config = join(self.packagedir, '.git', 'config')
+        with open(config, 'at') as file:
+            file.write('[includeIf "hasconfig:remote.*.url:foo"]\n\tpath = foo\n')
+        self.assertEqual(self.reader.get_config_lines(self.packagedir), None)
+
+    def testValuelessBoolean(self):
+        # A key without value means true
+        self.process.system(['git', 'config', 'core.repositoryformatversion', '1'], cwd=self.packagedir)
+        config = join(self.packagedir, '.git', 'config')
+        with open(config, 'at') as file:
+            file.write('[extensions]\n\tworktreeConfig\n')
+        self.mkfile(join(self.packagedir, '.git', 'config.worktree'), '[foo]\n\tbar = baz\n')
+        self.assertSameAsGit(self.packagedir)
+        self.failUnless('foo.bar=baz' in self.reader.get_config_lines(self.packagedir))
+        self.assertEqual(Git().is_valid_sandbox(self.packagedir), True)
+
+    def testValuelessBare(self):
+        config = join(self.packagedir, '.git', 'config')
+        with open(config, 'at') as file:
+            file.write('[core]\n\tbare\n')
+        self.assertEqual(self.reader.is_valid_sandbox(self.packagedir), None)
+        self.assertEqual(self.reader.get_branch(self.packagedir), None)
+
+    def testGitDir(self):
+        os.environ['GIT_DIR'] = join(self.packagedir, '.git')
+        try:
+            self.assertEqual(self.reader.get_root(self.packagedir), None)
+        finally:
+            del os.environ['GIT_DIR']
+
+    def testInsideGitDir(self):
+        self.assertEqual(self.reader.is_valid_sandbox(join(self.packagedir, '.git')), None)
+        self.assertEqual(self.reader.is_valid_sandbox(join(self.packagedir, '.git', 'refs')), None)
+
+    def testBareRepo(self):
+        self.process.system(['git', 'clone', '-q', '--bare', 'testpackage', 'bare.git'])
+        self.assertEqual(self.reader.is_valid_sandbox(join(self.tempdir, 'bare.git')), None)
+
+    def testNoSandbox(self):
+        self.destroy()
+        self.assertEqual(self.reader.is_valid_sandbox(self.packagedir), False)
+        self.assertEqual(self.reader.get_root(self.packagedir), None)
+
+
+class ConfigReaderTests(JailSetup):
+
+    def parse(self, text):
+        return list(ConfigReader(None, None).parse(text))
+
+    def testSections(self):
+        self.assertEqual(self.parse('[Core]\n\tBare = false\n'), [('core.bare', 'false')])
+        self.assertEqual(self.parse('[remote "Origin"]\nurl=foo'), [('remote.Origin.url', 'foo')])
+        self.assertEqual(self.parse('[Remote.Origin]\nurl=foo'), [('remote.origin.url', 'foo')])
+        self.assertEqual(self.parse('[a "b\\"c\\\\"] d = e'), [('a.b"c\\.d', 'e')])
+
+    def testValues(self):
+        self.assertEqual(self.parse('[a]\nb\n'), [('a.b', None)])
+        self.assertEqual(self.parse('[a]\nb =\n'), [('a.b', '')])
+        self.assertEqual(self.parse('[a]\nb = c  d  \n'), [('a.b', 'c  d')])
+        self.assertEqual(self.parse('[a]\nb = " c ; d "\n'), [('a.b', ' c ; d ')])
+        self.assertEqual(self.parse('[a]\nb = c ; d\n'), [('a.b', 'c')])
+        self.assertEqual(self.parse('[a]\nb = c # d\n'), [('a.b', 'c')])
+        self.assertEqual(self.parse('[a]\nb = c\\td\\n\\\\\n'), [('a.b', 'c\td\n\\')])
+        self.assertEqual(self.parse('[a]\nb = c \\\n d\n'), [('a.b', 'c  d')])
+        self.assertEqual(self.parse('[a]\r\nb = c\r\n'), [('a.b', 'c')])
+
+    def testComments(self):
+        self.assertEqual(self.parse('# foo\n; bar\n[a] ; baz\nb = c\n'), [('a.b', 'c')])
+
+    def testErrors(self):
+        self.assertRaises(ValueError, self.parse, 'b = c\n')
+        self.assertRaises(ValueError, self.parse, '[a\n')
+        self.assertRaises(ValueError, self.parse, '[a]\nb = "c\n')
+        self.assertRaises(ValueError, self.parse, '[a]\nb = \\x\n')
+
+    def testSameAsGit(self):
+        text = ('[a "B.c"]\n\td = " x\\" y" ; comment\n'
+                '[e.F]\n\tg\n\th = 1 \\\n 2\n'
+                '[i]\n\tj = k\n\tj = l\n')
+        self.mkfile('config', text)
+        process = Process(quiet=True)
+        rc, lines = process.popen(['git', 'config', '-f', 'config', '-l'], echo=False)
+        self.assertEqual(rc, 0)
+        parsed = ['%s=%s' % x if x[1] is not None else x[0] for x in self.parse(text)]
+        self.assertEqual(parsed, lines)
+
+
+class RefnameTests(unittest.TestCase):
+
+    def testSafe(self):
+        self.assertEqual(is_safe_refname('2.6'), True)
+        self.assertEqual(is_safe_refname('release/2.6'), True)
+
+    def testUnsafe(self):
+        for name in ('', '/2.6', '2.6/', '../x', 'a..b', '.x', 'a/.x', 'x.lock', 'a b', 'a~1', 'a^', 'a:b', 'a@{1}'):
+            self.assertEqual(is_safe_refname(name), False, name)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
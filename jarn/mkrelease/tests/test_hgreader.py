@@ -0,0 +1,139 @@
+import unittest
+import os
+
+from os.path import join
+
+from jarn.mkrelease.hgreader import HgReader
+from jarn.mkrelease.hgreader import ConfigReader
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.scm import Mercurial
+
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import MercurialSetup
+from jarn.mkrelease.testing import NullReader
+from jarn.mkrelease.testing import appendlines
+
+
+class ReaderSetup(MercurialSetup):
+
+    def setUp(self):
+        MercurialSetup.setUp(self)
+        self.reader = HgReader()
+        self.hg = Mercurial(Process(quiet=True), reader=NullReader())
+        self.process = Process(quiet=True)
+
+    def assertSameAsHg(self, dir):
+        hg = self.hg
+        reader = self.reader
+        self.assertEqual(reader.is_valid_sandbox(dir), hg.is_valid_sandbox(dir))
+        self.assertEqual(reader.get_root(dir), hg.get_root_from_sandbox(dir))
+        self.assertEqual(reader.get_branch(dir), hg.get_branch_from_sandbox(dir))
+        self.assertEqual(reader.get_path(dir), hg.get_url_from_sandbox(dir))
+
+    def sethgrc(self, dir, text):
+        self.mkfile(join(dir, '.hg', 'hgrc'), text)
+
+
+class ReaderTests(ReaderSetup):
+
+    def testSandbox(self):
+        self.sethgrc(self.packagedir, '[paths]\ndefault = /foo\n')
+        self.assertSameAsHg(self.packagedir)
+
+    def testSubdirectory(self):
+        self.sethgrc(self.packagedir, '[paths]\ndefault = /foo\n')
+        self.assertSameAsHg(join(self.packagedir, 'testpackage'))
+
+    def testClone(self):
+        self.clone()
+        self.assertSameAsHg(self.clonedir)
+        self.assertEqual(self.reader.get_path(self.clonedir), self.packagedir)
+
+    def testNoDefaultPath(self):
+        self.assertEqual(self.reader.get_path(self.packagedir), '')
+
+    def testBranch(self):
+        self.branch(self.packagedir, 'feature/foo')
+        self.sethgrc(self.packagedir, '[paths]\ndefault = /foo\n')
+        self.assertSameAsHg(self.packagedir)
+        self.assertEqual(self.reader.get_branch(self.packagedir), 'feature/foo')
+
+    def testNonAsciiBranch(self):
+        self.mkfile(join(self.packagedir, '.hg', 'branch'), 'f\xc3\xbc\n')
+        self.assertEqual(self.reader.get_branch(self.packagedir), None)
+
+    def testRelativePath(self):
+        self.sethgrc(self.packagedir, '[paths]\ndefault = ../foo\n')
+        self.assertSameAsHg(self.packagedir)
+        self.assertEqual(self.reader.get_path(self.packagedir), join(self.tempdir, 'foo'))
+
+    def testUrl(self):
+        self.sethgrc(self.packagedir, '[paths]\ndefault = ssh://hg@example.com/~/foo\n')
+        self.assertSameAsHg(self.packagedir)
+
+    def testInclude(self):
+        self.mkfile(join(self.packagedir, '.hg', 'paths.rc'), '[paths]\ndefault = foo\n')
+        self.sethgrc(self.packagedir, '[paths]\ndefault = /bar\n%include paths.rc\n')
+        self.assertSameAsHg(self.packagedir)
+        self.assertEqual(self.reader.get_path(self.packagedir), join(self.packagedir, 'foo'))
+
+    def testUnset(self):
+        self.sethgrc(self.packagedir, '[paths]\ndefault = /foo\n%unset default\n')
+        self.assertEqual(self.reader.get_path(self.packagedir), '')
+
+    def testMultiLinePath(self):
+        self.sethgrc(self.packagedir, '[paths]\ndefault = /foo\n  bar\n')
+        self.assertEqual(self.reader.get_path(self.packagedir), None)
+
+    def testUnknownRequirement(self):
+        appendlines(join(self.packagedir, '.hg', 'requires'), ['exp-foo'])
+        self.assertEqual(self.reader.is_valid_sandbox(self.packagedir), None)
+        self.assertEqual(self.reader.get_root(self.packagedir), None)
+
+    def testHgrcPath(self):
+        os.environ['HGRCPATH'] = ''
+        try:
+            self.assertEqual(self.reader.get_path(self.packagedir), None)
+        finally:
+            del os.environ['HGRCPATH']
+
+    def testNoSandbox(self):
+        self.destroy()
+        self.assertEqual(self.reader.is_valid_sandbox(self.packagedir), False)
+        self.assertEqual(self.reader.get_root(self.packagedir), None)
+        self.assertEqual(self.reader.get_branch(self.packagedir), None)
+
+
+class ConfigReaderTests(JailSetup):
+
+    def parse(self, text):
+        return ConfigReader().parse(text)
+
+    def testSections(self):
+        self.assertEqual(self.parse('[a]\nb = c\n[d]\ne=f\n'), [('a', 'b', 'c'), ('d', 'e', 'f')])
+
+    def testValues(self):
+        self.assertEqual(self.parse('[a]\nb =\nc = d e \n'), [('a', 'b', ''), ('a', 'c', 'd e')])
+
+    def testContinuation(self):
+        self.assertEqual(self.parse('[a]\nb = c\n  d\n# e\n  f\ng = h\n'),
+                         [('a', 'b', 'c\nd\nf'), ('a', 'g', 'h')])
+
+    def testComments(self):
+        self.assertEqual(self.parse('# foo\n; bar\n[a]\nb = c\n'), [('a', 'b', 'c')])
+
+    def testUnset(self):
+        self.assertEqual(self.parse('[a]\nb = c\n%unset b\n'), [('a', 'b', 'c'), ('a', 'b', None)])
+
+    def testInclude(self):
+        self.mkfile('other.rc', '[b]\nc = d\n')
+        self.mkfile('hgrc', '[a]\n%include other.rc\n%include missing.rc\n')
+        self.assertEqual(ConfigReader().read('hgrc'), [('b', 'c', 'd')])
+
+    def testErrors(self):
+        self.assertRaises(ValueError, self.parse, '[a]\n= c\n')
+        self.assertRaises(ValueError, self.parse, '[a\n')
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,115 @@
+import unittest
+import time
+
+from jarn.mkrelease.layoutcache import LayoutCache
+from jarn.mkrelease.diskcache import write_file
+from jarn.mkrelease.scm import Subversion
+
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import MockProcess
+from jarn.mkrelease.testing import NullReader
+
+URL = 'svn://example.com/repo/testpackage'
+UUID = '50221704-352c-4dd0-aa12-5dfe41ce1d12'
+LAYOUT = ('trunk', 'branches', 'tags')
+
+INFO_XML = ['<?xml version="1.0" encoding="UTF-8"?>',
+            '<info>',
+            '<entry kind="dir" path="." revision="1">',
+            '<url>%s/trunk</url>' % URL,
+            '<repository>',
+            '<root>svn://example.com/repo</root>',
+            '<uuid>%s</uuid>' % UUID,
+            '</repository>',
+            '</entry>',
+            '</info>']
+
+
+class LayoutCacheTests(JailSetup):
+
+    def testMissing(self):
+        cache = LayoutCache(self.tempdir)
+        self.assertEqual(cache.lookup(URL, UUID), None)
+
+    def testLookup(self):
+        cache = LayoutCache(self.tempdir)
+        self.assertEqual(cache.store(URL, UUID, LAYOUT), True)
+        self.assertEqual(cache.lookup(URL, UUID), LAYOUT)
+
+    def testOtherRepository(self):
+        cache = LayoutCache(self.tempdir)
+        cache.store(URL, UUID, LAYOUT)
+        self.assertEqual(cache.lookup(URL, 'other-uuid'), None)
+        self.assertEqual(cache.lookup(URL + '2', UUID), None)
+
+    def testExpired(self):
+        cache = LayoutCache(self.tempdir, ttl=60)
+        write_file(cache.get_filename(URL, UUID),
+                   '%f\n%s\n%s\ntrunk branches tags\n' % (time.time() - 61, URL, UUID))
+        self.assertEqual(cache.lookup(URL, UUID), None)
+
+    def testFuture(self):
+        cache = LayoutCache(self.tempdir, ttl=60)
+        write_file(cache.get_filename(URL, UUID),
+                   '%f\n%s\n%s\ntrunk branches tags\n' % (time.time() + 3600, URL, UUID))
+        self.assertEqual(cache.lookup(URL, UUID), None)
+
+    def testRefresh(self):
+        LayoutCache(self.tempdir).store(URL, UUID, LAYOUT)
+        cache = LayoutCache(self.tempdir, refresh=True)
+        self.assertEqual(cache.lookup(URL, UUID), None)
+
+    def testCorrupt(self):
+        cache = LayoutCache(self.tempdir)
+        write_file(cache.get_filename(URL, UUID), 'foo\n')
+        self.assertEqual(cache.lookup(URL, UUID), None)
+        write_file(cache.get_filename(URL, UUID), 'foo\n%s\n%s\ntrunk branches tags\n' % (URL, UUID))
+        self.assertEqual(cache.lookup(URL, UUID), None)
+
+
+class SubversionLayoutTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.commands = []
+
+    def func(self, cmd):
+        self.commands.append(cmd)
+        if cmd[:3] == ['svn', 'info', '--xml']:
+            return 0, INFO_XML
+        if cmd[:2] == ['svn', 'list']:
+            return 0, ['branches/', 'tags/', 'trunk/']
+
+    def make_scm(self, refresh=False):
+        scm = Subversion(MockProcess(func=self.func), reader=NullReader())
+        scm.layoutcache = LayoutCache(self.tempdir, refresh=refresh)
+        return scm
+
+    def count(self):
+        return len([x for x in self.commands if x[:2] == ['svn', 'list']])
+
+    def testCached(self):
+        self.assertEqual(self.make_scm().get_layout_from_sandbox('foo'), LAYOUT)
+        self.assertEqual(self.make_scm().get_layout_from_sandbox('foo'), LAYOUT)
+        self.assertEqual(self.count(), 1)
+
+    def testRefresh(self):
+        self.make_scm().get_layout_from_sandbox('foo')
+        self.make_scm(refresh=True).get_layout_from_sandbox('foo')
+        self.assertEqual(self.count(), 2)
+
+    def testMakeTagId(self):
+        self.make_scm().get_layout_from_sandbox('foo')
+        self.assertEqual(self.make_scm().make_tagid('foo', '2.6'), URL + '/tags/2.6')
+        self.assertEqual(self.count(), 1)
+
+    def testNoCache(self):
+        scm = Subversion(MockProcess(func=self.func), reader=NullReader())
+        scm.get_layout_from_sandbox('foo')
+        scm.get_layout_from_sandbox('foo')
+        self.assertEqual(self.count(), 2)
+        self.assertEqual(len(self.commands), 4)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
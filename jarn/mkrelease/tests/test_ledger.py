@@ -0,0 +1,126 @@
+import unittest
+import StringIO
+
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.process import AsyncProcess
+from jarn.mkrelease.ledger import Ledger
+from jarn.mkrelease.ledger import format_cmd
+
+from jarn.mkrelease.testing import JailSetup
+
+
+class LedgerSetup(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.ledger = Process.ledger = Ledger()
+
+    def tearDown(self):
+        Process.ledger = None
+        JailSetup.tearDown(self)
+
+
+class RecordTests(LedgerSetup):
+
+    def testRecord(self):
+        process = Process(quiet=True)
+        process.popen(['echo', 'Hello world'])
+        self.assertEqual(len(self.ledger), 1)
+        entry = self.ledger.entries[0]
+        self.assertEqual(entry.cmd, ['echo', 'Hello world'])
+        self.assertEqual(entry.cwd, self.tempdir)
+        self.assertEqual(entry.returncode, 0)
+        self.assertEqual(entry.nbytes, 12)
+        self.assertEqual(entry.nbytes2, 0)
+        self.failUnless(entry.end >= entry.start)
+
+    def testRecordStderr(self):
+        process = Process(quiet=True)
+        process.popen('echo "Hello world" >&2; exit 3')
+        entry = self.ledger.entries[0]
+        self.assertEqual(entry.returncode, 3)
+        self.assertEqual(entry.nbytes, 0)
+        self.assertEqual(entry.nbytes2, 12)
+
+    def testRecordBadCmd(self):
+        process = Process(quiet=True)
+        process.popen(['$', 'Hello world'])
+        entry = self.ledger.entries[0]
+        self.assertEqual(entry.returncode, 127)
+        self.assertEqual(entry.nbytes, 0)
+
+    def testRecordPipeAndSystem(self):
+        process = Process(quiet=True)
+        process.pipe(['echo', 'Hello world'])
+        process.system(['echo', 'Hello world'])
+        self.assertEqual(len(self.ledger), 2)
+
+    def testRecordAsync(self):
+        process = AsyncProcess(quiet=True)
+        job = process.pipe(['echo', 'Hello world'])
+        job.wait()
+        job.wait()
+        self.assertEqual(len(self.ledger), 1)
+
+    def testNoLedger(self):
+        Process.ledger = None
+        process = Process(quiet=True)
+        process.popen(['echo', 'Hello world'])
+        self.assertEqual(len(self.ledger), 0)
+
+
+class ReportTests(LedgerSetup):
+
+    def testRepeated(self):
+        process = Process(quiet=True)
+        process.popen(['echo', 'foo'])
+        process.popen(['echo', 'bar'])
+        process.popen(['echo', 'foo'])
+        repeated = self.ledger.get_repeated()
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0][0], 2)
+        self.assertEqual(repeated[0][2].cmd, ['echo', 'foo'])
+
+    def testRepeatedInOtherDir(self):
+        process = Process(quiet=True)
+        process.popen(['echo', 'foo'])
+        self.dirstack.push('/')
+        process.popen(['echo', 'foo'])
+        self.assertEqual(self.ledger.get_repeated(), [])
+
+    def testSlowest(self):
+        process = Process(quiet=True)
+        process.popen(['sleep', '0.2'])
+        process.popen(['echo', 'foo'])
+        slowest = self.ledger.get_slowest(1)
+        self.assertEqual(slowest[0].cmd, ['sleep', '0.2'])
+
+    def testReport(self):
+        process = Process(quiet=True)
+        process.popen(['echo', 'foo'])
+        process.popen(['echo', 'foo'])
+        file = StringIO.StringIO()
+        self.ledger.report(file)
+        lines = file.getvalue().split('\n')
+        self.assertEqual(lines[0], 'Commands: 2 run, %.3f s total, 8 bytes stdout, 0 bytes stderr' %
+                         sum(x.elapsed for x in self.ledger.entries))
+        self.assertEqual(lines[1], 'Slowest commands:')
+        self.failUnless(lines[-2].startswith('    2x'))
+        self.failUnless(lines[-2].endswith('echo foo  (in %s)' % self.tempdir))
+
+
+class FormatTests(unittest.TestCase):
+
+    def testArgv(self):
+        self.assertEqual(format_cmd(['git', 'commit', '-m', 'Prepare foo 1.0.']),
+                         "git commit -m 'Prepare foo 1.0.'")
+
+    def testString(self):
+        self.assertEqual(format_cmd('echo  "foo"\nexit 1'), 'echo "foo" exit 1')
+
+    def testTruncate(self):
+        self.assertEqual(format_cmd(['echo', 'x' * 100], 20), 'echo xxxxxxxxxxxx...')
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
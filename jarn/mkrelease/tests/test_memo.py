@@ -0,0 +1,164 @@
+import unittest
+import StringIO
+
+from jarn.mkrelease.memo import Memo
+from jarn.mkrelease.memo import memoize
+from jarn.mkrelease.memo import invalidates
+from jarn.mkrelease.scm import Git, Mercurial
+
+from jarn.mkrelease.testing import MockProcess
+from jarn.mkrelease.testing import NullReader
+
+
+class Thing(object):
+
+    memo = None
+
+    def __init__(self):
+        self.calls = 0
+
+    @memoize
+    def query(self, dir, arg=None):
+        self.calls += 1
+        return dir, arg
+
+    @memoize
+    def other(self, dir):
+        self.calls += 1
+        return dir
+
+    @memoize
+    def fail(self, dir):
+        self.calls += 1
+        raise SystemExit(1)
+
+    @invalidates('query')
+    def change(self, dir):
+        pass
+
+    @invalidates()
+    def change_all(self, dir):
+        pass
+
+
+class MemoTests(unittest.TestCase):
+
+    def setUp(self):
+        self.thing = Thing()
+        self.thing.memo = self.memo = Memo()
+
+    def testNoMemo(self):
+        self.thing.memo = None
+        self.thing.query('foo')
+        self.thing.query('foo')
+        self.assertEqual(self.thing.calls, 2)
+
+    def testHit(self):
+        self.assertEqual(self.thing.query('foo'), ('foo', None))
+        self.assertEqual(self.thing.query('foo'), ('foo', None))
+        self.assertEqual(self.thing.calls, 1)
+        self.assertEqual(self.memo.hits, 1)
+        self.assertEqual(self.memo.misses, 1)
+        self.assertEqual(self.memo.stats, {'query': (1, 1)})
+
+    def testKeys(self):
+        self.thing.query('foo')
+        self.thing.query('bar')
+        self.thing.query('foo', 'baz')
+        self.thing.other('foo')
+        self.assertEqual(self.thing.calls, 4)
+        self.assertEqual(len(self.memo), 4)
+
+    def testErrorsAreNotCached(self):
+        self.assertRaises(SystemExit, self.thing.fail, 'foo')
+        self.assertRaises(SystemExit, self.thing.fail, 'foo')
+        self.assertEqual(self.thing.calls, 2)
+
+    def testInvalidate(self):
+        self.thing.query('foo')
+        self.thing.other('foo')
+        self.thing.change('foo')
+        self.thing.query('foo')
+        self.thing.other('foo')
+        self.assertEqual(self.thing.calls, 3)
+
+    def testInvalidateAll(self):
+        self.thing.query('foo')
+        self.thing.other('foo')
+        self.thing.change_all('foo')
+        self.thing.query('foo')
+        self.thing.other('foo')
+        self.assertEqual(self.thing.calls, 4)
+
+    def testReport(self):
+        self.thing.query('foo')
+        self.thing.query('foo')
+        file = StringIO.StringIO()
+        self.memo.report(file)
+        lines = file.getvalue().split('\n')
+        self.assertEqual(lines[0], 'SCM queries: 1 hits, 1 misses')
+        self.assertEqual(lines[1].split(), ['query', '1', 'hits', '1', 'misses'])
+
+
+class SCMMemoTests(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = []
+
+    def func(self, cmd):
+        self.commands.append(cmd)
+        if cmd == ['git', 'branch']:
+            return 0, ['* master']
+        if cmd == ['git', 'config', '-l']:
+            return 0, ['branch.master.remote=origin',
+                       'branch.master.merge=refs/heads/master',
+                       'remote.origin.url=/foo']
+        if cmd[:2] == ['git', 'status']:
+            return 0, ['M setup.py']
+        if cmd[:2] == ['git', 'commit']:
+            return 0, []
+        if cmd == ['git', '--version']:
+            return 0, ['git version 2.0.0']
+        if cmd[:2] == ['hg', 'status']:
+            return 0, ['M setup.py']
+        if cmd[:2] == ['hg', 'log']:
+            return 0, []
+        if cmd[:2] == ['hg', 'tag']:
+            return 0, []
+
+    def testGitUrl(self):
+        scm = Git(MockProcess(func=self.func), reader=NullReader())
+        scm.memo = Memo()
+        self.assertEqual(scm.get_url_from_sandbox('foo'), '/foo')
+        self.assertEqual(scm.get_tracked_branch_from_sandbox('foo'), 'master')
+        self.assertEqual(self.commands, [['git', 'branch'], ['git', 'config', '-l']])
+
+    def testGitCommitInvalidates(self):
+        scm = Git(MockProcess(func=self.func), reader=NullReader())
+        scm.memo = Memo()
+        self.assertEqual(scm.is_dirty_sandbox('foo'), True)
+        self.assertEqual(scm.is_unclean_sandbox('foo'), True)
+        self.assertEqual(len([x for x in self.commands if x[:2] == ['git', 'status']]), 1)
+        scm.commit_sandbox('foo', 'testpackage', '2.6', False)
+        scm.is_dirty_sandbox('foo')
+        self.assertEqual(len([x for x in self.commands if x[:2] == ['git', 'status']]), 2)
+
+    def testHgTagInvalidates(self):
+        scm = Mercurial(MockProcess(func=self.func))
+        scm.memo = Memo()
+        self.assertEqual(scm.tag_exists('foo', '2.6'), False)
+        self.assertEqual(scm.tag_exists('foo', '2.6'), False)
+        self.assertEqual(len([x for x in self.commands if x[:2] == ['hg', 'log']]), 1)
+        scm.create_tag('foo', '2.6', 'testpackage', '2.6', False)
+        scm.tag_exists('foo', '2.6')
+        self.assertEqual(len([x for x in self.commands if x[:2] == ['hg', 'log']]), 2)
+
+    def testNoMemo(self):
+        scm = Git(MockProcess(func=self.func), reader=NullReader())
+        scm.get_url_from_sandbox('foo')
+        self.assertEqual(self.commands.count(['git', 'branch']), 1)
+        self.assertEqual(self.commands.count(['git', 'config', '-l']), 2)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
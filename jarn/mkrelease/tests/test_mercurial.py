@@ -4,11 +4,14 @@ import os
 from os.path import join, isdir
 
 from jarn.mkrelease.scm import Mercurial
+from jarn.mkrelease.scm import Status
+from jarn.mkrelease.memo import Memo
 
 from jarn.mkrelease.process import Process
 
 from jarn.mkrelease.testing import MercurialSetup
 from jarn.mkrelease.testing import MockProcess
+from jarn.mkrelease.testing import NullReader
 from jarn.mkrelease.testing import quiet
 
 
@@ -107,7 +110,7 @@ class RootFromSandboxTests(MercurialSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Mercurial(MockProcess(rc=1))
+        scm = Mercurial(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_root_from_sandbox, self.packagedir)
 
 
@@ -135,7 +138,7 @@ class BranchFromSandboxTests(MercurialSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Mercurial(MockProcess(rc=1))
+        scm = Mercurial(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_branch_from_sandbox, self.packagedir)
 
 
@@ -158,7 +161,7 @@ class UrlFromSandboxTests(MercurialSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Mercurial(MockProcess(rc=1))
+        scm = Mercurial(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_url_from_sandbox, self.packagedir)
 
 
@@ -181,7 +184,7 @@ class RemoteSandboxTests(MercurialSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Mercurial(MockProcess(rc=1))
+        scm = Mercurial(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.is_remote_sandbox, self.packagedir)
 
 
@@ -265,6 +268,31 @@ class UncleanSandboxTests(MercurialSetup):
         self.assertRaises(SystemExit, scm.check_unclean_sandbox, self.packagedir)
 
 
+class StatusTests(MercurialSetup):
+
+    def testCleanSandbox(self):
+        scm = Mercurial()
+        self.assertEqual(scm.get_status_from_sandbox(self.packagedir), Status(False, False))
+
+    def testModifiedFile(self):
+        scm = Mercurial()
+        self.modify(self.packagedir)
+        self.assertEqual(scm.get_status_from_sandbox(self.packagedir), Status(True, True))
+
+    def testDeletedButTrackedFile(self):
+        scm = Mercurial()
+        self.delete(self.packagedir)
+        self.assertEqual(scm.get_status_from_sandbox(self.packagedir), Status(False, True))
+
+    def testOneScan(self):
+        scm = Mercurial()
+        scm.memo = Memo()
+        self.modify(self.packagedir)
+        self.assertEqual(scm.is_dirty_sandbox(self.packagedir), True)
+        self.assertEqual(scm.is_unclean_sandbox(self.packagedir), True)
+        self.assertEqual(scm.memo.stats['get_status_from_sandbox'], (1, 1))
+
+
 class CommitSandboxTests(MercurialSetup):
 
     def testCommitCleanSandbox(self):
@@ -339,6 +367,69 @@ class CloneUrlTests(MercurialSetup):
         self.assertRaises(SystemExit, scm.clone_url, self.packagedir, 'testclone')
 
 
+class ShallowCloneUrlTests(MercurialSetup):
+
+    def testShallowCloneUrl(self):
+        scm = Mercurial(Process(quiet=True))
+        self.assertEqual(scm.shallow_clone_url(self.packagedir, 'testclone', ''), 0)
+        self.assertEqual(scm.get_branch_from_sandbox(join(self.tempdir, 'testclone')), 'default')
+
+    def testShallowCloneRevision(self):
+        scm = Mercurial(Process(quiet=True))
+        self.tag(self.packagedir, '2.6')
+        self.assertEqual(scm.shallow_clone_url(self.packagedir, 'testclone', '2.6'), 0)
+        rc, lines = Process(quiet=True).popen(
+            ['hg', 'log', '--template', '{rev}\n'], echo=False, cwd=join(self.tempdir, 'testclone'))
+        self.assertEqual(len(lines), 9)
+
+    def testCreateTag(self):
+        scm = Mercurial(Process(quiet=True))
+        scm.shallow_clone_url(self.packagedir, 'testclone', '')
+        clonedir = join(self.tempdir, 'testclone')
+        self.assertEqual(scm.tag_exists(clonedir, '2.6'), False)
+        self.assertEqual(scm.create_tag(clonedir, '2.6', 'testpackage', '2.6', True), 0)
+        self.assertEqual(scm.tag_exists(clonedir, '2.6'), True)
+        self.assertEqual(Mercurial().tag_exists(self.packagedir, '2.6'), True)
+
+    def testTagOnOtherHead(self):
+        scm = Mercurial(Process(quiet=True))
+        process = Process(quiet=True)
+        process.system(['hg', 'branch', '-q', '2.x'], cwd=self.packagedir)
+        process.system(['hg', 'commit', '-m', 'Open 2.x'], cwd=self.packagedir)
+        process.system(['hg', 'tag', '2.6'], cwd=self.packagedir)
+        process.system(['hg', 'update', '-q', 'default'], cwd=self.packagedir)
+        scm.shallow_clone_url(self.packagedir, 'testclone', 'default')
+        clonedir = join(self.tempdir, 'testclone')
+        self.assertEqual(Mercurial().tag_exists(clonedir, '2.6'), False)
+        self.assertEqual(scm.tag_exists(clonedir, '2.6'), True)
+        self.assertEqual(scm.tag_exists(clonedir, '2.7'), False)
+
+    def testTagOnOtherHeadCommands(self):
+        commands = []
+        def func(cmd):
+            commands.append(cmd)
+            if cmd[:2] == ['hg', 'identify']:
+                return 255, [], ["abort: unknown revision '2.6'!"]
+            return 0, []
+        scm = Mercurial(MockProcess(func=func))
+        scm.shallow_clone_url(self.packagedir, 'testclone', '')
+        self.assertEqual(scm.tag_exists('testclone', '2.6'), False)
+        self.assertEqual(commands[-1], ['hg', 'identify', '-r', '2.6', self.packagedir])
+
+    @quiet
+    def testTagOnOtherHeadBadServer(self):
+        scm = Mercurial(Process(quiet=True))
+        scm.shallow_clone_url(self.packagedir, 'testclone', '')
+        self.destroy()
+        self.assertRaises(SystemExit, scm.tag_exists, join(self.tempdir, 'testclone'), '2.6')
+
+    @quiet
+    def testBadServer(self):
+        scm = Mercurial(Process(quiet=True))
+        self.destroy()
+        self.assertRaises(SystemExit, scm.shallow_clone_url, self.packagedir, 'testclone', '')
+
+
 class BranchIdTests(MercurialSetup):
 
     def testMakeBranchId(self):
@@ -425,6 +516,16 @@ class TagExistsTests(MercurialSetup):
         self.tag(self.packagedir, '2.6')
         self.assertRaises(SystemExit, scm.check_tag_exists, self.packagedir, '2.6')
 
+    def testTagIsNotAPattern(self):
+        scm = Mercurial()
+        self.tag(self.packagedir, '2.6')
+        self.assertEqual(scm.tag_exists(self.packagedir, '2x6'), False)
+        self.assertEqual(scm.tag_exists(self.packagedir, '2'), False)
+
+    def testTip(self):
+        scm = Mercurial()
+        self.assertEqual(scm.tag_exists(self.packagedir, 'tip'), True)
+
 
 class CreateTagTests(MercurialSetup):
 
@@ -473,6 +574,33 @@ class CreateTagTests(MercurialSetup):
         self.assertRaises(SystemExit, scm.create_tag, self.packagedir, '2.6', 'testpackage', '2.6', False)
 
 
+class PushSandboxTests(MercurialSetup):
+
+    def testPushCommitAndTag(self):
+        scm = Mercurial(Process(quiet=True))
+        self.clone()
+        self.modify(self.clonedir)
+        scm.commit_sandbox(self.clonedir, 'testpackage', '2.6', False)
+        scm.create_tag(self.clonedir, '2.6', 'testpackage', '2.6', False)
+        self.assertEqual(scm.push_sandbox(self.clonedir, '2.6'), 0)
+        self.assertEqual(Mercurial().tag_exists(self.packagedir, '2.6'), True)
+        self.update(self.packagedir)
+        self.verify(self.packagedir)
+
+    def testPushNothing(self):
+        scm = Mercurial(Process(quiet=True))
+        self.clone()
+        self.assertEqual(scm.push_sandbox(self.clonedir), 0)
+
+    @quiet
+    def testBadPush(self):
+        scm = Mercurial(Process(quiet=True))
+        self.clone()
+        scm.create_tag(self.clonedir, '2.6', 'testpackage', '2.6', False)
+        self.destroy()
+        self.assertRaises(SystemExit, scm.push_sandbox, self.clonedir, '2.6')
+
+
 class GetVersionTests(unittest.TestCase):
 
     def testGetVersion(self):
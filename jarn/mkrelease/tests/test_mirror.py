@@ -0,0 +1,179 @@
+import unittest
+import os
+
+from os.path import join, isdir, isfile
+
+from jarn.mkrelease.mirror import Mirrors
+from jarn.mkrelease.mirror import Lock
+from jarn.mkrelease.scm import Git, Mercurial
+from jarn.mkrelease.process import Process
+
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import GitSetup
+from jarn.mkrelease.testing import MercurialSetup
+from jarn.mkrelease.testing import MockProcess
+from jarn.mkrelease.testing import quiet
+
+
+class LockTests(JailSetup):
+
+    def testExclusive(self):
+        first = Lock(join(self.tempdir, 'lock'))
+        second = Lock(join(self.tempdir, 'lock'))
+        self.assertEqual(first.acquire(), True)
+        self.assertEqual(second.acquire(blocking=False), False)
+        first.release()
+        self.assertEqual(second.acquire(blocking=False), True)
+        second.release()
+
+    def testShared(self):
+        first = Lock(join(self.tempdir, 'lock'))
+        second = Lock(join(self.tempdir, 'lock'))
+        third = Lock(join(self.tempdir, 'lock'))
+        self.assertEqual(first.acquire(exclusive=False), True)
+        self.assertEqual(second.acquire(exclusive=False, blocking=False), True)
+        self.assertEqual(third.acquire(blocking=False), False)
+        first.release()
+        second.release()
+
+    def testMissingDir(self):
+        lock = Lock(join(self.tempdir, 'foo', 'lock'))
+        self.assertRaises(IOError, lock.acquire)
+
+    def testIsCurrent(self):
+        lock = Lock(join(self.tempdir, 'lock'))
+        lock.acquire()
+        self.assertEqual(lock.is_current(), True)
+        os.remove(lock.filename)
+        self.assertEqual(lock.is_current(), False)
+        lock.release()
+
+
+class MirrorsTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.mirrordir = join(self.tempdir, 'mirrors')
+        os.mkdir(self.mirrordir)
+
+    def testMirrorDir(self):
+        mirrors = Mirrors(self.mirrordir)
+        self.assertEqual(mirrors.get_mirror_dir('file:///foo/../bar'),
+                         mirrors.get_mirror_dir('file:///bar'))
+        self.assertNotEqual(mirrors.get_mirror_dir('file:///foo'),
+                            mirrors.get_mirror_dir('file:///bar'))
+
+    def testUnsupported(self):
+        commands = []
+        def func(cmd):
+            commands.append(cmd)
+            return 0, []
+        scm = Git(MockProcess(func=func))
+        scm.name = 'svn'
+        mirrors = Mirrors(self.mirrordir)
+        mirrors.clone_url(scm, 'file:///foo', 'build')
+        self.assertEqual(commands, [['git', 'clone', 'file:///foo', 'build']])
+        self.assertEqual(os.listdir(self.mirrordir), [])
+
+    def testEvict(self):
+        mirrors = Mirrors(self.mirrordir, 2)
+        for name in ('a', 'b', 'c'):
+            lock = mirrors.use(join(self.mirrordir, name))
+            lock.release()
+            os.utime(lock.filename, (ord(name), ord(name)))
+        mirrors.evict()
+        self.assertEqual(sorted(os.listdir(self.mirrordir)), ['b', 'c'])
+
+    def testEvictSkipsMirrorsInUse(self):
+        mirrors = Mirrors(self.mirrordir, 0)
+        lock = mirrors.use(join(self.mirrordir, 'a'))
+        mirrors.use(join(self.mirrordir, 'b')).release()
+        mirrors.evict()
+        self.assertEqual(os.listdir(self.mirrordir), ['a'])
+        lock.release()
+        mirrors.evict()
+        self.assertEqual(os.listdir(self.mirrordir), [])
+
+
+class GitMirrorTests(GitSetup):
+
+    def setUp(self):
+        GitSetup.setUp(self)
+        self.url = 'file://' + self.packagedir
+        self.mirrors = Mirrors(join(self.tempdir, 'mirrors'))
+
+    def tearDown(self):
+        self.mirrors.close()
+        GitSetup.tearDown(self)
+
+    def testCloneUrl(self):
+        scm = Git(Process(quiet=True))
+        self.assertEqual(self.mirrors.clone_url(scm, self.url, 'build'), 0)
+        mirror = join(self.mirrors.get_mirror_dir(self.url), 'repo')
+        self.assertEqual(isfile(join(mirror, 'HEAD')), True)
+        self.assertEqual(isfile(join('build', '.git', 'objects', 'info', 'alternates')), True)
+        self.assertEqual(scm.get_url_from_sandbox(join(self.tempdir, 'build')), self.url)
+
+    def testUpdateMirror(self):
+        scm = Git(Process(quiet=True))
+        self.mirrors.clone_url(scm, self.url, 'build')
+        self.tag(self.packagedir, '2.6')
+        self.mirrors.clone_url(scm, self.url, 'build2')
+        mirror = join(self.mirrors.get_mirror_dir(self.url), 'repo')
+        self.assertEqual(Git().tag_exists(mirror, '2.6'), True)
+        self.assertEqual(Git().tag_exists(join(self.tempdir, 'build2'), '2.6'), True)
+
+    def testCreateTag(self):
+        scm = Git(Process(quiet=True))
+        self.mirrors.clone_url(scm, self.url, 'build')
+        builddir = join(self.tempdir, 'build')
+        scm.switch_branch(builddir, 'master')
+        self.assertEqual(scm.create_tag(builddir, '2.6', 'testpackage', '2.6', True), 0)
+        self.assertEqual(Git().tag_exists(self.packagedir, '2.6'), True)
+
+    @quiet
+    def testBadServer(self):
+        scm = Git(Process(quiet=True))
+        self.destroy()
+        self.assertRaises(SystemExit, self.mirrors.clone_url, scm, self.url, 'build')
+        mirrordir = self.mirrors.get_mirror_dir(self.url)
+        self.assertEqual(isdir(join(mirrordir, 'repo')), False)
+
+
+class MercurialMirrorTests(MercurialSetup):
+
+    def setUp(self):
+        MercurialSetup.setUp(self)
+        self.url = 'file://' + self.packagedir
+        self.mirrors = Mirrors(join(self.tempdir, 'mirrors'))
+
+    def tearDown(self):
+        self.mirrors.close()
+        MercurialSetup.tearDown(self)
+
+    def testCloneUrl(self):
+        scm = Mercurial(Process(quiet=True))
+        self.assertEqual(self.mirrors.clone_url(scm, self.url, 'build'), 0)
+        mirror = join(self.mirrors.get_mirror_dir(self.url), 'repo')
+        self.assertEqual(isdir(join(mirror, '.hg')), True)
+        self.assertEqual(scm.get_url_from_sandbox(join(self.tempdir, 'build')), self.url)
+
+    def testUpdateMirror(self):
+        scm = Mercurial(Process(quiet=True))
+        self.mirrors.clone_url(scm, self.url, 'build')
+        self.tag(self.packagedir, '2.6')
+        self.mirrors.clone_url(scm, self.url, 'build2')
+        self.assertEqual(Mercurial().tag_exists(join(self.tempdir, 'build2'), '2.6'), True)
+
+    def testCreateTag(self):
+        scm = Mercurial(Process(quiet=True))
+        self.mirrors.clone_url(scm, self.url, 'build')
+        builddir = join(self.tempdir, 'build')
+        self.assertEqual(scm.create_tag(builddir, '2.6', 'testpackage', '2.6', True), 0)
+        self.assertEqual(Mercurial().tag_exists(self.packagedir, '2.6'), True)
+        mirror = join(self.mirrors.get_mirror_dir(self.url), 'repo')
+        self.assertEqual(Mercurial().tag_exists(mirror, '2.6'), False)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
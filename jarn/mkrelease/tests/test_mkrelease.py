@@ -1,8 +1,16 @@
 # THIS SHOULD BE DOCTESTS
 import unittest
+import os
+
+from os.path import join
 
 from jarn.mkrelease.mkrelease import main
+from jarn.mkrelease.mkrelease import ReleaseMaker
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.ledger import Ledger
 from jarn.mkrelease.testing import SubversionSetup
+from jarn.mkrelease.testing import GitSetup
+from jarn.mkrelease.testing import quiet
 
 
 class Tests(SubversionSetup):
@@ -15,6 +23,112 @@ class Tests(SubversionSetup):
         pass
 
 
+class GitReleaseTests(GitSetup):
+    # Release from a clone of packagedir; packagedir is the remote
+
+    def setUp(self):
+        GitSetup.setUp(self)
+        try:
+            self.clone()
+            # The server is parked; release from a branch we can push
+            Process(quiet=True).system(['git', 'checkout', '-q', 'master'], cwd=self.clonedir)
+            self.config = join(self.tempdir, 'mkrelease.cfg')
+            self.mkfile(self.config)
+            self.saved = os.environ.get('XDG_CACHE_HOME')
+            os.environ['XDG_CACHE_HOME'] = join(self.tempdir, 'cache')
+        except:
+            self.cleanUp()
+            raise
+
+    def tearDown(self):
+        if self.saved is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.saved
+        GitSetup.tearDown(self)
+
+    @quiet
+    def release(self, *args):
+        rm = ReleaseMaker(['-c', self.config, '-S', '-q'] + list(args) + [self.clonedir])
+        rm.get_options()
+        # Recent setuptools no longer know the Subversion-only flag
+        rm.infoflags = [x for x in rm.infoflags if x != '--no-svn-revision']
+        rm.get_package()
+        rm.make_release()
+        return rm
+
+    def git(self, dir, *args):
+        rc, lines = Process(quiet=True).popen(['git'] + list(args), echo=False, cwd=dir)
+        return lines
+
+    def subject(self, dir):
+        return self.git(dir, 'log', '-1', '--format=%s', 'master')[0]
+
+    def has_tag(self, dir):
+        return self.git(dir, 'tag', '-l', '2.6') == ['2.6']
+
+    def testCommit(self):
+        self.modify(self.clonedir)
+        rm = self.release('-T')
+        self.assertEqual(rm.committed, True)
+        self.assertEqual(self.subject(self.clonedir), 'Prepare testpackage 2.6.')
+        self.assertEqual(self.has_tag(self.clonedir), False)
+        self.assertNotEqual(self.subject(self.packagedir), 'Prepare testpackage 2.6.')
+
+    def testTag(self):
+        rm = self.release('-C')
+        self.assertEqual(rm.committed, False)
+        self.assertEqual(self.has_tag(self.clonedir), True)
+        self.assertEqual(self.has_tag(self.packagedir), False)
+
+    def testCommitAndTag(self):
+        self.modify(self.clonedir)
+        self.release()
+        self.assertEqual(self.subject(self.clonedir), 'Prepare testpackage 2.6.')
+        self.assertEqual(self.has_tag(self.clonedir), True)
+        self.assertEqual(self.git(self.clonedir, 'rev-parse', 'master'),
+                         self.git(self.clonedir, 'rev-parse', '2.6^{commit}'))
+        self.assertNotEqual(self.subject(self.packagedir), 'Prepare testpackage 2.6.')
+        self.assertEqual(self.has_tag(self.packagedir), False)
+
+    def testCommitAndTagWithPush(self):
+        self.modify(self.clonedir)
+        Process.ledger = Ledger()
+        try:
+            self.release('-p')
+            pushes = [x for x in Process.ledger.entries if x.cmd[:2] == ['git', 'push']]
+        finally:
+            Process.ledger = None
+        self.assertEqual(len(pushes), 1)
+        self.assertEqual(self.subject(self.packagedir), 'Prepare testpackage 2.6.')
+        self.assertEqual(self.has_tag(self.packagedir), True)
+
+    def testCommitWithPush(self):
+        self.modify(self.clonedir)
+        self.release('-T', '-p')
+        self.assertEqual(self.subject(self.packagedir), 'Prepare testpackage 2.6.')
+        self.assertEqual(self.has_tag(self.clonedir), False)
+        self.assertEqual(self.has_tag(self.packagedir), False)
+
+    def testTagWithPush(self):
+        before = self.subject(self.packagedir)
+        self.release('-C', '-p')
+        self.assertEqual(self.subject(self.packagedir), before)
+        self.assertEqual(self.has_tag(self.packagedir), True)
+
+    def testTagDirtySandbox(self):
+        self.modify(self.clonedir)
+        self.assertRaises(SystemExit, self.release, '-C', '-p')
+        self.assertEqual(self.has_tag(self.clonedir), False)
+        self.assertEqual(self.has_tag(self.packagedir), False)
+
+    def testNothingToPush(self):
+        before = self.subject(self.packagedir)
+        rm = self.release('-T', '-p')
+        self.assertEqual(rm.committed, False)
+        self.assertEqual(self.subject(self.packagedir), before)
+        self.assertEqual(self.has_tag(self.packagedir), False)
+
+
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
-
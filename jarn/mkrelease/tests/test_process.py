@@ -1,7 +1,29 @@
 import unittest
 import os
+import sys
+import time
+import threading
+import StringIO
 
 from jarn.mkrelease.process import Process
+from jarn.mkrelease.process import AsyncProcess
+from jarn.mkrelease.tee import Stream
+from jarn.mkrelease.tee import Capture
+from jarn.mkrelease.tee import On
+from jarn.mkrelease.tee import Off
+from jarn.mkrelease.tee import StartsWith
+from jarn.mkrelease.tee import Equals
+from jarn.mkrelease.tee import EndsWith
+from jarn.mkrelease.tee import NotEmpty
+from jarn.mkrelease.tee import Before
+from jarn.mkrelease.tee import NotAfter
+from jarn.mkrelease.tee import After
+from jarn.mkrelease.tee import NotBefore
+from jarn.mkrelease.tee import Not
+from jarn.mkrelease.tee import And
+from jarn.mkrelease.tee import Or
+from jarn.mkrelease.tee import Tap
+from jarn.mkrelease.tee import compile_filter
 
 from jarn.mkrelease.testing import JailSetup
 from jarn.mkrelease.testing import quiet
@@ -49,6 +71,326 @@ class PopenTests(unittest.TestCase):
         self.assertEqual(rc, 127)
         self.assertEqual(lines, [])
 
+    def test_argv(self):
+        process = Process(quiet=True)
+        rc, lines = process.popen(['echo', '$HOME', '"Hello world"'])
+        self.assertEqual(rc, 0)
+        self.assertEqual(lines, ['$HOME "Hello world"'])
+
+    def test_argv_env(self):
+        env = os.environ.copy()
+        env['HELLO'] = 'Hello world'
+        process = Process(quiet=True, env=env)
+        rc, lines = process.popen(['sh', '-c', 'echo ${HELLO}'])
+        self.assertEqual(rc, 0)
+        self.assertEqual(lines, ['Hello world'])
+
+    @quiet
+    def test_argv_bad_cmd(self):
+        process = Process()
+        rc, lines = process.popen(['$', 'Hello world'])
+        self.assertEqual(rc, 127)
+        self.assertEqual(lines, [])
+
+
+class CwdTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        os.mkdir('foo')
+        self.foo = os.path.join(self.tempdir, 'foo')
+
+    def test_popen(self):
+        process = Process(quiet=True)
+        rc, lines = process.popen(['pwd'], cwd=self.foo)
+        self.assertEqual(lines, [self.foo])
+        self.assertEqual(os.getcwd(), self.tempdir)
+
+    def test_relative(self):
+        process = Process(quiet=True)
+        self.assertEqual(process.pipe(['pwd'], cwd='foo'), self.foo)
+
+    def test_system(self):
+        process = Process(quiet=True)
+        rc = process.system('pwd > output', cwd=self.foo)
+        self.assertEqual(rc, 0)
+        self.assertEqual(os.path.isfile(os.path.join(self.foo, 'output')), True)
+
+    def test_query(self):
+        process = Process(quiet=True)
+        rc, line = process.query(['pwd'], StartsWith('/'), cwd=self.foo)
+        self.assertEqual(line, self.foo)
+
+    def test_async(self):
+        process = AsyncProcess(quiet=True)
+        job = process.pipe(['pwd'], cwd=self.foo)
+        self.assertEqual(job.wait(), self.foo)
+
+    def test_bad_cwd(self):
+        process = Process(quiet=True)
+        self.assertRaises(OSError, process.popen, ['pwd'], cwd='bar')
+        self.assertRaises(OSError, process.system, ['pwd'], cwd='bar')
+
+    def test_threads(self):
+        process = Process(quiet=True)
+        dirs = []
+        for i in range(10):
+            dir = os.path.join(self.tempdir, 'dir%d' % i)
+            os.mkdir(dir)
+            dirs.append(dir)
+        results = {}
+        def run(dir):
+            results[dir] = [process.pipe(['pwd'], cwd=dir) for i in range(5)]
+        threads = [threading.Thread(target=run, args=(dir,)) for dir in dirs]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for dir in dirs:
+            self.assertEqual(results[dir], [dir] * 5)
+
+
+class TeeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = sys.stdout, sys.stderr
+        sys.stdout = StringIO.StringIO()
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.saved
+
+    def test_stdout_and_stderr(self):
+        process = Process()
+        rc, lines = process.popen('echo "Hello world"; echo "Hello stderr" >&2')
+        self.assertEqual(rc, 0)
+        self.assertEqual(lines, ['Hello world'])
+        self.assertEqual(sys.stdout.getvalue(), 'Hello world\n')
+        self.assertEqual(sys.stderr.getvalue(), 'Hello stderr\n')
+
+    def test_partial_line(self):
+        process = Process()
+        rc, lines = process.popen('printf "Hello\nworld"')
+        self.assertEqual(rc, 0)
+        self.assertEqual(lines, ['Hello', 'world'])
+        self.assertEqual(sys.stdout.getvalue(), 'Hello\nworld')
+
+    def test_large_output(self):
+        # Both pipes are drained concurrently; a child filling its
+        # stderr pipe must not block while we read stdout.
+        process = Process()
+        script = ('import sys\n'
+                  'for i in range(20000):\n'
+                  '    sys.stderr.write("err %d\\n" % i)\n'
+                  '    sys.stdout.write("out %d\\n" % i)\n')
+        rc, lines = process.popen('"%s" -c \'%s\'' % (sys.executable, script),
+                                  echo=False, echo2=False)
+        self.assertEqual(rc, 0)
+        self.assertEqual(len(lines), 20000)
+        self.assertEqual(lines[-1], 'out 19999')
+
+    def test_filter(self):
+        process = Process()
+        rc, lines = process.popen('echo "foo"; echo "bar"; echo "baz"',
+                                  echo=StartsWith('ba'))
+        self.assertEqual(rc, 0)
+        self.assertEqual(lines, ['foo', 'bar', 'baz'])
+        self.assertEqual(sys.stdout.getvalue(), 'bar\nbaz\n')
+
+    def test_no_threads(self):
+        counts = []
+
+        def filter(line):
+            counts.append(threading.active_count())
+            return False
+
+        before = threading.active_count()
+        process = Process()
+        rc, lines = process.popen('echo "Hello world"', echo=filter, echo2=filter)
+        self.assertEqual(rc, 0)
+        self.assertEqual(counts, [before])
+
+    def test_exit_code(self):
+        process = Process()
+        for i in range(20):
+            rc, lines = process.popen('echo "Hello world"; exit 3')
+            self.assertEqual(rc, 3)
+
+
+class StreamTests(unittest.TestCase):
+
+    def test_chunks(self):
+        file = StringIO.StringIO()
+        lines = []
+        stream = Stream(None, On(), file, lines)
+        stream.feed('foo\nba')
+        stream.feed('r')
+        stream.feed('\nbaz  \r\n\n')
+        stream.feed('qux')
+        stream.close()
+        self.assertEqual(lines, ['foo', 'bar', 'baz', '', 'qux'])
+        self.assertEqual(file.getvalue(), 'foo\nbar\nbaz  \r\n\nqux')
+        self.assertEqual(stream.nbytes, 19)
+
+    def test_filter(self):
+        file = StringIO.StringIO()
+        lines = []
+        stream = Stream(None, StartsWith('ba'), file, lines)
+        stream.feed('foo\nbar  \nba')
+        stream.feed('z\n')
+        stream.close()
+        self.assertEqual(lines, ['foo', 'bar', 'baz'])
+        self.assertEqual(file.getvalue(), 'bar  \nbaz\n')
+
+    def test_filter_sees_every_line_once(self):
+        seen = []
+
+        def filter(line):
+            seen.append(line)
+            return False
+
+        stream = Stream(None, filter, StringIO.StringIO())
+        for char in 'foo\nbar\n\nbaz':
+            stream.feed(char)
+        stream.close()
+        self.assertEqual(seen, ['foo', 'bar', '', 'baz'])
+
+    def test_off(self):
+        file = StringIO.StringIO()
+        capture = Capture(StartsWith('b'))
+        stream = Stream(None, Off(), file, capture)
+        stream.feed('foo\nbar\nbaz\n')
+        stream.close()
+        self.assertEqual(file.getvalue(), '')
+        self.assertEqual(capture.values, ['bar', 'baz'])
+        self.assertEqual(list(capture.tail), ['foo'])
+
+
+class CaptureTests(unittest.TestCase):
+
+    def test_capture(self):
+        process = Process(quiet=True)
+        capture = Capture(StartsWith('b'))
+        rc, lines = process.popen('echo "foo"; echo "bar"; echo "baz"', capture=capture)
+        self.assertEqual(rc, 0)
+        self.assertEqual(lines, ['bar', 'baz'])
+        self.assertEqual(capture.values, ['bar', 'baz'])
+        self.assertEqual(list(capture.tail), ['foo'])
+
+    def test_multiple_matchers(self):
+        process = Process(quiet=True)
+        capture = Capture(Equals('foo'), Equals('baz'))
+        rc, lines = process.popen('echo "foo"; echo "bar"; echo "baz"', capture=capture)
+        self.assertEqual(lines, ['foo', 'baz'])
+        self.assertEqual(list(capture.tail), ['bar'])
+
+    def test_tail_is_bounded(self):
+        process = Process(quiet=True)
+        capture = Capture(Equals('5000'), maxlen=3)
+        rc, lines = process.popen(['seq', '1', '10000'], capture=capture)
+        self.assertEqual(rc, 0)
+        self.assertEqual(lines, ['5000'])
+        self.assertEqual(list(capture.tail), ['9998', '9999', '10000'])
+
+    def test_echo(self):
+        saved = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            process = Process()
+            capture = Capture(Equals('bar'))
+            rc, lines = process.popen('echo "foo"; echo "bar"', capture=capture)
+            self.assertEqual(sys.stdout.getvalue(), 'foo\nbar\n')
+        finally:
+            sys.stdout = saved
+        self.assertEqual(lines, ['bar'])
+
+
+class CompileFilterTests(unittest.TestCase):
+
+    lines = ['running sdist', 'running egg_info', 'writing foo', '',
+             'running check', 'adding foo.py', 'done', 'running upload']
+
+    def assertSame(self, make_filter):
+        filter = make_filter()
+        expected = [filter(x) for x in self.lines]
+        compiled = compile_filter(make_filter())
+        self.assertEqual([bool(compiled(x)) for x in self.lines],
+                         [bool(x) for x in expected])
+        return compiled
+
+    def test_stateless(self):
+        self.assertSame(lambda: NotEmpty())
+        self.assertSame(lambda: Equals('done', 'writing foo'))
+        self.assertSame(lambda: StartsWith('running', 'add'))
+        self.assertSame(lambda: EndsWith('.py'))
+        self.assertSame(lambda: Not(StartsWith('running')))
+
+    def test_regex(self):
+        compiled = self.assertSame(
+            lambda: Or(And(StartsWith('running'), Not(EndsWith('sdist'))), Equals('done')))
+        self.failUnless('(line) is not None' in compiled.source)
+
+    def test_regex_escapes_patterns(self):
+        compiled = compile_filter(Or(StartsWith('a.b'), EndsWith('(c')))
+        self.assertEqual(bool(compiled('axb')), False)
+        self.assertEqual(bool(compiled('a.b')), True)
+        self.assertEqual(bool(compiled('x(c')), True)
+
+    def test_stateful(self):
+        self.assertSame(lambda: Before('running check'))
+        self.assertSame(lambda: NotAfter('running check'))
+        self.assertSame(lambda: After('running check'))
+        self.assertSame(lambda: NotBefore('running check'))
+
+    def test_setuptools_filter(self):
+        self.assertSame(lambda: And(After('running sdist'), StartsWith('running')))
+        self.assertSame(lambda: Or(After('done'), Equals('')))
+
+    def test_short_circuit(self):
+        # After must only see lines passing StartsWith
+        self.assertSame(lambda: And(StartsWith('writing', 'adding'), After('writing foo')))
+        self.assertSame(lambda: Or(StartsWith('running'), NotAfter('adding foo.py')))
+
+    def test_own_state(self):
+        filter = After('done')
+        compiled = compile_filter(filter)
+        self.assertEqual(compiled('done'), False)
+        self.assertEqual(compiled('foo'), True)
+        self.assertEqual(filter.echo, False)
+
+    def test_initial_state(self):
+        filter = After('done')
+        filter('done')
+        compiled = compile_filter(filter)
+        self.assertEqual(compiled('foo'), True)
+
+    def test_shared_state(self):
+        filter = After('done')
+        tree = And(filter, filter)
+        self.failUnless(compile_filter(tree) is tree)
+
+    def test_unknown_callables(self):
+        seen = []
+        def filter(line):
+            seen.append(line)
+            return True
+        compiled = compile_filter(And(StartsWith('running'), filter))
+        self.assertEqual([compiled(x) for x in self.lines].count(True), 4)
+        self.assertEqual(len(seen), 4)
+
+    def test_unchanged(self):
+        for filter in (On(), Off(), len):
+            self.failUnless(compile_filter(filter) is filter)
+
+    def test_subclasses_are_not_compiled(self):
+        class Stop(StartsWith):
+            def __call__(self, line):
+                return False
+        filter = Stop('running')
+        self.failUnless(compile_filter(filter) is filter)
+        compiled = compile_filter(Or(Stop('running'), Equals('done')))
+        self.assertEqual([compiled(x) for x in self.lines].count(True), 1)
+
 
 class PipeTests(unittest.TestCase):
 
@@ -76,6 +418,71 @@ class PipeTests(unittest.TestCase):
         self.assertEqual(value, '')
 
 
+class TapTests(unittest.TestCase):
+
+    @quiet
+    def test_tap(self):
+        errors = []
+        process = Process()
+        rc, lines = process.popen('echo foo; echo bar >&2', echo2=Tap(Off(), errors))
+        self.assertEqual(lines, ['foo'])
+        self.assertEqual(errors, ['bar'])
+
+    def test_quiet(self):
+        errors = []
+        process = Process(quiet=True)
+        rc, lines = process.popen('echo foo; echo bar >&2', echo2=Tap(True, errors))
+        self.assertEqual(lines, ['foo'])
+        self.assertEqual(errors, ['bar'])
+
+
+class QueryTests(unittest.TestCase):
+
+    def test_match(self):
+        process = Process(quiet=True)
+        rc, line = process.query(['seq', '1', '10'], Equals('5'))
+        self.assertEqual(rc, 0)
+        self.assertEqual(line, '5')
+
+    def test_no_match(self):
+        process = Process(quiet=True)
+        rc, line = process.query(['seq', '1', '10'], Equals('11'))
+        self.assertEqual(rc, 0)
+        self.assertEqual(line, None)
+
+    def test_predicate(self):
+        process = Process(quiet=True)
+        rc, line = process.query(['seq', '1', '10'], lambda line: int(line) > 3)
+        self.assertEqual(line, '4')
+
+    def test_stops_early(self):
+        process = Process(quiet=True)
+        start = time.time()
+        rc, line = process.query(['sh', '-c', 'echo foo; sleep 10'], Equals('foo'))
+        self.failUnless(time.time() - start < 5)
+        self.assertEqual(rc, 0)
+        self.assertEqual(line, 'foo')
+
+    def test_large_output(self):
+        process = Process(quiet=True)
+        start = time.time()
+        rc, line = process.query(['seq', '1', '100000000'], Equals('10'))
+        self.failUnless(time.time() - start < 5)
+        self.assertEqual(line, '10')
+
+    def test_failure(self):
+        process = Process(quiet=True)
+        rc, line = process.query('echo "foo"; exit 3', Equals('bar'))
+        self.assertEqual(rc, 3)
+        self.assertEqual(line, None)
+
+    def test_bad_cmd(self):
+        process = Process(quiet=True)
+        rc, line = process.query(['$', 'foo'], Equals('foo'))
+        self.assertEqual(rc, 127)
+        self.assertEqual(line, None)
+
+
 class SystemTests(JailSetup):
 
     def test_simple(self):
@@ -102,6 +509,113 @@ class SystemTests(JailSetup):
         rc = process.system('$ "Hello world" 2> output')
         self.assertEqual(rc, 127)
 
+    def test_passthrough(self):
+        saved = sys.stdout
+        sys.stdout = open('output', 'w+')
+        try:
+            process = Process()
+            process.spawn = None # Must not be used
+            rc = process.system(['echo', 'Hello world'])
+            sys.stdout.seek(0)
+            output = sys.stdout.read()
+        finally:
+            sys.stdout.close()
+            sys.stdout = saved
+        self.assertEqual(rc, 0)
+        self.assertEqual(output, 'Hello world\n')
+
+    def test_passthrough_flushes(self):
+        saved = sys.stdout
+        sys.stdout = open('output', 'w+')
+        try:
+            process = Process()
+            print 'Before',
+            process.system(['echo', 'Hello world'])
+            sys.stdout.seek(0)
+            output = sys.stdout.read()
+        finally:
+            sys.stdout.close()
+            sys.stdout = saved
+        self.assertEqual(output, 'BeforeHello world\n')
+
+    def test_passthrough_quiet(self):
+        process = Process(quiet=True)
+        process.spawn = None # Must not be used
+        rc = process.system(['echo', 'Hello world'])
+        self.assertEqual(rc, 0)
+
+    @quiet
+    def test_no_passthrough(self):
+        # StringIO has no file descriptor
+        process = Process()
+        rc = process.system(['echo', 'Hello world'])
+        self.assertEqual(rc, 0)
+        self.assertEqual(sys.stdout.getvalue(), 'Hello world\n')
+
+    def test_passthrough_bad_cmd(self):
+        process = Process(quiet=True)
+        rc = process.system(['$', 'Hello world'])
+        self.assertEqual(rc, 127)
+
+
+class AsyncProcessTests(JailSetup):
+
+    def test_popen(self):
+        process = AsyncProcess(quiet=True)
+        job = process.popen('echo "Hello world"')
+        self.assertEqual(job.wait(), (0, ['Hello world']))
+        self.assertEqual(job.done(), True)
+
+    def test_pipe(self):
+        process = AsyncProcess(quiet=True)
+        job = process.pipe('echo "Hello world"')
+        self.assertEqual(job.wait(), 'Hello world')
+
+    def test_system(self):
+        process = AsyncProcess(quiet=True)
+        job = process.system('echo "Hello world" > output; exit 2')
+        self.assertEqual(job.wait(), 2)
+        self.assertEqual(process.pipe('cat output').wait(), 'Hello world')
+
+    def test_gather(self):
+        process = AsyncProcess(quiet=True)
+        jobs = [process.pipe('echo %d' % i) for i in range(10)]
+        self.assertEqual(process.gather(*jobs), [str(i) for i in range(10)])
+
+    def test_overlap(self):
+        process = AsyncProcess(quiet=True)
+        start = time.time()
+        jobs = [process.system('sleep 0.5') for i in range(4)]
+        self.assertEqual(process.gather(*jobs), [0, 0, 0, 0])
+        self.failUnless(time.time() - start < 1.5)
+
+    def test_wait_drives_other_jobs(self):
+        process = AsyncProcess(quiet=True)
+        job1 = process.pipe('sleep 0.2; echo one')
+        job2 = process.pipe('sleep 0.5; echo two')
+        self.assertEqual(job2.wait(), 'two')
+        self.assertEqual(job1.done(), True)
+        self.assertEqual(job1.wait(), 'one')
+
+    def test_bad_cmd(self):
+        process = AsyncProcess(quiet=True)
+        job = process.popen('$ "Hello world"')
+        self.assertEqual(job.wait(), (127, []))
+
+    def test_not_a_process(self):
+        self.assertEqual(isinstance(AsyncProcess(), Process), False)
+
+    def test_wrapped_process(self):
+        spawned = []
+        class SpawnProcess(Process):
+            def spawn(self, cmd, echo, echo2, capture=None, cwd=None):
+                spawned.append(cmd)
+                return Process.spawn(self, cmd, echo, echo2, capture, cwd)
+        process = AsyncProcess(process=SpawnProcess(quiet=True))
+        self.assertEqual(process.quiet, True)
+        self.assertEqual(process.pipe('echo "Hello world"').wait(), 'Hello world')
+        self.assertEqual(spawned, ['echo "Hello world"'])
+
 
 class OsSystemTests(JailSetup):
 
@@ -1,14 +1,33 @@
 import unittest
+import os
+
+from os.path import join
 
 from jarn.mkrelease.process import Process
 from jarn.mkrelease.scm import SCMFactory
+from jarn.mkrelease.scm import Subversion, Mercurial, Git
 
 from jarn.mkrelease.testing import quiet
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import MockProcess
 from jarn.mkrelease.testing import SubversionSetup
 from jarn.mkrelease.testing import MercurialSetup
 from jarn.mkrelease.testing import GitSetup
 
 
+def without_process(klass):
+    # Fail if the SCM runs a command
+    class scm(klass):
+        def __init__(self):
+            klass.__init__(self, MockProcess(func=lambda cmd: None))
+    return scm
+
+
+class NoProcessFactory(SCMFactory):
+
+    scms = tuple([without_process(x) for x in (Subversion, Mercurial, Git)])
+
+
 class ScmFromUrlTests(unittest.TestCase):
 
     def testGetSvn(self):
@@ -95,6 +114,71 @@ class ScmFromTypeTests(unittest.TestCase):
         self.assertRaises(SystemExit, scms.get_scm_from_type, 'foo')
 
 
+class MarkerTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.scms = SCMFactory()
+
+    def testNoMarker(self):
+        self.assertEqual(self.scms._find_markers(self.tempdir), None)
+
+    def testGit(self):
+        os.mkdir('.git')
+        self.assertEqual(self.scms._find_markers(self.tempdir), ['git'])
+
+    def testGitFile(self):
+        self.mkfile('.git', 'gitdir: ../foo/.git/worktrees/bar\n')
+        self.assertEqual(self.scms._find_markers(self.tempdir), ['git'])
+
+    def testBadGitFile(self):
+        self.mkfile('.git', 'foo\n')
+        self.assertEqual(self.scms._find_markers(self.tempdir), None)
+
+    def testMercurial(self):
+        os.mkdir('.hg')
+        self.assertEqual(self.scms._find_markers(self.tempdir), ['hg'])
+
+    def testSubversion(self):
+        os.mkdir('.svn')
+        self.mkfile(join('.svn', 'wc.db'))
+        self.assertEqual(self.scms._find_markers(self.tempdir), ['svn'])
+
+    def testOldSubversion(self):
+        os.mkdir('.svn')
+        self.assertEqual(self.scms._find_markers(self.tempdir), None)
+
+    def testSubdirectory(self):
+        os.mkdir('.hg')
+        os.makedirs(join('foo', 'bar'))
+        self.assertEqual(self.scms._find_markers(join(self.tempdir, 'foo', 'bar')), ['hg'])
+
+    def testClosest(self):
+        os.mkdir('.hg')
+        os.makedirs(join('foo', '.git'))
+        os.mkdir(join('foo', 'bar'))
+        self.assertEqual(self.scms._find_markers(join(self.tempdir, 'foo', 'bar')), ['git'])
+
+    def testSameDirectory(self):
+        os.mkdir('.hg')
+        os.mkdir('.git')
+        self.assertEqual(self.scms._find_markers(self.tempdir), ['hg', 'git'])
+        self.assertEqual(self.scms._find_marked_scm(self.tempdir), None)
+
+    def testFile(self):
+        os.mkdir('.hg')
+        self.mkfile('foo')
+        self.assertEqual(self.scms._find_markers(join(self.tempdir, 'foo')), None)
+
+    def testGitEnviron(self):
+        os.mkdir('.git')
+        os.environ['GIT_DIR'] = join(self.tempdir, '.git')
+        try:
+            self.assertEqual(self.scms._find_markers(self.tempdir), None)
+        finally:
+            del os.environ['GIT_DIR']
+
+
 class SubversionFromSandboxTests(SubversionSetup):
 
     def testGetSubversion(self):
@@ -130,6 +214,19 @@ class MercurialFromSandboxTests(MercurialSetup):
         scms = SCMFactory()
         self.assertEqual(scms.get_scm_from_sandbox(self.packagedir).name, 'hg')
 
+    def testNoProcesses(self):
+        scms = NoProcessFactory()
+        self.assertEqual(scms.get_scm_from_sandbox(join(self.packagedir, 'testpackage')).name, 'hg')
+
+    def testNestedGit(self):
+        scms = NoProcessFactory()
+        process = Process(quiet=True)
+        self.dirstack.push(join(self.packagedir, 'testpackage'))
+        process.system('git init -q .')
+        self.dirstack.pop()
+        self.assertEqual(scms.get_scm_from_sandbox(join(self.packagedir, 'testpackage')).name, 'git')
+        self.assertEqual(scms.get_scm_from_sandbox(self.packagedir).name, 'hg')
+
     @quiet
     def testAmbiguousSandbox(self):
         scms = SCMFactory()
@@ -148,6 +245,10 @@ class GitFromSandboxTests(GitSetup):
         scms = SCMFactory()
         self.assertEqual(scms.get_scm_from_sandbox(self.packagedir).name, 'git')
 
+    def testNoProcesses(self):
+        scms = NoProcessFactory()
+        self.assertEqual(scms.get_scm_from_sandbox(join(self.packagedir, 'testpackage')).name, 'git')
+
     @quiet
     def testAmbiguousSandbox(self):
         scms = SCMFactory()
@@ -0,0 +1,82 @@
+import unittest
+import os
+import time
+
+from os.path import join, isfile
+
+from jarn.mkrelease.scp import SCP
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.ledger import Ledger
+
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import quiet
+
+
+class UploadSetup(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.distfile = join(self.tempdir, 'testpackage-2.6.tar.gz')
+        self.mkfile(self.distfile, 'dist\n')
+        for name in ('bin', 'dist1', 'dist2', 'dist3'):
+            os.mkdir(name)
+        self.path = os.environ['PATH']
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        JailSetup.tearDown(self)
+
+    def slow_scp(self, delay):
+        # A local scp taking 'delay' seconds
+        filename = join(self.tempdir, 'bin', 'scp')
+        self.mkfile(filename, '#!/bin/sh\nsleep %s\ncp "$1" "$2"\n' % delay)
+        os.chmod(filename, 0755)
+        os.environ['PATH'] = join(self.tempdir, 'bin') + os.pathsep + self.path
+
+
+class UploadTests(UploadSetup):
+
+    def testScp(self):
+        scp = SCP(Process(quiet=True))
+        self.assertEqual(scp.run_scp(self.distfile, join(self.tempdir, 'dist1')), 0)
+        self.assertEqual(isfile(join('dist1', 'testpackage-2.6.tar.gz')), True)
+
+    def testUploads(self):
+        scp = SCP(Process(quiet=True))
+        uploads = [('scp', join(self.tempdir, x)) for x in ('dist1', 'dist2', 'dist3')]
+        self.assertEqual(scp.run_uploads(self.distfile, uploads), 0)
+        for x in ('dist1', 'dist2', 'dist3'):
+            self.assertEqual(isfile(join(x, 'testpackage-2.6.tar.gz')), True)
+
+    def testConcurrent(self):
+        self.slow_scp(0.5)
+        scp = SCP(Process(quiet=True))
+        uploads = [('scp', join(self.tempdir, x)) for x in ('dist1', 'dist2', 'dist3')]
+        Process.ledger = Ledger()
+        try:
+            start = time.time()
+            scp.run_uploads(self.distfile, uploads)
+            elapsed = time.time() - start
+            self.assertEqual(len(Process.ledger), 3)
+        finally:
+            Process.ledger = None
+        self.failUnless(elapsed < 1.2)
+        for x in ('dist1', 'dist2', 'dist3'):
+            self.assertEqual(isfile(join(x, 'testpackage-2.6.tar.gz')), True)
+
+    @quiet
+    def testBadLocation(self):
+        scp = SCP(Process(quiet=True))
+        self.assertRaises(SystemExit, scp.run_scp, self.distfile, join(self.tempdir, 'peng', 'x'))
+
+    @quiet
+    def testOneBadLocation(self):
+        scp = SCP(Process(quiet=True))
+        uploads = [('scp', join(self.tempdir, 'dist1')), ('scp', join(self.tempdir, 'peng', 'x'))]
+        self.assertRaises(SystemExit, scp.run_uploads, self.distfile, uploads)
+        # The other upload completes
+        self.assertEqual(isfile(join('dist1', 'testpackage-2.6.tar.gz')), True)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -4,13 +4,23 @@ import os
 from os.path import join, isdir
 
 from jarn.mkrelease.scm import Subversion
+from jarn.mkrelease.scm import Status
+from jarn.mkrelease.memo import Memo
 
 from jarn.mkrelease.process import Process
 
 from jarn.mkrelease.testing import SubversionSetup
 from jarn.mkrelease.testing import MockProcess
+from jarn.mkrelease.testing import NullReader
 from jarn.mkrelease.testing import quiet
 
+INFO_XML = ['<?xml version="1.0" encoding="UTF-8"?>',
+            '<info>',
+            '<entry kind="dir" path="." revision="1">',
+            '<url>file://svn/testpackage</url>',
+            '</entry>',
+            '</info>']
+
 
 class ValidUrlTests(unittest.TestCase):
 
@@ -95,7 +105,7 @@ class RootFromSandboxTests(SubversionSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Subversion(MockProcess(rc=1))
+        scm = Subversion(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_root_from_sandbox, self.clonedir)
 
 
@@ -133,7 +143,7 @@ class BranchFromSandboxTests(SubversionSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Subversion(MockProcess(rc=1))
+        scm = Subversion(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_branch_from_sandbox, self.clonedir)
 
 
@@ -157,7 +167,7 @@ class UrlFromSandboxTests(SubversionSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Subversion(MockProcess(rc=1))
+        scm = Subversion(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.get_url_from_sandbox, self.clonedir)
 
 
@@ -179,7 +189,7 @@ class RemoteSandboxTests(SubversionSetup):
 
     @quiet
     def testBadProcess(self):
-        scm = Subversion(MockProcess(rc=1))
+        scm = Subversion(MockProcess(rc=1), reader=NullReader())
         self.assertRaises(SystemExit, scm.is_remote_sandbox, self.clonedir)
 
 
@@ -275,7 +285,7 @@ class UncleanSandboxTests(SubversionSetup):
     def testTreeConflict(self):
         # Requires Subversion >= 1.6
         def func(cmd):
-            if cmd == 'svn --version':
+            if cmd == ['svn', '--version']:
                 return 0, ['version 1.6.16']
             else:
                 return 0, ['      C foo.py']
@@ -284,6 +294,31 @@ class UncleanSandboxTests(SubversionSetup):
         self.assertEqual(scm.is_unclean_sandbox(self.clonedir), True)
 
 
+class StatusTests(SubversionSetup):
+
+    def testCleanSandbox(self):
+        scm = Subversion()
+        self.assertEqual(scm.get_status_from_sandbox(self.clonedir), Status(False, False))
+
+    def testModifiedFile(self):
+        scm = Subversion()
+        self.modify(self.clonedir)
+        self.assertEqual(scm.get_status_from_sandbox(self.clonedir), Status(True, True))
+
+    def testDeletedButTrackedFile(self):
+        scm = Subversion()
+        self.delete(self.clonedir)
+        self.assertEqual(scm.get_status_from_sandbox(self.clonedir), Status(False, True))
+
+    def testOneScan(self):
+        scm = Subversion()
+        scm.memo = Memo()
+        self.modify(self.clonedir)
+        self.assertEqual(scm.is_dirty_sandbox(self.clonedir), True)
+        self.assertEqual(scm.is_unclean_sandbox(self.clonedir), True)
+        self.assertEqual(scm.memo.stats['get_status_from_sandbox'], (1, 1))
+
+
 class CommitSandboxTests(SubversionSetup):
 
     def testCommitCleanSandbox(self):
@@ -343,6 +378,27 @@ class CloneUrlTests(SubversionSetup):
         self.assertRaises(SystemExit, scm.clone_url, 'file://'+self.packagedir, 'testclone2')
 
 
+class ShallowCloneUrlTests(SubversionSetup):
+
+    def testShallowCloneUrl(self):
+        scm = Subversion(Process(quiet=True))
+        self.assertEqual(scm.shallow_clone_url('file://'+self.packagedir+'/trunk', 'testclone2', ''), 0)
+        self.assertEqual(isdir('testclone2'), True)
+
+    def testShallowCloneBranch(self):
+        scm = Subversion(Process(quiet=True))
+        branchid = 'file://%s/branches/2.x' % self.packagedir
+        self.branch(self.clonedir, branchid)
+        self.assertEqual(scm.shallow_clone_url('file://'+self.packagedir+'/trunk', 'testclone2', branchid), 0)
+        self.assertEqual(scm.get_url_from_sandbox(join(self.tempdir, 'testclone2')), branchid)
+
+    @quiet
+    def testBadServer(self):
+        scm = Subversion(Process(quiet=True))
+        self.destroy(self.packagedir)
+        self.assertRaises(SystemExit, scm.shallow_clone_url, 'file://'+self.packagedir, 'testclone2', '')
+
+
 class BranchIdTests(SubversionSetup):
 
     def testMakeBranchId(self):
@@ -462,7 +518,7 @@ class TagIdTests(SubversionSetup):
 
     @quiet
     def testTagIdFromBadUrl(self):
-        scm = Subversion(MockProcess(rc=0, lines=['', 'URL: file://svn/testpackage']))
+        scm = Subversion(MockProcess(rc=0, lines=INFO_XML), reader=NullReader())
         self.assertRaises(SystemExit, scm.make_tagid, self.clonedir, '2.6')
 
 
@@ -500,7 +556,7 @@ class CodespeakTagIdTests(SubversionSetup):
 
     @quiet
     def testTagIdFromBadUrl(self):
-        scm = Subversion(MockProcess(rc=0, lines=['', 'URL: file://svn/testpackage']))
+        scm = Subversion(MockProcess(rc=0, lines=INFO_XML), reader=NullReader())
         self.assertRaises(SystemExit, scm.make_tagid, self.clonedir, '2.6')
 
 
@@ -552,6 +608,204 @@ class CreateTagTests(SubversionSetup):
         self.assertRaises(SystemExit, scm.create_tag, self.clonedir, tagid, 'testpackage', '2.6', False)
 
 
+class CommitAndTagTests(SubversionSetup):
+
+    def cat(self, url):
+        process = Process(quiet=True)
+        rc, lines = process.popen(['svn', 'cat', url], echo=False)
+        self.assertEqual(rc, 0)
+        return lines
+
+    def testCommitAndTag(self):
+        scm = Subversion(Process(quiet=True))
+        tagid = 'file://%s/tags/2.6' % self.packagedir
+        self.modify(self.clonedir)
+        self.assertEqual(scm.commit_and_tag_sandbox(self.clonedir, tagid, 'testpackage', '2.6'), True)
+        self.assertEqual(scm.tag_exists(self.clonedir, tagid), True)
+        self.assertEqual(scm.is_dirty_sandbox(self.clonedir), False)
+        self.assertEqual(self.cat(tagid + '/setup.py')[-1], '#foo')
+        self.assertEqual(self.cat('file://%s/trunk/setup.py' % self.packagedir)[-1], '#foo')
+
+    def testCleanSandbox(self):
+        scm = Subversion(Process(quiet=True))
+        tagid = 'file://%s/tags/2.6' % self.packagedir
+        self.assertEqual(scm.commit_and_tag_sandbox(self.clonedir, tagid, 'testpackage', '2.6'), True)
+        self.assertEqual(scm.tag_exists(self.clonedir, tagid), True)
+
+    def testPropertyChange(self):
+        scm = Subversion(Process(quiet=True))
+        tagid = 'file://%s/tags/2.6' % self.packagedir
+        self.modifyprop(self.clonedir)
+        self.assertEqual(scm.commit_and_tag_sandbox(self.clonedir, tagid, 'testpackage', '2.6'), False)
+        self.assertEqual(scm.tag_exists(self.clonedir, tagid), False)
+        self.assertEqual(scm.is_dirty_sandbox(self.clonedir), True)
+
+    def testKeywords(self):
+        # svnmucc would upload the expanded keyword; fall back
+        process = Process(quiet=True)
+        self.mkfile(join(self.clonedir, 'keywords.txt'), '$Id$\n')
+        process.system(['svn', 'add', '-q', 'keywords.txt'], cwd=self.clonedir)
+        process.system(['svn', 'propset', '-q', 'svn:keywords', 'Id', 'keywords.txt'], cwd=self.clonedir)
+        process.system(['svn', 'commit', '-q', '-m', 'Add keywords.txt'], cwd=self.clonedir)
+        process.system(['svn', 'update', '-q'], cwd=self.clonedir)
+        with open(join(self.clonedir, 'keywords.txt'), 'at') as file:
+            file.write('foo\n')
+        scm = Subversion(Process(quiet=True))
+        tagid = 'file://%s/tags/2.6' % self.packagedir
+        self.assertEqual(scm.commit_and_tag_sandbox(self.clonedir, tagid, 'testpackage', '2.6'), False)
+        self.assertEqual(scm.tag_exists(self.clonedir, tagid), False)
+        self.assertEqual(scm.is_dirty_sandbox(self.clonedir), True)
+        self.assertEqual(self.cat('file://%s/trunk/keywords.txt' % self.packagedir), ['$Id$'])
+
+    @quiet
+    def testExistingTag(self):
+        scm = Subversion(Process(quiet=True))
+        tagid = 'file://%s/tags/2.6' % self.packagedir
+        self.tag(self.clonedir, tagid)
+        self.modify(self.clonedir)
+        self.assertEqual(scm.commit_and_tag_sandbox(self.clonedir, tagid, 'testpackage', '2.6'), False)
+        self.assertEqual(scm.is_dirty_sandbox(self.clonedir), True)
+        self.assertNotEqual(self.cat('file://%s/trunk/setup.py' % self.packagedir)[-1], '#foo')
+
+
+class CommitAndTagCommandTests(unittest.TestCase):
+
+    url = 'svn://example.com/repo/testpackage/trunk'
+    tagid = 'svn://example.com/repo/testpackage/tags/2.6'
+
+    def setUp(self):
+        self.commands = []
+        self.status = ['M       /sandbox/setup.py']
+        self.svnmucc = 0
+        self.props = []
+
+    def func(self, cmd):
+        self.commands.append(cmd)
+        if cmd == ['svnmucc', '--version']:
+            return 0, ['svnmucc, version 1.14.2']
+        if cmd == ['svn', 'status', '-q', '/sandbox']:
+            return 0, self.status
+        if cmd == ['svn', 'info', '--xml', '/sandbox']:
+            return 0, ['<info><entry revision="5"><url>%s</url></entry></info>' % self.url]
+        if cmd == ['svn', 'info', '--xml', '/sandbox/setup.py']:
+            return 0, ['<info><entry revision="4"><url>%s/setup.py</url></entry></info>' % self.url]
+        if cmd == ['svn', 'proplist', '--xml', '/sandbox/setup.py']:
+            return 0, ['<properties><target path="/sandbox/setup.py">'] + \
+                      ['<property name="%s"/>' % x for x in self.props] + \
+                      ['</target></properties>']
+        if cmd[0] == 'svnmucc':
+            return self.svnmucc, []
+        if cmd[:2] == ['svn', 'update']:
+            return 0, []
+
+    def make_scm(self):
+        return Subversion(MockProcess(func=self.func), reader=NullReader())
+
+    def testCommand(self):
+        scm = self.make_scm()
+        self.assertEqual(scm.commit_and_tag_sandbox('/sandbox', self.tagid, 'testpackage', '2.6'), True)
+        self.assertEqual(self.commands[-2],
+            ['svnmucc', '-m', 'Prepare and tag testpackage 2.6.', '-r', '4',
+             'cp', 'HEAD', self.url, self.tagid,
+             'put', '/sandbox/setup.py', self.url + '/setup.py',
+             'put', '/sandbox/setup.py', self.tagid + '/setup.py'])
+        self.assertEqual(self.commands[-1], ['svn', 'update', '-q', '/sandbox'])
+
+    def testCleanSandbox(self):
+        self.status = []
+        scm = self.make_scm()
+        self.assertEqual(scm.commit_and_tag_sandbox('/sandbox', self.tagid, 'testpackage', '2.6'), True)
+        self.assertEqual(self.commands[-1],
+            ['svnmucc', '-m', 'Prepare and tag testpackage 2.6.',
+             'cp', 'HEAD', self.url, self.tagid])
+
+    def testAddedFile(self):
+        self.status.append('A       /sandbox/foo.py')
+        scm = self.make_scm()
+        self.assertEqual(scm.commit_and_tag_sandbox('/sandbox', self.tagid, 'testpackage', '2.6'), False)
+        self.assertEqual([x for x in self.commands if x[0] == 'svnmucc'], [['svnmucc', '--version']])
+
+    def testPropertyChange(self):
+        self.status = ['MM      /sandbox/setup.py']
+        scm = self.make_scm()
+        self.assertEqual(scm.commit_and_tag_sandbox('/sandbox', self.tagid, 'testpackage', '2.6'), False)
+
+    def testKeywords(self):
+        self.props = ['svn:keywords']
+        scm = self.make_scm()
+        self.assertEqual(scm.commit_and_tag_sandbox('/sandbox', self.tagid, 'testpackage', '2.6'), False)
+        self.assertEqual([x for x in self.commands if x[0] == 'svnmucc'], [['svnmucc', '--version']])
+
+    def testEolStyle(self):
+        self.props = ['svn:mime-type', 'svn:eol-style']
+        scm = self.make_scm()
+        self.assertEqual(scm.commit_and_tag_sandbox('/sandbox', self.tagid, 'testpackage', '2.6'), False)
+
+    def testOtherProperty(self):
+        self.props = ['svn:mime-type']
+        scm = self.make_scm()
+        self.assertEqual(scm.commit_and_tag_sandbox('/sandbox', self.tagid, 'testpackage', '2.6'), True)
+
+    def testFailure(self):
+        self.svnmucc = 1
+        scm = self.make_scm()
+        self.assertEqual(scm.commit_and_tag_sandbox('/sandbox', self.tagid, 'testpackage', '2.6'), False)
+        self.assertEqual(self.commands[-1][0], 'svnmucc')
+
+    def testNoSvnmucc(self):
+        def func(cmd):
+            if cmd == ['svnmucc', '--version']:
+                return 1, []
+        scm = Subversion(MockProcess(func=func), reader=NullReader())
+        self.assertEqual(scm.commit_and_tag_sandbox('/sandbox', self.tagid, 'testpackage', '2.6'), False)
+
+
+class TagExistsCommandTests(unittest.TestCase):
+
+    tagid = 'svn://example.com/repo/testpackage/tags/2.6'
+
+    def make_scm(self, urls, rc=0):
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<info>']
+        for url in urls:
+            lines += ['<entry kind="dir" path="%s" revision="5">' % url.split('/')[-1],
+                      '<url>%s</url>' % url,
+                      '</entry>']
+        lines += ['</info>']
+        def func(cmd):
+            self.commands.append(cmd)
+            return rc, lines
+        self.commands = []
+        return Subversion(MockProcess(func=func), reader=NullReader())
+
+    def testTagExists(self):
+        scm = self.make_scm(['svn://example.com/repo/testpackage/tags', self.tagid])
+        self.assertEqual(scm.tag_exists('/sandbox', self.tagid), True)
+        self.assertEqual(len(self.commands), 1)
+
+    def testTagDoesNotExist(self):
+        scm = self.make_scm(['svn://example.com/repo/testpackage/tags'], rc=1)
+        self.assertEqual(scm.tag_exists('/sandbox', self.tagid), False)
+        self.assertEqual(len(self.commands), 1)
+
+    def testQuotedUrl(self):
+        tagid = 'svn://example.com/repo/test package/tags/2.6'
+        scm = self.make_scm(['svn://example.com/repo/test%20package/tags',
+                             'svn://example.com/repo/test%20package/tags/2.6'])
+        self.assertEqual(scm.tag_exists('/sandbox', tagid), True)
+
+    @quiet
+    def testUnreachable(self):
+        scm = self.make_scm([], rc=1)
+        self.assertRaises(SystemExit, scm.check_tag_exists, '/sandbox', self.tagid)
+
+
+class PushSandboxTests(SubversionSetup):
+
+    def testPushSandbox(self):
+        scm = Subversion(MockProcess(rc=1))
+        self.assertEqual(scm.push_sandbox(self.clonedir, 'file://%s/tags/2.6' % self.packagedir), 0)
+
+
 class GetVersionTests(unittest.TestCase):
 
     def testGetVersion(self):
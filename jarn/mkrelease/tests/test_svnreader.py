@@ -0,0 +1,204 @@
+import unittest
+import os
+import sqlite3
+import zipfile
+
+from os.path import join, dirname
+
+from jarn.mkrelease.svnreader import SvnReader
+from jarn.mkrelease.svnreader import Info
+from jarn.mkrelease.svnreader import parse_info
+from jarn.mkrelease.svnreader import parse_infos
+from jarn.mkrelease.svnreader import parse_propnames
+from jarn.mkrelease.scm import Subversion
+
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import MockProcess
+
+REPOS = 'file:///Users/stefan/sandbox/jarn.mkrelease/jarn/mkrelease/tests/testrepo.svn17'
+UUID = '50221704-352c-4dd0-aa12-5dfe41ce1d12'
+
+
+class ReaderSetup(JailSetup):
+    # The readers do not need svn; use the working copy as is
+
+    source = 'testpackage.svn17.zip'
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        try:
+            package = join(dirname(__file__), self.source)
+            archive = zipfile.ZipFile(package, 'r')
+            archive.extractall()
+            os.rename(self.source[:-4], 'testclone')
+            self.clonedir = join(self.tempdir, 'testclone')
+            self.reader = SvnReader()
+        except:
+            self.cleanUp()
+            raise
+
+    def execute(self, sql, *args):
+        connection = sqlite3.connect(join(self.clonedir, '.svn', 'wc.db'))
+        try:
+            connection.execute(sql, args)
+            connection.commit()
+        finally:
+            connection.close()
+
+
+class ReaderTests(ReaderSetup):
+
+    def testSandbox(self):
+        self.assertEqual(self.reader.is_valid_sandbox(self.clonedir), True)
+        self.assertEqual(self.reader.get_info(self.clonedir),
+                         Info(REPOS + '/trunk', REPOS, UUID, self.clonedir, 1))
+        self.assertEqual(self.reader.get_root(self.clonedir), self.clonedir)
+
+    def testSubdirectory(self):
+        subdir = join(self.clonedir, 'testpackage')
+        self.assertEqual(self.reader.is_valid_sandbox(subdir), True)
+        self.assertEqual(self.reader.get_info(subdir),
+                         Info(REPOS + '/trunk/testpackage', REPOS, UUID, self.clonedir, 1))
+        self.assertEqual(self.reader.get_root(subdir), self.clonedir)
+
+    def testUnversionedDirectory(self):
+        os.mkdir(join(self.clonedir, 'foo'))
+        self.assertEqual(self.reader.is_valid_sandbox(join(self.clonedir, 'foo')), False)
+        self.assertEqual(self.reader.get_info(join(self.clonedir, 'foo')), None)
+        self.assertEqual(self.reader.get_root(join(self.clonedir, 'foo')), None)
+
+    def testNoSandbox(self):
+        self.assertEqual(self.reader.is_valid_sandbox(self.tempdir), False)
+        self.assertEqual(self.reader.get_info(self.tempdir), None)
+
+    def testSwitchedSubdirectory(self):
+        self.execute("UPDATE nodes SET repos_path = 'branches/foo' WHERE local_relpath = 'testpackage'")
+        subdir = join(self.clonedir, 'testpackage')
+        self.assertEqual(self.reader.get_info(subdir).url, REPOS + '/branches/foo')
+        self.assertEqual(self.reader.get_root(subdir), subdir)
+
+    def testQuotedUrl(self):
+        self.execute("UPDATE nodes SET repos_path = 'trunk/foo bar' WHERE local_relpath = 'testpackage'")
+        subdir = join(self.clonedir, 'testpackage')
+        self.assertEqual(self.reader.get_info(subdir).url, REPOS + '/trunk/foo%20bar')
+
+    def testLocalChanges(self):
+        self.execute("INSERT INTO nodes (wc_id, local_relpath, op_depth, parent_relpath, "
+                     "presence, kind) VALUES (1, 'testpackage', 1, '', 'base-deleted', 'dir')")
+        subdir = join(self.clonedir, 'testpackage')
+        self.assertEqual(self.reader.get_info(subdir), None)
+        self.assertEqual(self.reader.get_info(self.clonedir).url, REPOS + '/trunk')
+
+    def testUnknownFormat(self):
+        self.execute('PRAGMA user_version = 99')
+        self.assertEqual(self.reader.is_valid_sandbox(self.clonedir), None)
+        self.assertEqual(self.reader.get_info(self.clonedir), None)
+
+    def testBadDatabase(self):
+        self.mkfile(join(self.clonedir, '.svn', 'wc.db'), 'foo')
+        self.assertEqual(self.reader.get_info(self.clonedir), None)
+
+    def testNoCommands(self):
+        def func(cmd):
+            return None
+        scm = Subversion(MockProcess(func=func))
+        self.assertEqual(scm.is_valid_sandbox(self.clonedir), True)
+        self.assertEqual(scm.get_url_from_sandbox(self.clonedir), REPOS + '/trunk')
+        self.assertEqual(scm.get_root_from_sandbox(join(self.clonedir, 'testpackage')), self.clonedir)
+
+
+class OldReaderTests(ReaderSetup):
+
+    source = 'testpackage.svn16.zip'
+
+    def testUnsupported(self):
+        self.assertEqual(self.reader.is_valid_sandbox(self.clonedir), None)
+        self.assertEqual(self.reader.get_info(self.clonedir), None)
+        self.assertEqual(self.reader.get_root(self.clonedir), None)
+
+
+class ParseInfoTests(unittest.TestCase):
+
+    def testInfo(self):
+        text = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<info>\n'
+                '<entry kind="dir" path="." revision="5">\n'
+                '<url>file:///repo/trunk</url>\n'
+                '<relative-url>^/trunk</relative-url>\n'
+                '<repository>\n<root>file:///repo</root>\n<uuid>x</uuid>\n</repository>\n'
+                '<wc-info>\n<wcroot-abspath>/wc</wcroot-abspath>\n</wc-info>\n'
+                '</entry>\n'
+                '</info>\n')
+        self.assertEqual(parse_info(text), Info('file:///repo/trunk', 'file:///repo', 'x', '/wc', 5))
+
+    def testOldInfo(self):
+        text = ('<?xml version="1.0"?>\n'
+                '<info>\n'
+                '<entry kind="dir" path="." revision="5">\n'
+                '<url>file:///repo/trunk</url>\n'
+                '</entry>\n'
+                '</info>\n')
+        self.assertEqual(parse_info(text), Info('file:///repo/trunk', None, None, None, 5))
+
+    def testBadInfo(self):
+        self.assertEqual(parse_info('<info>'), None)
+        self.assertEqual(parse_info('<info></info>'), None)
+
+    def testTruncatedInfo(self):
+        text = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<info>\n'
+                '<entry kind="dir" path="." revision="5">\n'
+                '<url>file:///repo/tr')
+        self.assertEqual(parse_info(text), None)
+        self.assertEqual(parse_info(''), None)
+
+    def testInfos(self):
+        text = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<info>\n'
+                '<entry kind="dir" path="tags" revision="5">\n'
+                '<url>file:///repo/tags</url>\n'
+                '</entry>\n'
+                '<entry kind="dir" path="2.6" revision="4">\n'
+                '<url>file:///repo/tags/2.6</url>\n'
+                '</entry>\n'
+                '</info>\n')
+        self.assertEqual(parse_infos(text), [Info('file:///repo/tags', None, None, None, 5),
+                                             Info('file:///repo/tags/2.6', None, None, None, 4)])
+
+    def testTruncatedInfos(self):
+        text = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<info>\n'
+                '<entry kind="dir" path="tags" revision="5">\n'
+                '<url>file:///repo/tags</url>\n'
+                '</entry>\n'
+                '<entry kind="dir" path="2.6" revision="4">\n')
+        self.assertEqual(parse_infos(text), [Info('file:///repo/tags', None, None, None, 5)])
+        self.assertEqual(parse_infos(''), [])
+
+    def testBadEntryInInfos(self):
+        text = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<info>\n'
+                '<entry kind="dir" path="tags" revision="5">\n'
+                '<url>file:///repo/tags</url>\n'
+                '</entry>\n'
+                '<entry kind="dir" path="2.6" revision="4">\n'
+                '<url>file:///repo/tags/2.6</ur>\n'
+                '</entry>\n'
+                '</info>\n')
+        self.assertEqual(parse_infos(text), [Info('file:///repo/tags', None, None, None, 5)])
+
+    def testPropnames(self):
+        text = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<properties>\n'
+                '<target path="a.py">\n<property name="svn:keywords"/>\n</target>\n'
+                '<target path="b.py">\n<property name="svn:eol-style"/>\n</target>\n'
+                '</properties>\n')
+        self.assertEqual(parse_propnames(text), set(['svn:keywords', 'svn:eol-style']))
+        self.assertEqual(parse_propnames('<properties>\n</properties>'), set())
+        self.assertEqual(parse_propnames('<properties>'), None)
+        self.assertEqual(parse_propnames('<properties>\n<target path="a.py">\n<prop'), None)
+        self.assertEqual(parse_propnames(''), None)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
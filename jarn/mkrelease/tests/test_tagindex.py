@@ -0,0 +1,128 @@
+import unittest
+import os
+
+from os.path import join, isfile
+
+from jarn.mkrelease.tagindex import TagIndex
+from jarn.mkrelease.diskcache import get_cache_dir
+from jarn.mkrelease.diskcache import read_file
+from jarn.mkrelease.diskcache import write_file
+from jarn.mkrelease.scm import Mercurial
+from jarn.mkrelease.process import Process
+
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import MercurialSetup
+
+
+class DiskCacheTests(JailSetup):
+
+    def testCacheDir(self):
+        saved = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.tempdir
+        try:
+            self.assertEqual(get_cache_dir('tags'), join(self.tempdir, 'jarn.mkrelease', 'tags'))
+        finally:
+            if saved is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = saved
+
+    def testWriteAndRead(self):
+        filename = join(self.tempdir, 'foo', 'bar')
+        self.assertEqual(write_file(filename, 'baz\n'), True)
+        self.assertEqual(read_file(filename), 'baz\n')
+        self.assertEqual(os.listdir(join(self.tempdir, 'foo')), ['bar'])
+
+    def testReadMissing(self):
+        self.assertEqual(read_file(join(self.tempdir, 'foo')), None)
+
+    def testWriteFails(self):
+        self.mkfile('foo')
+        self.assertEqual(write_file(join(self.tempdir, 'foo', 'bar'), 'baz\n'), False)
+
+
+class TagIndexTests(JailSetup):
+
+    def testMissing(self):
+        index = TagIndex(self.tempdir)
+        self.assertEqual(index.lookup('/repo', 'stamp', '1.0'), None)
+
+    def testLookup(self):
+        index = TagIndex(self.tempdir)
+        index.store('/repo', 'stamp', ['1.0', '1.1', 'tip'])
+        self.assertEqual(index.lookup('/repo', 'stamp', '1.0'), True)
+        self.assertEqual(index.lookup('/repo', 'stamp', 'tip'), True)
+        self.assertEqual(index.lookup('/repo', 'stamp', '1.2'), False)
+        self.assertEqual(index.lookup('/repo', 'stamp', '1'), False)
+        self.assertEqual(index.lookup('/repo', 'stamp', '.0'), False)
+
+    def testStale(self):
+        index = TagIndex(self.tempdir)
+        index.store('/repo', 'stamp', ['1.0'])
+        self.assertEqual(index.lookup('/repo', 'other', '1.0'), None)
+
+    def testPerRepository(self):
+        index = TagIndex(self.tempdir)
+        index.store('/repo', 'stamp', ['1.0'])
+        self.assertEqual(index.lookup('/other', 'stamp', '1.0'), None)
+
+    def testEmpty(self):
+        index = TagIndex(self.tempdir)
+        index.store('/repo', 'stamp', [])
+        self.assertEqual(index.lookup('/repo', 'stamp', ''), False)
+        self.assertEqual(index.lookup('/repo', 'stamp', '1.0'), False)
+
+
+class MercurialTagIndexTests(MercurialSetup):
+
+    def setUp(self):
+        MercurialSetup.setUp(self)
+        self.indexdir = join(self.tempdir, 'index')
+
+    def makeScm(self):
+        scm = Mercurial()
+        scm.tagindex = TagIndex(self.indexdir)
+        return scm
+
+    def testTagDoesNotExist(self):
+        scm = self.makeScm()
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), False)
+        self.assertEqual(len(os.listdir(self.indexdir)), 1)
+
+    def testTagExists(self):
+        self.tag(self.packagedir, '2.6')
+        scm = self.makeScm()
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), True)
+        self.assertEqual(self.makeScm().tag_exists(self.packagedir, '2.6'), True)
+
+    def testIndexIsUsed(self):
+        self.makeScm().tag_exists(self.packagedir, '2.6')
+        root, stamp = Mercurial().get_tags_stamp_from_sandbox(self.packagedir)
+        TagIndex(self.indexdir).store(root, stamp, ['2.6'])
+        self.assertEqual(self.makeScm().tag_exists(self.packagedir, '2.6'), True)
+
+    def testCreateTagUpdatesIndex(self):
+        scm = self.makeScm()
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), False)
+        self.assertEqual(scm.create_tag(self.packagedir, '2.6', 'testpackage', '2.6', False), 0)
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), True)
+        self.assertEqual(self.makeScm().tag_exists(self.packagedir, '2.6'), True)
+
+    def testLocalTag(self):
+        scm = self.makeScm()
+        self.assertEqual(scm.tag_exists(self.packagedir, '2.6'), False)
+        Process(quiet=True).system(['hg', 'tag', '-l', '2.6'], cwd=self.packagedir)
+        self.assertEqual(self.makeScm().tag_exists(self.packagedir, '2.6'), True)
+
+    def testSubdirectory(self):
+        scm = Mercurial()
+        root, stamp = scm.get_tags_stamp_from_sandbox(join(self.packagedir, 'testpackage'))
+        self.assertEqual(root, self.packagedir)
+
+    def testNoRepository(self):
+        scm = Mercurial()
+        self.assertEqual(scm.get_tags_stamp_from_sandbox('/'), None)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,81 @@
+import os
+import shutil
+import unittest
+
+from os.path import join
+from multiprocessing.pool import ThreadPool
+
+from jarn.mkrelease.setuptools import Setuptools
+from jarn.mkrelease.process import Process
+from jarn.mkrelease.scm import Mercurial, Git
+
+from jarn.mkrelease.testing import MercurialSetup
+from jarn.mkrelease.testing import GitSetup
+
+SANDBOXES = 8
+THREADS = 4
+
+
+class ConcurrencyTests(object):
+    """Run SCM and setup.py operations on many sandboxes at once.
+
+    Commands get their working directory passed in; the working
+    directory of the test process must never change.
+    """
+
+    def setUp(self):
+        super(ConcurrencyTests, self).setUp()
+        self.sandboxes = []
+        for i in range(SANDBOXES):
+            dir = join(self.tempdir, 'sandbox%d' % i)
+            shutil.copytree(self.packagedir, dir)
+            if i % 2:
+                self.modify(dir)
+            self.sandboxes.append(dir)
+        self.scm = self.scmclass(Process(quiet=True))
+        self.setuptools = Setuptools(Process(quiet=True, env=Setuptools().get_env()))
+
+    def check(self, i):
+        # err_exit would kill the pool's worker thread
+        try:
+            return self._check(i)
+        except SystemExit, e:
+            return 'SystemExit(%s)' % e
+
+    def _check(self, i):
+        dir = self.sandboxes[i]
+        tagid = '%d.0' % i
+        before = self.scm.tag_exists(dir, tagid)
+        self.scm.create_tag(dir, tagid, 'testpackage', tagid, False)
+        return (self.scm.get_root_from_sandbox(dir) == dir,
+                self.scm.is_dirty_sandbox(dir),
+                before,
+                self.scm.tag_exists(dir, tagid),
+                self.scm.tag_exists(dir, '%d.0' % (i + 1)),
+                self.setuptools.get_package_info(dir))
+
+    def testConcurrentSandboxes(self):
+        cwd = os.getcwd()
+        pool = ThreadPool(THREADS)
+        try:
+            results = pool.map(self.check, range(SANDBOXES))
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(os.getcwd(), cwd)
+        for i, result in enumerate(results):
+            self.assertEqual(result, (True, bool(i % 2), False, True, False, ('testpackage', '2.6')))
+
+
+class MercurialTests(ConcurrencyTests, MercurialSetup):
+
+    scmclass = Mercurial
+
+
+class GitTests(ConcurrencyTests, GitSetup):
+
+    scmclass = Git
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
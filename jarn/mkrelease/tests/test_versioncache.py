@@ -0,0 +1,140 @@
+import unittest
+import os
+
+from os.path import join
+
+from jarn.mkrelease.versioncache import VersionCache
+from jarn.mkrelease.versioncache import find_binary
+from jarn.mkrelease.diskcache import write_file
+from jarn.mkrelease.scm import Git
+
+from jarn.mkrelease.testing import JailSetup
+from jarn.mkrelease.testing import MockProcess
+
+
+class VersionCacheSetup(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        os.mkdir('bin')
+        self.bindir = join(self.tempdir, 'bin')
+        self.cachedir = join(self.tempdir, 'cache')
+        self.mkbinary('git')
+
+    def mkbinary(self, name, body='#!/bin/sh\n'):
+        filename = join(self.bindir, name)
+        self.mkfile(filename, body)
+        os.chmod(filename, 0755)
+        return filename
+
+    def make_cache(self):
+        # Start with an empty process-wide layer
+        VersionCache.versions.clear()
+        return VersionCache(self.cachedir, self.bindir)
+
+
+class FindBinaryTests(VersionCacheSetup):
+
+    def testFound(self):
+        self.assertEqual(find_binary('git', self.bindir), join(self.bindir, 'git'))
+
+    def testNotFound(self):
+        self.assertEqual(find_binary('hg', self.bindir), None)
+
+    def testNotExecutable(self):
+        os.chmod(join(self.bindir, 'git'), 0644)
+        self.assertEqual(find_binary('git', self.bindir), None)
+
+    def testSymlink(self):
+        os.mkdir('other')
+        os.symlink(join(self.bindir, 'git'), join(self.tempdir, 'other', 'git'))
+        self.assertEqual(find_binary('git', join(self.tempdir, 'other')), join(self.bindir, 'git'))
+
+    def testPathOrder(self):
+        os.mkdir('first')
+        self.mkfile(join('first', 'git'))
+        self.assertEqual(find_binary('git', os.pathsep.join([join(self.tempdir, 'first'), self.bindir])),
+                         join(self.bindir, 'git'))
+
+
+class VersionCacheTests(VersionCacheSetup):
+
+    def testMissing(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.lookup('git'), None)
+
+    def testLookup(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.store('git', '2.39.2'), True)
+        self.assertEqual(cache.lookup('git'), '2.39.2')
+
+    def testOnDisk(self):
+        self.make_cache().store('git', '2.39.2')
+        self.assertEqual(self.make_cache().lookup('git'), '2.39.2')
+
+    def testInMemory(self):
+        cache = self.make_cache()
+        cache.store('git', '2.39.2')
+        os.remove(cache.get_filename(cache.get_key('git')))
+        self.assertEqual(VersionCache(self.cachedir, self.bindir).lookup('git'), '2.39.2')
+
+    def testChangedBinary(self):
+        self.make_cache().store('git', '2.39.2')
+        self.mkbinary('git', '#!/bin/sh\necho\n')
+        self.assertEqual(self.make_cache().lookup('git'), None)
+
+    def testChangedMtime(self):
+        self.make_cache().store('git', '2.39.2')
+        os.utime(join(self.bindir, 'git'), (0, 0))
+        self.assertEqual(self.make_cache().lookup('git'), None)
+
+    def testNoBinary(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.store('hg', '4.9.1'), False)
+        self.assertEqual(cache.lookup('hg'), None)
+
+    def testCorrupt(self):
+        cache = self.make_cache()
+        write_file(cache.get_filename(cache.get_key('git')), 'foo\n')
+        self.assertEqual(cache.lookup('git'), None)
+
+
+class SCMVersionTests(VersionCacheSetup):
+
+    def setUp(self):
+        VersionCacheSetup.setUp(self)
+        self.commands = []
+
+    def func(self, cmd):
+        self.commands.append(cmd)
+        if cmd == ['git', '--version']:
+            return 0, ['git version 2.39.2']
+
+    def make_scm(self, cache):
+        scm = Git(MockProcess(func=self.func))
+        scm.versioncache = cache
+        return scm
+
+    def testCached(self):
+        self.assertEqual(self.make_scm(self.make_cache()).version_info, (2, 39, 2))
+        self.assertEqual(self.make_scm(self.make_cache()).version_info, (2, 39, 2))
+        self.assertEqual(len(self.commands), 1)
+
+    def testNoCache(self):
+        self.assertEqual(self.make_scm(None).version_info, (2, 39, 2))
+        self.assertEqual(self.make_scm(None).version_info, (2, 39, 2))
+        self.assertEqual(len(self.commands), 2)
+
+    def testFailure(self):
+        def func(cmd):
+            self.commands.append(cmd)
+            return 1, []
+        cache = self.make_cache()
+        scm = Git(MockProcess(func=func))
+        scm.versioncache = cache
+        self.assertEqual(scm.version_info, ())
+        self.assertEqual(cache.lookup('git'), None)
+
+
+def test_suite():
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,82 @@
+import os
+
+from hashlib import sha1
+from os.path import join, realpath, isfile
+
+from diskcache import read_file, write_file
+
+
+class VersionCache(object):
+    """A persistent cache of SCM binary versions.
+
+    Entries are keyed by the resolved path, mtime, and size of the
+    binary found on 'path' (default: $PATH), so installing another
+    version invalidates them. Versions are kept in memory for the
+    rest of the process and on disk for later runs.
+
+    Install a cache by assigning it to the SCM's 'versioncache'
+    attribute.
+    """
+
+    # Shared by all instances
+    versions = {}
+
+    def __init__(self, dir, path=None):
+        self.dir = dir
+        self.path = path
+
+    def get_key(self, name):
+        """Return a (path, mtime, size) tuple for binary 'name', or
+        None if it is not on the path.
+        """
+        filename = find_binary(name, self.path)
+        if filename is None:
+            return None
+        try:
+            info = os.stat(filename)
+        except OSError:
+            return None
+        return (filename, repr(info.st_mtime), str(info.st_size))
+
+    def get_filename(self, key):
+        return join(self.dir, sha1('\n'.join(key)).hexdigest())
+
+    def lookup(self, name):
+        """Return the version string of binary 'name', or None if it
+        is not cached or the binary has changed.
+        """
+        key = self.get_key(name)
+        if key is None:
+            return None
+        version = self.versions.get(key)
+        if version is not None:
+            return version
+        data = read_file(self.get_filename(key))
+        if data is None:
+            return None
+        lines = data.split('\n')
+        if len(lines) < 4 or tuple(lines[:3]) != key or not lines[3]:
+            return None
+        self.versions[key] = lines[3]
+        return lines[3]
+
+    def store(self, name, version):
+        """Write the version of binary 'name'."""
+        key = self.get_key(name)
+        if key is None:
+            return False
+        self.versions[key] = version
+        return write_file(self.get_filename(key), '%s\n%s\n' % ('\n'.join(key), version))
+
+
+def find_binary(name, path=None):
+    """Return the resolved filename of executable 'name' on 'path',
+    or None.
+    """
+    if path is None:
+        path = os.environ.get('PATH', os.defpath)
+    for dir in path.split(os.pathsep):
+        filename = join(dir or os.curdir, name)
+        if isfile(filename) and os.access(filename, os.X_OK):
+            return realpath(filename)
+    return None